@@ -1,8 +1,6 @@
 from MythTV.logging import MythLog
 from MythTV.exceptions import MythDBError
 
-from weakref import ref
-
 import sys
 import warnings
 with warnings.catch_warnings():
@@ -30,22 +28,38 @@ class LoggedCursor( MySQLdb.cursors.Cursor ):
     """
     Custom cursor, offering logging and error handling
     """
+    _release = None
+    # error codes for a dropped server connection, and statements that
+    # can safely be replayed after reconnecting
+    _goneaway = (2006, 2013)
+    _idempotent = ('SELECT', 'SHOW', 'DESC', 'DESCRIBE', 'EXPLAIN')
+
     def __init__(self, connection):
         super(LoggedCursor, self).__init__(connection)
         self.log = None
-        self.ping = ref(self._ping121)
-        if MySQLdb.version_info >= ('1','2','2'):
-            self.ping = ref(self._ping122)
-        self.ping()
 
-    def _ping121(self): self.connection.ping(True)
-    def _ping122(self): self.connection.ping()
+    def _reconnect(self):
+        self.log(self.log.DATABASE, MythLog.INFO,
+                 'Database connection lost, reconnecting')
+        try:
+            self.connection.ping(True)
+        except TypeError:
+            # MySQLdb older than 1.2.2 does not take a reconnect flag
+            self.connection.ping()
+        self.connection.autocommit(True)
+
+    def _retry(self, e, query):
+        # only retry statements that have no side effects
+        if (not e.args) or (e.args[0] not in self._goneaway):
+            return False
+        return query.lstrip().split(None, 1)[0].upper() in self._idempotent
 
     def _sanitize(self, query): return query.replace('?', '%s')
 
     def log_query(self, query, args):
-        self.log(self.log.DATABASE, MythLog.DEBUG, 
-                 ' '.join(query.split()), str(args))
+        if self.log.isEnabledFor(self.log.DATABASE, MythLog.DEBUG):
+            self.log(self.log.DATABASE, MythLog.DEBUG,
+                     ' '.join(query.split()), str(args))
 
     def execute(self, query, args=None):
         """
@@ -60,13 +74,16 @@ class LoggedCursor( MySQLdb.cursors.Cursor ):
 
         Returns long integer rows affected, if any
         """
-        self.ping()
         query = self._sanitize(query)
         self.log_query(query, args)
         try:
-            if args is None:
-                return super(LoggedCursor, self).execute(query)
-            return super(LoggedCursor, self).execute(query, args)
+            try:
+                return super(LoggedCursor, self).execute(query, args)
+            except MySQLdb.OperationalError, e:
+                if not self._retry(e, query):
+                    raise
+                self._reconnect()
+                return super(LoggedCursor, self).execute(query, args)
         except Exception, e:
             raise MythDBError(MythDBError.DB_RAW, e.args)
 
@@ -87,14 +104,26 @@ class LoggedCursor( MySQLdb.cursors.Cursor ):
         REPLACE. Otherwise it is equivalent to looping over args with
         execute().
         """
-        self.ping()
         query = self._sanitize(query)
         self.log_query(query, args)
         try:
-            return super(LoggedCursor, self).executemany(query, args)
+            try:
+                return super(LoggedCursor, self).executemany(query, args)
+            except MySQLdb.OperationalError, e:
+                if not self._retry(e, query):
+                    raise
+                self._reconnect()
+                return super(LoggedCursor, self).executemany(query, args)
         except Exception, e:
             raise MythDBError(MythDBError.DB_RAW, e.args)
 
+    def close(self):
+        super(LoggedCursor, self).close()
+        # hand the connection back to the pool
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
     def commit(self): self.connection.commit()
     def rollback(self): self.connection.rollback()
 
@@ -106,3 +135,57 @@ class LoggedCursor( MySQLdb.cursors.Cursor ):
         else:
             self.commit()
         self.close()
+
+class LoggedSSCursor( MySQLdb.cursors.CursorUseResultMixIn, LoggedCursor ):
+    """
+    Unbuffered variant of LoggedCursor, streaming rows from the server as
+        they are fetched rather than storing the full result client-side.
+    """
+    _exhausted = True
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def execute(self, query, args=None):
+        self._exhausted = False
+        return LoggedCursor.execute(self, query, args)
+
+    def executemany(self, query, args):
+        self._exhausted = False
+        return LoggedCursor.executemany(self, query, args)
+
+    def fetchone(self):
+        row = super(LoggedSSCursor, self).fetchone()
+        if row is None:
+            self._exhausted = True
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super(LoggedSSCursor, self).fetchmany(size)
+        if len(rows) < (size or self.arraysize):
+            self._exhausted = True
+        return rows
+
+    def fetchall(self):
+        rows = super(LoggedSSCursor, self).fetchall()
+        self._exhausted = True
+        return rows
+
+    def close(self):
+        if self._exhausted:
+            LoggedCursor.close(self)
+            return
+        # reading out the remainder of an abandoned result could take
+        # as long as the query itself, so have the pool close the
+        # connection instead of reusing it
+        self._exhausted = True
+        self.connection = None
+        release, self._release = self._release, None
+        if release is not None:
+            release(True)
+
+    def __exit__(self, type, value, traceback):
+        # commit or rollback would fail with rows left unread
+        if self._exhausted:
+            return LoggedCursor.__exit__(self, type, value, traceback)
+        self.close()
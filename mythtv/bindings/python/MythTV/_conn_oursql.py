@@ -23,7 +23,8 @@ def dbconnect(dbconn, log):
                         port=   dbconn.port,
                         use_unicode=True,
                         charset='utf8',
-                        autoping=True,
+                        autoping=False,
+                        autoreconnect=True,
                         raise_on_warnings=False)
     return db
 
@@ -32,13 +33,36 @@ class LoggedCursor( oursql.Cursor ):
     Custom cursor, offering logging and error handling
     """
     log = None
+    _release = None
+    # error codes for a dropped server connection, and statements that
+    # can safely be replayed after reconnecting
+    _goneaway = (2006, 2013)
+    _idempotent = ('SELECT', 'SHOW', 'DESC', 'DESCRIBE', 'EXPLAIN')
+
+    def _reconnect(self):
+        self.log(self.log.DATABASE, MythLog.INFO,
+                 'Database connection lost, reconnecting')
+        # with autoreconnect enabled, a ping re-establishes the connection
+        self.connection.ping()
+
+    def _retry(self, e, query):
+        # only retry statements that have no side effects
+        if getattr(e, 'errno', None) not in self._goneaway:
+            return False
+        return query.lstrip().split(None, 1)[0].upper() in self._idempotent
 
     def log_query(self, query, args):
-        self.log(self.log.DATABASE, MythLog.DEBUG,
-                 ' '.join(query.split()), str(args))
+        if self.log.isEnabledFor(self.log.DATABASE, MythLog.DEBUG):
+            self.log(self.log.DATABASE, MythLog.DEBUG,
+                     ' '.join(query.split()), str(args))
 
     def _sanitize(self, query): return query.replace('%s', '?')
 
+    def _execute(self, query, args):
+        if args:
+            return super(LoggedCursor, self).execute(query, args)
+        return super(LoggedCursor, self).execute(query)
+
     def execute(self, query, args=None):
         """
         Execute a query.
@@ -51,9 +75,13 @@ class LoggedCursor( oursql.Cursor ):
         query = self._sanitize(query)
         self.log_query(query, args)
         try:
-            if args:
-                return super(LoggedCursor, self).execute(query, args)
-            return super(LoggedCursor, self).execute(query)
+            try:
+                return self._execute(query, args)
+            except oursql.OperationalError, e:
+                if not self._retry(e, query):
+                    raise
+                self._reconnect()
+                return self._execute(query, args)
         except Exception, e:
             raise MythDBError(MythDBError.DB_RAW, e.args)
 
@@ -73,10 +101,76 @@ class LoggedCursor( oursql.Cursor ):
         query = self._sanitize(query)
         self.log_query(query, args)
         try:
-            return super(LoggedCursor, self).executemany(query, args)
+            try:
+                return super(LoggedCursor, self).executemany(query, args)
+            except oursql.OperationalError, e:
+                if not self._retry(e, query):
+                    raise
+                self._reconnect()
+                return super(LoggedCursor, self).executemany(query, args)
         except Exception, e:
             raise MythDBError(MythDBError.DB_RAW, e.args)
 
+    def close(self):
+        super(LoggedCursor, self).close()
+        # hand the connection back to the pool
+        release, self._release = self._release, None
+        if release is not None:
+            release()
+
     def commit(self): self.connection.commit()
     def rollback(self): self.connection.rollback()
 
+class LoggedSSCursor( LoggedCursor ):
+    """
+    Streaming variant of LoggedCursor. oursql already reads results from
+        the server lazily, so this only tracks whether the result has been
+        read out, to decide if the connection can be reused.
+    """
+    _exhausted = True
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def execute(self, query, args=None):
+        self._exhausted = False
+        return LoggedCursor.execute(self, query, args)
+
+    def executemany(self, query, args):
+        self._exhausted = False
+        return LoggedCursor.executemany(self, query, args)
+
+    def fetchone(self):
+        row = super(LoggedSSCursor, self).fetchone()
+        if row is None:
+            self._exhausted = True
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super(LoggedSSCursor, self).fetchmany(size)
+        if len(rows) < (size or self.arraysize):
+            self._exhausted = True
+        return rows
+
+    def fetchall(self):
+        rows = super(LoggedSSCursor, self).fetchall()
+        self._exhausted = True
+        return rows
+
+    def close(self):
+        if self._exhausted:
+            LoggedCursor.close(self)
+            return
+        # reading out the remainder of an abandoned result could take
+        # as long as the query itself, so have the pool close the
+        # connection instead of reusing it
+        self._exhausted = True
+        release, self._release = self._release, None
+        if release is not None:
+            release(True)
+
+    def __exit__(self, type, value, traceback):
+        # commit or rollback would fail with rows left unread
+        if self._exhausted:
+            return LoggedCursor.__exit__(self, type, value, traceback)
+        self.close()
@@ -192,7 +192,148 @@ class DictData( OrdDict ):
     def __setstate__(self, state):
         for k,v in state.iteritems():
             self[k] = v
-        
+
+class LazyDictData( DictData ):
+    """
+    LazyDictData.__init__(raw) --> LazyDictData object
+
+    DictData variant keeping the raw input list in a tuple, and converting
+        each field on first access. _deprocess() returns the original raw
+        values for any fields that have not been modified, rather than
+        converting them back.
+
+    dict(obj) and d.update(obj) convert all remaining fields before
+        copying. Keyword expansion, f(**obj), reads the underlying storage
+        directly, and must be given dict(obj) instead.
+    """
+    _raw = None
+    _modified = None
+
+    @classmethod
+    def _getconverters(cls):
+        if '_converters' not in cls.__dict__:
+            cls._converters = [cls._trans[t] for t in cls._field_type]
+            cls._fieldindex = dict((k,i) for i,k in \
+                                            enumerate(cls._field_order))
+        return cls._converters
+
+    def __init__(self, data, _process=True):
+        dict.__init__(self)
+        self.__dict__['_modified'] = None
+        if _process and (self._field_type != 'Pass'):
+            if len(data) != len(self._field_type):
+                raise MythError('Incorrect raw input length to DictData()')
+            self._getconverters()
+            self.__dict__['_raw'] = tuple(data)
+        else:
+            self.__dict__['_raw'] = None
+            if _process:
+                data = self._process(data)
+            dict.update(self, data)
+
+    def __missing__(self, key):
+        if self._raw is None:
+            raise KeyError(key)
+        try:
+            i = self._fieldindex[key]
+        except (KeyError, TypeError):
+            raise KeyError(key)
+        value = self._raw[i]
+        if value == '':
+            value = None
+        else:
+            value = self._converters[i](value)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def _fill(self):
+        if (self._raw is not None) and \
+                (dict.__len__(self) < len(self._field_order)):
+            for key in self._field_order:
+                if not dict.__contains__(self, key):
+                    self.__missing__(key)
+
+    @property
+    def keys(self):
+        # dict(obj) and d.update(obj) look this up, and then copy the
+        # underlying storage directly, so convert everything first
+        self._fill()
+        return DictData.keys.__get__(self)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        if (self._raw is not None) and (key in self._fieldindex):
+            return True
+        return dict.__contains__(self, key)
+
+    def has_key(self, key):
+        return key in self
+
+    def __len__(self):
+        if self._raw is not None:
+            return len(self._field_order)
+        return dict.__len__(self)
+
+    def __eq__(self, other):
+        self._fill()
+        if isinstance(other, LazyDictData):
+            other._fill()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __setitem__(self, key, value):
+        DictData.__setitem__(self, key, value)
+        if self._raw is not None:
+            if self._modified is None:
+                self.__dict__['_modified'] = set()
+            self._modified.add(key)
+
+    def _deprocess(self):
+        """
+        Returns the internal data back out in the format
+            of the original raw list.
+        """
+        if self._raw is None:
+            return DictData._deprocess(self)
+        data = list(self._raw)
+        for i,v in enumerate(data):
+            key = self._field_order[i]
+            ftype = self._field_type[i]
+            if (self._modified is not None) and (key in self._modified):
+                v = dict.__getitem__(self, key)
+            elif isinstance(v, basestring):
+                continue
+            elif ftype > 3:
+                # raw values of plain types are already in converted form
+                v = self[key]
+            if v is None:
+                data[i] = ''
+            else:
+                data[i] = self._inv_trans[ftype](v)
+        return data
+
+    def copy(self):
+        """Returns a deep copy of itself."""
+        c = self.__class__(self._deprocess())
+        c.__dict__.update((k,v) for k,v in self.__dict__.items() \
+                                if k not in ('_raw', '_modified', '_enums'))
+        return c
+
+    def __getstate__(self):
+        self._fill()
+        return dict(self)
+
+    def __setstate__(self, state):
+        self.__dict__['_raw'] = None
+        self.__dict__['_modified'] = None
+        DictData.__setstate__(self, state)
 
 class DictInvert(dict):
     """
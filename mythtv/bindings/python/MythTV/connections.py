@@ -6,36 +6,85 @@ from MythTV.msearch import MSearch
 from MythTV.logging import MythLog
 from MythTV.exceptions import *
 from MythTV.altdict import OrdDict
-from MythTV.utility import deadlinesocket
+from MythTV.utility import deadlinesocket, MythFuture
 
-from time import sleep, time
-from select import select
+from time import time
+from traceback import format_exc
+from select import select, error as select_error
+from collections import deque
+from itertools import chain
 from thread import start_new_thread, allocate_lock, get_ident
+from threading import Thread, Condition, Lock, Event, current_thread
 import lxml.etree as etree
 import weakref
 import urllib2
 import socket
 import Queue
+import errno
+import fcntl
+import os
 import json
 import re
 
 try:
     import _conn_oursql as dbmodule
-    from   _conn_oursql import LoggedCursor
+    from   _conn_oursql import LoggedCursor, LoggedSSCursor
 except:
     try:
         import _conn_mysqldb as dbmodule
-        from   _conn_mysqldb import LoggedCursor
+        from   _conn_mysqldb import LoggedCursor, LoggedSSCursor
     except:
         raise MythError("No viable database module found.")
 
+class _PoolMonitor( Thread ):
+    """
+    Background thread periodically evicting idle connections and checking
+        the liveness of those remaining in a connection pool. Only a weak
+        reference to the pool is held, and the thread terminates once the
+        pool has been closed or garbage collected.
+    """
+    def __init__(self, pool, interval):
+        super(_PoolMonitor, self).__init__(name='Python Connection Pool')
+        self.daemon = True
+        self.pool = weakref.ref(pool)
+        self.interval = interval
+        self.stopped = Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.stopped.wait(self.interval)
+            pool = self.pool()
+            if (pool is None) or self.stopped.is_set():
+                break
+            try:
+                pool._check()
+            except:
+                pass
+            del pool
+
 class _Connection_Pool( object ):
     """
-    Provides a scaling connection pool to access a shared resource.
+    Provides a thread-safe, bounded connection pool to access a shared resource.
+
+    No more than 'maxsize' connections will be open at any time. Once that
+        limit is reached, acquire() will block for up to 'timeout' seconds
+        waiting for another thread to release a connection. Idle connections
+        beyond the base pool size are closed after 'idletime' seconds, and
+        idle connections are tested for liveness every 'checkinterval'
+        seconds by a background thread. Connections that have sat unused
+        for longer than 'pinginterval' seconds are tested again as they
+        are handed out, rather than pinging the server before every query.
     """
 
     _defpoolsize = 2
+    _defmaxsize = 8
+    _deftimeout = 30.0
+    _defidletime = 300.0
+    _defcheckinterval = 60.0
+    _defpinginterval = 30.0
     _logmode = MythLog.SOCKET
+    _errtype = MythDBError
+    _resource = 'database connection'
     @classmethod
     def setDefaultSize(cls, size):
         """
@@ -43,65 +92,290 @@ class _Connection_Pool( object ):
         """
         cls._defpoolsize = size
 
-    def resizePool(self, size):
+    @classmethod
+    def setDefaultMaxSize(cls, size):
+        """
+        Set the default maximum number of simultaneous connections for new
+            database connections.
+        """
+        cls._defmaxsize = size
+
+    @classmethod
+    def setDefaultTimeout(cls, timeout):
+        """
+        Set the default time to wait for a connection to be released
+            before acquire() gives up.
+        """
+        cls._deftimeout = timeout
+
+    @classmethod
+    def setDefaultPingInterval(cls, interval):
+        """
+        Set the default time a connection may sit idle in the pool before
+            it is tested for liveness on its next use.
+        """
+        cls._defpinginterval = interval
+
+    def resizePool(self, size, maxsize=None):
         """Resize the connection pool."""
         if size < 1:
             size = 1
-        diff = size - self._poolsize
-        self._poolsize = size
-
-        while diff:
-            if diff > 0:
-                self._pool.append(self._connect())
-                diff -= 1
-            else:
-                try:
-                    conn = self._pool.pop()
-                    conn.close()
-                except IndexError:
-                    key,conn = self._inuse.popitem()
-                    conn.close()
-                diff += 1
+        if maxsize is None:
+            maxsize = self._maxsize
+        maxsize = max(size, maxsize)
+
+        closing = []
+        with self._lock:
+            self._poolsize = size
+            self._maxsize = maxsize
+            # close idle connections beyond the new limit
+            while self._pool and (len(self._pool) > size):
+                conn, t = self._pool.pop(0)
+                closing.append(conn)
+            self._count -= len(closing)
+            # in-use connections beyond the limit are closed on release
+            self._lock.notify_all()
+        for conn in closing:
+            self._close(conn)
+        self._fill()
 
     def __init__(self):
         self._pool = []
         self._inuse = {}
         self._refs  = {}
         self._stack = {}
-        self._poolsize = self._defpoolsize
-
-        for i in range(self._poolsize):
-            self._pool.append(self._connect())
+        self._count = 0
+        self._lock = Condition(Lock())
+        self._poolsize = max(1, self._defpoolsize)
+        self._maxsize = max(self._poolsize, self._defmaxsize)
+        self.timeout = self._deftimeout
+        self.idletime = self._defidletime
+        self.pinginterval = self._defpinginterval
+        self._stats = {'acquired':0, 'connected':0, 'closed':0,
+                       'waits':0, 'waittime':0.0, 'maxwait':0.0,
+                       'timeouts':0, 'evicted':0, 'failedchecks':0,
+                       'pings':0, 'peakinuse':0}
+
+        self._fill()
+
+        self._monitor = _PoolMonitor(self, self._defcheckinterval)
+        self._monitor.start()
 
     def __del__(self):
-        for conn in self._pool:
-            conn.close()
-        for id,conn in self._inuse.items():
+        self.close()
+
+    def close(self):
+        """Close all connections and stop the background monitor."""
+        try:
+            self._monitor.stopped.set()
+        except AttributeError:
+            pass
+        with self._lock:
+            conns = [conn for conn,t in self._pool] + self._inuse.values()
+            self._pool = []
+            self._inuse = {}
+            self._count = 0
+            self._lock.notify_all()
+        for conn in conns:
+            self._close(conn)
+
+    def _fill(self):
+        """Open connections until the base pool size is reached."""
+        while True:
+            with self._lock:
+                if self._count >= self._poolsize:
+                    return
+                self._count += 1
+            try:
+                conn = self._connect()
+            except:
+                with self._lock:
+                    self._count -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self._stats['connected'] += 1
+                self._pool.append((conn, time()))
+                self._lock.notify()
+
+    def _close(self, conn):
+        try:
             conn.close()
+        except:
+            pass
+        with self._lock:
+            self._stats['closed'] += 1
 
-    def acquire(self):
+    def _ping(self, conn):
+        with self._lock:
+            self._stats['pings'] += 1
+        try:
+            conn.ping()
+        except:
+            return False
+        return True
+
+    def _check(self):
         """
-        Acquire one connection from the pool,
-            or open a new one if none are available.
+        Close connections that have been idle longer than allowed, and
+            test the remaining idle connections for liveness.
         """
+        now = time()
+        evict = []
+        with self._lock:
+            # oldest connections are at the front of the list
+            while (len(self._pool) > self._poolsize) and \
+                    (now - self._pool[0][1] > self.idletime):
+                evict.append(self._pool.pop(0)[0])
+            self._count -= len(evict)
+            self._stats['evicted'] += len(evict)
+            # pull remaining idle connections out of the pool for testing
+            # they remain counted in the total to hold their slots
+            testing, self._pool = self._pool, []
+            if evict:
+                self._lock.notify_all()
+
+        for conn in evict:
+            self.log(self._logmode, MythLog.DEBUG,
+                        'Closing idle connection from pool')
+            self._close(conn)
+
+        alive = []
+        for conn, t in testing:
+            if self._ping(conn):
+                alive.append((conn, t))
+            else:
+                self.log(self._logmode, MythLog.INFO,
+                        'Discarding dead connection from pool')
+                self._close(conn)
+                with self._lock:
+                    self._count -= 1
+                    self._stats['failedchecks'] += 1
+                    self._lock.notify()
+
+        with self._lock:
+            # return live connections, preserving their idle order
+            self._pool = alive + self._pool
+            self._pool.sort(key=lambda x: x[1])
+            self._lock.notify_all()
+
+        # replace any connections lost below the base pool size
         try:
-            conn = self._pool.pop(0)
-            self._inuse[id(conn)] = conn
+            self._fill()
+        except:
+            pass
+
+    def acquire(self, timeout=None):
+        """
+        Acquire one connection from the pool, opening a new one if none
+            are available and the pool has not reached its maximum size.
+            Otherwise, block until a connection is released, raising
+            MythDBError once 'timeout' seconds have elapsed.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        start = time()
+        conn = None
+        lastuse = start
+        with self._lock:
+            while True:
+                if self._pool:
+                    # use the most recently released connection, allowing
+                    # the least used ones to age out
+                    conn, lastuse = self._pool.pop()
+                    break
+                if self._count < self._maxsize:
+                    # reserve a slot for a new connection
+                    self._count += 1
+                    break
+                remaining = start + timeout - time()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    self.log(self._logmode, MythLog.ERR,
+                        'Timed out waiting for connection from pool',
+                        '%d connections in use' % len(self._inuse))
+                    raise self._errtype('Timed out waiting for a free '+\
+                                        self._resource)
+                self._lock.wait(remaining)
+
+            wait = time() - start
+            if wait > 0.001:
+                self._stats['waits'] += 1
+                self._stats['waittime'] += wait
+                self._stats['maxwait'] = max(self._stats['maxwait'], wait)
+
+        if (conn is not None) and (time() - lastuse > self.pinginterval):
+            # the server may have dropped a connection left idle this long
+            if not self._ping(conn):
+                self.log(self._logmode, MythLog.INFO,
+                        'Discarding dead connection from pool')
+                self._close(conn)
+                with self._lock:
+                    self._stats['failedchecks'] += 1
+                # reuse the slot of the dead connection for a new one
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except:
+                with self._lock:
+                    self._count -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self._stats['connected'] += 1
+            self.log(self._logmode, MythLog.DEBUG,
+                        'Opened new connection for pool')
+        else:
             self.log(self._logmode, MythLog.DEBUG,
                         'Acquiring connection from pool')
-        except IndexError:
-            conn = self._connect()
+
+        with self._lock:
+            self._inuse[id(conn)] = conn
+            self._stats['acquired'] += 1
+            self._stats['peakinuse'] = max(self._stats['peakinuse'],
+                                           len(self._inuse))
         return conn
 
-    def release(self, id):
+    def release(self, id, discard=False):
         """
-        Release a connection back to the pool to allow reuse.
+        Release a connection back to the pool to allow reuse, or close it
+            if 'discard' is set because it was left in an unusable state.
         """
-        conn = self._inuse.pop(id)
-        self._pool.append(conn)
+        with self._lock:
+            conn = self._inuse.pop(id, None)
+            if conn is None:
+                return
+            if discard or (self._count > self._maxsize):
+                # pool has been shrunk while connection was in use
+                self._count -= 1
+            else:
+                self._pool.append((conn, time()))
+                conn = None
+            self._lock.notify()
+        if conn is not None:
+            self._close(conn)
         self.log(self._logmode, MythLog.DEBUG,
                     'Releasing connection to pool')
 
+    def getPoolStats(self):
+        """
+        Return a dictionary of pool occupancy and usage counters.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._pool)
+            stats['inuse'] = len(self._inuse)
+            stats['open'] = self._count
+            stats['size'] = self._poolsize
+            stats['maxsize'] = self._maxsize
+        if stats['waits']:
+            stats['avgwait'] = stats['waittime']/stats['waits']
+        else:
+            stats['avgwait'] = 0.0
+        return stats
+
 class DBConnection( _Connection_Pool ):
     """
     This is the basic database connection object.
@@ -117,6 +391,7 @@ class DBConnection( _Connection_Pool ):
         self.log = MythLog('Python Database Connection')
         self.tablefields = None
         self.settings = None
+        self.lookups = None
         self.dbconn = dbconn
         self._refs = {}
 
@@ -137,22 +412,40 @@ class DBConnection( _Connection_Pool ):
         if log is None:
             log = self.log
         conn = self.acquire()
-        cursor = conn.cursor(type)
+        try:
+            cursor = conn.cursor(type)
+        except:
+            self.release(id(conn))
+            raise
         cursor.log = log
 
         r = weakref.ref(cursor, self._callback)
-        self._refs[id(r)] = (r, id(conn))
+        refid = id(r)
+        with self._lock:
+            # a streaming cursor dereferenced without being closed may
+            # have left unread rows on its connection
+            self._refs[refid] = (r, id(conn), issubclass(type, LoggedSSCursor))
+        # return the connection as soon as the cursor is closed, falling
+        # back to the weakref callback if it is simply dereferenced
+        cursor._release = lambda discard=False: \
+                                self._releaseref(refid, discard)
 
         return cursor
 
     def _callback(self, ref):
-        self.log(MythLog.DATABASE, MythLog.DEBUG, \
-                    'database callback received',\
-                     str(hex(id(ref))))
-        refid = id(ref)
-        ref, connid = self._refs.pop(refid)
-        if connid in self._inuse:
-            self.release(connid)
+        if self.log.isEnabledFor(MythLog.DATABASE, MythLog.DEBUG):
+            self.log(MythLog.DATABASE, MythLog.DEBUG, \
+                        'database callback received',\
+                         str(hex(id(ref))))
+        self._releaseref(id(ref), None)
+
+    def _releaseref(self, refid, discard=False):
+        with self._lock:
+            ref = self._refs.pop(refid, None)
+        if ref is not None:
+            if discard is None:
+                discard = ref[2]
+            self.release(ref[1], discard)
 
     def __enter__(self):
         cursor = self.cursor()
@@ -185,6 +478,7 @@ class BEConnection( object ):
         self.connected = False
         self.log = MythLog(self.logmodule)
         self._socklock = allocate_lock()
+        self._streaming = None
 
         self.host = backend
         self.port = port
@@ -288,6 +582,10 @@ class BEConnection( object ):
         if deadline < 1000:
             deadline += time()
 
+        # a command issued while iterating a response stream on this thread
+        # would wait on the socket lock forever, buffer the stream first
+        self._detachstream()
+
         try:
             # lock socket access
             with self._socklock:
@@ -316,6 +614,71 @@ class BEConnection( object ):
             else:
                 raise
 
+    def backendCommandStream(self, data, deadline=None):
+        """
+        obj.backendCommandStream(data, deadline=None) -> field iterator
+
+        Sends a formatted command, yielding the BACKEND_SEP delimited fields
+            of the response as they are received. The socket is held until
+            the iterator is exhausted or closed, and any unread remainder
+            of the response is discarded. Should the iterating thread issue
+            another command on this connection, the remainder is read into
+            memory and the socket released first.
+        """
+
+        # return if not connected
+        if not self.connected:
+            return
+
+        # pull default timeout
+        if deadline is None:
+            deadline = self.socket.getdeadline()
+        if deadline < 1000:
+            deadline += time()
+
+        self._detachstream()
+        self._socklock.acquire()
+        held = [True]
+        fields = iter(())
+        try:
+            self.socket.sendheader(data)
+            t = time()
+            timeout = (deadline-t) if (deadline-t>0) else 0.0
+            if len(select([self.socket],[],[], timeout)[0]) == 0:
+                return
+            fields = self.socket.recvheaderfields(BACKEND_SEP,
+                                                  deadline=deadline)
+            buffered = []
+            def detach():
+                self._streaming = None
+                held[0] = False
+                try:
+                    buffered.extend(fields)
+                finally:
+                    self._socklock.release()
+            self._streaming = (get_ident(), detach)
+
+            for field in chain(fields, buffered):
+                try:
+                    yield unicode(field, 'utf8')
+                except UnicodeDecodeError:
+                    yield field
+        finally:
+            if held[0]:
+                self._streaming = None
+                # keep the socket usable if the caller stops early
+                try:
+                    for field in fields:
+                        pass
+                except MythError:
+                    pass
+                self._socklock.release()
+
+    def _detachstream(self):
+        streaming = self._streaming
+        if (streaming is not None) and (streaming[0] == get_ident()):
+            streaming[1]()
+
     def blockShutdown(self):
         if not self.blockshutdown:
             self.backendCommand('BLOCK_SHUTDOWN')
@@ -326,31 +689,297 @@ class BEConnection( object ):
             self.backendCommand('ALLOW_SHUTDOWN')
             self.blockshutdown = False
 
+class EventBuffer( object ):
+    """
+    EventBuffer(maxsize=1024, policy=DROP_OLDEST, replaysize=256)
+
+    Bounded queue of backend events, sitting between the socket reader and
+        the event handlers. Once 'maxsize' events are pending, 'policy'
+        decides what happens to new arrivals:
+            DROP_OLDEST -- discard the oldest pending event
+            COALESCE    -- replace a pending event with the same key, such as
+                           an earlier UPDATE_FILE_SIZE for the same recording,
+                           otherwise discard the oldest
+            BLOCK       -- stall the reader until a handler catches up
+        The last 'replaysize' events received are kept regardless of policy,
+        and can be retrieved with replay().
+    """
+    DROP_OLDEST = 0
+    COALESCE    = 1
+    BLOCK       = 2
+
+    # events carrying a running value, where only the latest is of interest,
+    # mapped to the number of trailing words and trailing fields holding it
+    _coalescable = {'UPDATE_FILE_SIZE':(1,0), 'DOWNLOAD_FILE UPDATE':(0,2)}
+
+    def __init__(self, maxsize=1024, policy=DROP_OLDEST, replaysize=256):
+        self.maxsize = maxsize
+        self.policy = policy
+        self._queue = deque()
+        self._pending = {}
+        self._history = deque(maxlen=replaysize)
+        self._cond = Condition()
+        self._closed = False
+        self._seq = 0
+        self._stats = {'received':0, 'dropped':0, 'coalesced':0,
+                       'blocked':0, 'peak':0}
+
+    def configure(self, maxsize=None, policy=None, replaysize=None):
+        """
+        obj.configure(maxsize=None, policy=None, replaysize=None) -> None
+
+        Changes the buffer settings. Arguments left as None are unchanged.
+        """
+        with self._cond:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if policy is not None:
+                if policy != self.COALESCE:
+                    self._pending.clear()
+                elif self.policy != self.COALESCE:
+                    for entry in self._queue:
+                        self._pending[self._key(entry[2])] = entry
+                self.policy = policy
+            if replaysize is not None:
+                self._history = deque(self._history, maxlen=replaysize)
+            self._cond.notify_all()
+
+    def _key(self, event):
+        parts = event.split(BACKEND_SEP)
+        if len(parts) > 1:
+            for name, (words, fields) in self._coalescable.items():
+                if (parts[1] == name) or parts[1].startswith(name+' '):
+                    msg = parts[1]
+                    if words:
+                        msg = msg.rsplit(' ', words)[0]
+                    return (msg,)+tuple(parts[2:len(parts)-fields])
+        return event
+
+    def put(self, event):
+        """
+        obj.put(event) -> sequence number
+
+        Adds an event to the buffer, applying the overflow policy.
+        """
+        with self._cond:
+            self._seq += 1
+            now = time()
+            self._history.append((self._seq, now, event))
+            self._stats['received'] += 1
+
+            key = None
+            if self.policy == self.COALESCE:
+                key = self._key(event)
+                entry = self._pending.get(key)
+                if entry is not None:
+                    # keep the place in the queue, take the newer value
+                    entry[0] = self._seq
+                    entry[2] = event
+                    self._stats['coalesced'] += 1
+                    return self._seq
+
+            while len(self._queue) >= self.maxsize:
+                if (self.policy == self.BLOCK) and not self._closed:
+                    self._stats['blocked'] += 1
+                    self._cond.wait(1.0)
+                    continue
+                old = self._queue.popleft()
+                if self._pending.get(old[3]) is old:
+                    del self._pending[old[3]]
+                self._stats['dropped'] += 1
+
+            entry = [self._seq, now, event, key]
+            self._queue.append(entry)
+            if key is not None:
+                self._pending[key] = entry
+            if len(self._queue) > self._stats['peak']:
+                self._stats['peak'] = len(self._queue)
+            self._cond.notify_all()
+            return self._seq
+
+    def getentry(self, block=True, timeout=None):
+        """
+        obj.getentry(block=True, timeout=None) -> (seq, received, event)
+
+        Removes and returns the oldest pending event, along with its
+            sequence number and time of receipt. Raises Queue.Empty if
+            nothing arrives in time, or the buffer has been closed.
+        """
+        with self._cond:
+            if block and (timeout is not None):
+                deadline = time()+timeout
+            while not len(self._queue):
+                if (not block) or self._closed:
+                    raise Queue.Empty
+                if timeout is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline-time()
+                    if remaining <= 0:
+                        raise Queue.Empty
+                    self._cond.wait(remaining)
+            entry = self._queue.popleft()
+            if self._pending.get(entry[3]) is entry:
+                del self._pending[entry[3]]
+            self._cond.notify_all()
+            return tuple(entry[:3])
+
+    def get(self, block=True, timeout=None):
+        return self.getentry(block, timeout)[2]
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        return len(self._queue)
+
+    def empty(self):
+        return not len(self._queue)
+
+    def close(self):
+        """
+        Wakes any waiting readers and writers. Pending events can still
+            be retrieved, after which getentry() raises Queue.Empty.
+        """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self):
+        with self._cond:
+            self._closed = False
+
+    def lastSequence(self):
+        """
+        obj.lastSequence() -> int
+
+        Returns the sequence number of the most recently received event.
+        """
+        return self._seq
+
+    def replay(self, since=None, window=None):
+        """
+        obj.replay(since=None, window=None) -> list of (seq, received, event)
+
+        Returns events still held in the replay window, received after
+            sequence number 'since', and within the last 'window' seconds.
+        """
+        with self._cond:
+            history = list(self._history)
+        if since is not None:
+            history = [h for h in history if h[0] > since]
+        if window is not None:
+            start = time()-window
+            history = [h for h in history if h[1] >= start]
+        return history
+
+    def getStats(self):
+        """
+        obj.getStats() -> dict
+
+        Returns counters of received, dropped, coalesced events, the number
+            of times the reader was stalled, and current and peak depth.
+        """
+        with self._cond:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._queue)
+            stats['lastseq'] = self._seq
+            return stats
+
 class BEEventConnection( BEConnection ):
     """
     This is the basic event listener object.
     You probably don't want to use this directly.
+
+    Events are read by a thread blocking in select() on the socket, and
+        placed in a bounded EventBuffer. Separate dispatch threads take
+        events from the buffer and pass them through a table keyed on the
+        event name, so each event is only tested against handlers that
+        could match it, and a slow handler does not hold up reading of the
+        socket. By default a single dispatch thread is used, preserving
+        event order.
     """
     logmodule = 'Python Event Connection'
+    _defhandlerthreads = 0
+    _defbuffer = (1024, EventBuffer.DROP_OLDEST, 256)
+    _idletime = 30.0
+    _retrymin = 1.0
+    _retrymax = 60.0
+    _evprefix = 'BACKEND_MESSAGE'+BACKEND_SEP
+
+    @classmethod
+    def setDefaultHandlerThreads(cls, count):
+        """
+        Set the number of threads used to run event handlers for new
+            event connections. Events are handled in order by a single
+            thread when this is 0 or 1.
+        """
+        cls._defhandlerthreads = count
+
+    @classmethod
+    def setDefaultEventBuffer(cls, maxsize=1024,
+                              policy=EventBuffer.DROP_OLDEST, replaysize=256):
+        """
+        Set the size, overflow policy, and replay window of the event
+            buffer for new event connections. See EventBuffer.
+        """
+        cls._defbuffer = (maxsize, policy, replaysize)
 
     def __init__(self, backend, port, localname=None, deadline=10.0, level=2):
         self._regevents = weakref.WeakValueDictionary()
         self._announced = False
+        self._lost = False
         self._eventlevel = level
 
         self.hostname = ""
         self.threadrunning = False
-        self.eventqueue = Queue.Queue()
+        self.eventqueue = EventBuffer(*self._defbuffer)
+
+        self._regversion = 0
+        self._dispatch = None
+        self._wakeup = os.pipe()
+        for fd in self._wakeup:
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.handlerthreads = self._defhandlerthreads
+        self._dispatchgen = 0
+        self._dispatchers = []
+        self._handlerstats = {}
+        self._replayskip = {}
+        self._statslock = Lock()
 
         super(BEEventConnection, self).__init__(backend, port, localname, 
                                                 False, deadline)
 
+    def __del__(self):
+        super(BEEventConnection, self).__del__()
+        for fd in self._wakeup:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
     def connect(self):
         if self.connected:
             return
+        self._announced = False
         super(BEEventConnection, self).connect()
         if len(self._regevents) and (not self.threadrunning):
-            start_new_thread(self.eventloop, ())
+            self._startloop()
+
+    def disconnect(self, hard=False):
+        # an explicit disconnect also stops any pending reconnect attempts
+        self._lost = False
+        super(BEEventConnection, self).disconnect(hard)
+        self._announced = False
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup[1], '\0')
+        except OSError:
+            # pipe full, a wakeup is already pending
+            pass
 
     def announce(self):
         # set event level, 3=system only, 2=generic only, 1=both, 0=none
@@ -377,6 +1006,7 @@ class BEEventConnection( BEConnection ):
         if not self.connected:
             return
 
+        closed = False
         try:
             with self._socklock:
                 while True:
@@ -395,50 +1025,813 @@ class BEEventConnection( BEConnection ):
                     # else discard
 
         except MythError, e:
-            if e.sockcode == 54:
-                # remote has closed connection, attempt reconnect
-                self.reconnect(True, True)
-                return self.backendCommand(data, deadline)
-            else:
+            if e.sockcode != 54:
                 raise
+            closed = True
+        if closed:
+            # remote has closed connection, attempt reconnect
+            self.reconnect(True)
  
     def registeruser(self, uuid, opts):
         self._regusers[uuid] = opts
 
-    def registerevent(self, regex, function):
+    def registerevent(self, regex, function, since=None):
+        """
+        obj.registerevent(regex, function, since=None) -> None
+
+        Calls 'function' with each event matching 'regex'. If 'since' is
+            given, events after that sequence number still held in the
+            replay window are first passed to 'function' from the calling
+            thread, before this returns. Older events still waiting in the
+            buffer are delivered by the dispatch threads as usual.
+        """
+        with self._statslock:
+            stats = self._handlerstats.get(regex)
+            if stats is None:
+                stats = {'handler':getattr(function, '__name__',
+                                           repr(function)),
+                         'handled':0, 'errors':0, 'lastseq':0,
+                         'lastlag':0.0, 'maxlag':0.0, 'totallag':0.0,
+                         'replayed':0}
+                self._handlerstats[regex] = stats
+            history = []
+            if since is not None:
+                # the dispatch threads skip the events replayed below,
+                # anything older still pending is left for them to deliver
+                history = [h for h in self.eventqueue.replay(since)
+                                if (h[0] > stats['replayed']) and \
+                                    regex.match(h[2])]
+                if history:
+                    stats['replayed'] = history[-1][0]
+                    self._replayskip.setdefault(regex, set())\
+                                    .update(h[0] for h in history)
         self._regevents[regex] = function
+        self._regversion += 1
+
+        for seq, received, event in history:
+            self._runhandler(regex, function, seq, received, event)
+
         if (not self.threadrunning) and \
            (self._eventlevel):
-                start_new_thread(self.eventloop, ())
+                self._startloop()
+
+    def _startloop(self):
+        self.threadrunning = True
+        # dispatch threads of a previous loop exit once the closed buffer
+        # is drained, wait for them so they do not take the new events
+        for t in self._dispatchers:
+            if t is not current_thread():
+                t.join()
+        self.eventqueue.reopen()
+        gen = self._dispatchgen
+        self._dispatchers = []
+        for i in range(max(1, self.handlerthreads)):
+            t = Thread(target=self._dispatchloop, args=(gen,),
+                       name='Python Event Handler')
+            t.daemon = True
+            t.start()
+            self._dispatchers.append(t)
+        start_new_thread(self.eventloop, ())
+
+    @staticmethod
+    def _hasalternation(pattern):
+        """Return True if the pattern has a '|' outside of any group."""
+        depth = 0
+        inclass = False
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            if c == '\\':
+                i += 2
+                continue
+            if inclass:
+                if c == ']':
+                    inclass = False
+            elif c == '[':
+                inclass = True
+                # a leading ']' or '^]' is a literal member of the class
+                if pattern[i+1:i+2] == '^':
+                    i += 1
+                if pattern[i+1:i+2] == ']':
+                    i += 1
+            elif c == '(':
+                depth += 1
+            elif c == ')':
+                depth -= 1
+            elif (c == '|') and (depth == 0):
+                return True
+            i += 1
+        return False
+
+    @staticmethod
+    def _eventname(pattern):
+        """
+        Return the event name a pattern is restricted to, or None if it
+            can match events of any name.
+        """
+        if BEEventConnection._hasalternation(pattern):
+            return None
+        literal = []
+        i = 0
+        while i < len(pattern):
+            c = pattern[i]
+            if c == '\\':
+                if (i+1 < len(pattern)) and not pattern[i+1].isalnum():
+                    literal.append(pattern[i+1])
+                    i += 2
+                    continue
+                break
+            if c in '.^$*+?{}[]|()':
+                if literal and (c in '*?{'):
+                    # quantifier applies to the preceding character
+                    literal.pop()
+                break
+            literal.append(c)
+            i += 1
+        literal = ''.join(literal)
+
+        prefix = BEEventConnection._evprefix
+        if not literal.startswith(prefix):
+            return None
+        literal = literal[len(prefix):]
+        # name must be terminated within the literal portion
+        for i,c in enumerate(literal):
+            if (c == ' ') or literal.startswith(BACKEND_SEP, i):
+                return literal[:i] if i else None
+        return None
+
+    def _getdispatch(self):
+        # rebuild when handlers are added, or have been garbage collected
+        state = (self._regversion, len(self._regevents))
+        if (self._dispatch is None) or (self._dispatch[0] != state):
+            table = {}
+            wildcard = []
+            for regex in self._regevents.keys():
+                name = None
+                if not (regex.flags & re.IGNORECASE):
+                    name = self._eventname(regex.pattern)
+                if name is None:
+                    wildcard.append(regex)
+                else:
+                    table.setdefault(name, []).append(regex)
+            self._dispatch = (state, table, wildcard)
+            with self._statslock:
+                for regex in self._handlerstats.keys():
+                    if regex not in self._regevents:
+                        del self._handlerstats[regex]
+                        self._replayskip.pop(regex, None)
+        return self._dispatch[1:]
+
+    def _handlers(self, event):
+        table, wildcard = self._getdispatch()
+        body = event[len(self._evprefix):]
+        end = len(body)
+        for sep in (' ', BACKEND_SEP):
+            i = body.find(sep)
+            if -1 < i < end:
+                end = i
+        for regex in table.get(body[:end], []) + wildcard:
+            if regex.match(event):
+                func = self._regevents.get(regex)
+                if func is not None:
+                    yield regex, func
+
+    def _runhandler(self, regex, func, seq, received, event):
+        start = time()
+        failed = False
+        try:
+            func(event)
+        except KeyboardInterrupt:
+            raise
+        except EOFError:
+            raise
+        except:
+            failed = True
+            self.log(MythLog.SOCKET, MythLog.ERR,
+                     "Event handler '%s' failed" % \
+                            getattr(func, '__name__', repr(func)),
+                     format_exc())
+
+        lag = start-received
+        with self._statslock:
+            stats = self._handlerstats.get(regex)
+            if stats is None:
+                return
+            stats['handled'] += 1
+            stats['errors'] += failed
+            stats['lastseq'] = max(stats['lastseq'], seq)
+            stats['lastlag'] = lag
+            stats['totallag'] += lag
+            if lag > stats['maxlag']:
+                stats['maxlag'] = lag
+
+    def _dispatchevent(self, seq, received, event):
+        for regex, func in self._handlers(event):
+            with self._statslock:
+                skip = self._replayskip.get(regex)
+                if skip and (seq in skip):
+                    # already delivered by registerevent()
+                    skip.discard(seq)
+                    continue
+            self._runhandler(regex, func, seq, received, event)
+
+    def _dispatchloop(self, gen):
+        while True:
+            try:
+                entry = self.eventqueue.getentry(timeout=self._idletime)
+            except Queue.Empty:
+                if gen != self._dispatchgen:
+                    break
+                continue
+            self._dispatchevent(*entry)
+            # do not keep a collected handler's owner alive while idle
+            entry = None
+
+    def getEventStats(self):
+        """
+        obj.getEventStats() -> dict
+
+        Returns event buffer counters under the 'buffer' key, and per
+            handler counts and lag, the time from receipt of an event to
+            the start of its handler, keyed by handler pattern.
+        """
+        handlers = {}
+        with self._statslock:
+            for regex, stats in self._handlerstats.items():
+                stats = dict(stats)
+                stats['meanlag'] = stats.pop('totallag')/max(1,
+                                                    stats['handled'])
+                handlers[regex.pattern] = stats
+        return {'buffer':self.eventqueue.getStats(), 'handlers':handlers}
 
     def eventloop(self):
         self.threadrunning = True
-        while (len(self._regevents) > 0) and self.connected:
-            self.queueEvents()
-            while True:
+        retry = self._retrymin
+        try:
+            while len(self._regevents) > 0:
+                if not self.connected:
+                    if not self._lost:
+                        break
+                    try:
+                        self.connect()
+                    except (MythError, socket.error), e:
+                        self.log(MythLog.SOCKET, MythLog.ERR,
+                                 "Event connection lost, retrying in %ds" \
+                                        % retry, str(e))
+                        self._droplost()
+                        self._sleep(retry)
+                        retry = min(2*retry, self._retrymax)
+                        continue
+                    self._lost = False
+                    retry = self._retrymin
+
+                # block until the backend sends something, or we are woken
                 try:
-                    event = self.eventqueue.get_nowait()
-                    for r,f in self._regevents.items():
-                        # check for matches against registered handlers
-                        if r.match(event):
-                            try:
-                                f(event)
-                            except KeyboardInterrupt:
-                                raise
-                            except EOFError:
-                                raise
-                            except:
-                                pass
-                except Queue.Empty:
+                    ready = select([self.socket, self._wakeup[0]], [], [],
+                                   self._idletime)[0]
+                except (select_error, socket.error, ValueError), e:
+                    # socket closed from under us by disconnect()
+                    if e.args and (e.args[0] == errno.EINTR):
+                        continue
                     break
-            sleep(0.1)
-        self.threadrunning = False
+                if self._wakeup[0] in ready:
+                    try:
+                        while os.read(self._wakeup[0], 4096):
+                            pass
+                    except OSError:
+                        pass
+                if self.socket in ready:
+                    try:
+                        self.queueEvents()
+                    except (MythError, socket.error), e:
+                        self.log(MythLog.SOCKET, MythLog.ERR,
+                                 "Event connection failed", str(e))
+                        self._droplost()
+        finally:
+            # dispatch threads exit once the buffer is drained
+            self._dispatchgen += 1
+            self.eventqueue.close()
+            self.threadrunning = False
+
+    def _droplost(self):
+        # close a failed connection, leaving eventloop() to reconnect
+        try:
+            self.disconnect(True)
+        except socket.error:
+            pass
+        self._lost = True
+
+    def _sleep(self, delay):
+        # wait out a reconnect delay, returning early if woken
+        try:
+            if select([self._wakeup[0]], [], [], delay)[0]:
+                while os.read(self._wakeup[0], 4096):
+                    pass
+        except (select_error, OSError):
+            pass
 
     def backendCommand(self, data, deadline=None):
         if self._announced:
             return ""
         return super(BEEventConnection, self).backendCommand(data, deadline)
 
+class BECommandPool( _Connection_Pool ):
+    """
+    Pool of announced backend command connections, allowing commands from
+        several threads to be in flight at once. Each command is sent on an
+        idle socket, and the maximum pool size caps the number of
+        concurrent commands against the backend. Latency is recorded per
+        command name.
+    """
+    logmodule = 'Python Backend Connection'
+    _logmode = MythLog.SOCKET|MythLog.NETWORK
+    _errtype = MythBEError
+    _resource = 'backend connection'
+    _defpoolsize = 1
+    _defmaxsize = 4
+    _deftimeout = 10.0
+
+    def __init__(self, backend, port, localname=None, maxsize=None):
+        self.log = MythLog(self.logmodule)
+        self.host = backend
+        self.port = port
+        self.localname = localname
+        self._cmdstats = {}
+        _Connection_Pool.__init__(self)
+        if maxsize is not None:
+            self.resizePool(self._poolsize, maxsize)
+
+    def _connect(self):
+        return BEConnection(self.host, self.port, self.localname)
+
+    def _close(self, conn):
+        try:
+            conn.disconnect()
+        except:
+            pass
+        with self._lock:
+            self._stats['closed'] += 1
+
+    def _ping(self, conn):
+        with self._lock:
+            self._stats['pings'] += 1
+        try:
+            return conn.backendCommand('QUERY_HOSTNAME') != u''
+        except:
+            return False
+
+    def backendCommand(self, data, deadline=None):
+        """
+        obj.backendCommand(data, deadline=None) -> response string
+
+        Sends a command on an idle pooled connection, waiting for one to
+            become available if the concurrency limit has been reached.
+        """
+        conn = self.acquire()
+        start = time()
+        failed = True
+        try:
+            res = conn.backendCommand(data, deadline)
+            # an empty response may be a timeout, with the reply to follow
+            failed = (res == u'')
+            return res
+        finally:
+            self._record(data, time()-start, failed)
+            # do not reuse a connection that may have a reply pending
+            self.release(id(conn), failed)
+
+    def backendCommandStream(self, data, deadline=None):
+        """
+        obj.backendCommandStream(data, deadline=None) -> field iterator
+
+        Streams a response on a pooled connection, holding it until the
+            iterator is exhausted or closed.
+        """
+        conn = self.acquire()
+        start = time()
+        failed = True
+        fields = conn.backendCommandStream(data, deadline)
+        try:
+            for field in fields:
+                yield field
+            failed = False
+        except GeneratorExit:
+            failed = False
+            raise
+        finally:
+            fields.close()
+            self._record(data, time()-start, failed)
+            self.release(id(conn), failed)
+
+    def _record(self, data, elapsed, failed):
+        name = data.split(BACKEND_SEP, 1)[0].split(' ', 1)[0]
+        with self._lock:
+            stats = self._cmdstats.get(name)
+            if stats is None:
+                stats = self._cmdstats[name] = \
+                        {'count':0, 'errors':0, 'total':0.0, 'max':0.0}
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            if failed:
+                stats['errors'] += 1
+
+    def getCommandStats(self):
+        """
+        Return a dictionary of latency counters keyed by command name.
+        """
+        with self._lock:
+            stats = dict((k, dict(v)) for k,v in self._cmdstats.items())
+        for v in stats.values():
+            v['avg'] = v['total']/v['count']
+        return stats
+
+class AsyncLoop( object ):
+    """
+    Single threaded select() reactor driving any number of asynchronous
+        backend connections. Use start() to run it in a background thread,
+        or run() and runUntil() to drive it from the calling thread. Work
+        from other threads is handed to the loop with call(), which wakes
+        it through a pipe rather than polling.
+    """
+    _default = None
+    _deflock = allocate_lock()
+
+    @classmethod
+    def default(cls):
+        """Return a shared loop running in a background thread."""
+        with cls._deflock:
+            if cls._default is None:
+                cls._default = cls()
+                cls._default.start()
+            return cls._default
+
+    def __init__(self):
+        self.log = MythLog('Python Async Loop')
+        self._handlers = []
+        self._calls = deque()
+        self._rpipe, self._wpipe = os.pipe()
+        for fd in (self._rpipe, self._wpipe):
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self._ident = None
+        self._stopped = False
+
+    def inLoop(self):
+        return self._ident == get_ident()
+
+    def call(self, func, *args):
+        """Schedule func(*args) to be run on the loop thread."""
+        self._calls.append((func, args))
+        if not self.inLoop():
+            try:
+                os.write(self._wpipe, '\0')
+            except OSError:
+                # pipe full, the loop already has a wakeup pending
+                pass
+
+    def register(self, handler):
+        if handler not in self._handlers:
+            self._handlers.append(handler)
+
+    def unregister(self, handler):
+        if handler in self._handlers:
+            self._handlers.remove(handler)
+
+    def _runonce(self, timeout):
+        if self._calls:
+            timeout = 0.0
+        now = time()
+        for h in self._handlers:
+            deadline = h.deadline()
+            if deadline is not None:
+                timeout = max(0.0, min(timeout, deadline-now))
+
+        rlist = [self._rpipe]+self._handlers
+        wlist = [h for h in self._handlers if h.wantsWrite()]
+        try:
+            rlist, wlist, xlist = select(rlist, wlist, [], timeout)
+        except select_error, e:
+            if e.args[0] == errno.EINTR:
+                return
+            raise
+
+        for h in rlist:
+            if h == self._rpipe:
+                try:
+                    while os.read(self._rpipe, 4096):
+                        pass
+                except OSError:
+                    pass
+            else:
+                self._guard(h, h.handleRead)
+        for h in wlist:
+            if h in self._handlers:
+                self._guard(h, h.handleWrite)
+
+        while self._calls:
+            func, args = self._calls.popleft()
+            try:
+                func(*args)
+            except:
+                self.log.logTB(MythLog.SOCKET)
+
+        now = time()
+        for h in list(self._handlers):
+            self._guard(h, h.checkDeadline, now)
+
+    def _guard(self, handler, func, *args):
+        try:
+            func(*args)
+        except Exception, e:
+            handler.handleClose(e)
+
+    def run(self, timeout=None):
+        """
+        Run the loop until stop() is called, or for 'timeout' seconds.
+        """
+        end = None if timeout is None else time()+timeout
+        self._ident = get_ident()
+        self._stopped = False
+        try:
+            while not self._stopped:
+                wait = 1.0
+                if end is not None:
+                    wait = end - time()
+                    if wait <= 0:
+                        break
+                self._runonce(min(wait, 1.0))
+        finally:
+            self._ident = None
+
+    def runUntil(self, future, timeout=None):
+        """Run the loop until 'future' completes, or 'timeout' expires."""
+        end = None if timeout is None else time()+timeout
+        previous, self._ident = self._ident, get_ident()
+        try:
+            while not future.done():
+                wait = 1.0
+                if end is not None:
+                    wait = end - time()
+                    if wait <= 0:
+                        break
+                self._runonce(min(wait, 1.0))
+        finally:
+            self._ident = previous
+
+    def start(self):
+        """Run the loop in a background daemon thread."""
+        t = Thread(target=self.run, name='Python Async Loop')
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        self._stopped = True
+        self.call(lambda: None)
+
+class AsyncBEConnection( object ):
+    """
+    Non-blocking backend connection driven by an AsyncLoop. Commands may be
+        issued from any thread, are pipelined on the socket, and return
+        MythFuture objects resolving to the response string. The 'ready'
+        future completes once the connection has been announced.
+
+    If 'events' is set, the connection is announced as an event monitor
+        and BACKEND_MESSAGE events are passed to handlers registered with
+        registerevent() as soon as they arrive. Commands cannot be used on
+        an event connection.
+    """
+    logmodule = 'Python Async Backend Connection'
+    _framed = True
+
+    def __init__(self, backend, port, localname=None, events=False,
+                    loop=None, timeout=10.0, level=2):
+        self.log = MythLog(self.logmodule)
+        self.host = backend
+        self.port = port
+        self.localname = localname
+        if self.localname is None:
+            self.localname = socket.gethostname()
+        self.timeout = timeout
+        self.loop = loop if loop is not None else AsyncLoop.default()
+        self.events = events
+        self._eventlevel = level if events else 0
+        self._regevents = {}
+
+        self.connected = False
+        self.closed = False
+        self._connecting = True
+        self._pending = deque()
+        self._wbuff = bytearray()
+        self._rbuff = bytearray()
+
+        self.log(MythLog.SOCKET|MythLog.NETWORK, MythLog.INFO,
+                "Connecting to backend [%s]:%d" % (self.host, self.port))
+        family = socket.AF_INET6 if ':' in self.host else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.setblocking(0)
+        res = self.socket.connect_ex((self.host, self.port))
+        if res not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            raise MythBEError(MythError.PROTO_CONNECTION, self.host, self.port)
+
+        self.ready = MythFuture(self.loop)
+        self.loop.call(self.loop.register, self)
+        self._handshake()
+
+    def __repr__(self):
+        return "<%s '[%s]:%d' at %s>" % (self.__class__.__name__,
+                                         self.host, self.port, hex(id(self)))
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def _handshake(self):
+        self._command('MYTH_PROTO_VERSION %s %s' % \
+                                    (PROTO_VERSION, PROTO_TOKEN))\
+                .addCallback(self._checked(self._checkversion))
+        self._command(self._announcement())\
+                .addCallback(self._checked(self._checkannounce))
+
+    def _announcement(self):
+        return 'ANN Monitor %s %d' % (self.localname, self._eventlevel)
+
+    def _checkversion(self, f):
+        res = f.result().split(BACKEND_SEP)
+        if res[0] == 'REJECT':
+            raise MythBEError(MythError.PROTO_MISMATCH,
+                              int(res[1]), PROTO_VERSION)
+
+    def _checkannounce(self, f):
+        res = f.result()
+        if res != 'OK':
+            raise MythBEError(MythError.PROTO_ANNOUNCE,
+                              self.host, self.port, res)
+        self._announced()
+
+    def _announced(self):
+        self.connected = True
+        self.log(MythLog.SOCKET, MythLog.INFO,
+                 "Successfully connected to backend",
+                 "[%s]:%d" % (self.host, self.port))
+        self.ready.setResult(self)
+
+    def _checked(self, check):
+        # run a handshake check, closing the connection if it fails
+        def wrapper(f):
+            try:
+                check(f)
+            except Exception, e:
+                self.handleClose(e)
+        return wrapper
+
+    def _command(self, data):
+        future = MythFuture(self.loop)
+        self.loop.call(self._send, data, future)
+        return future
+
+    def backendCommand(self, data):
+        """
+        obj.backendCommand(data) -> MythFuture
+
+        Queues a command for the backend. The returned future resolves to
+            the response string.
+        """
+        if self.events:
+            raise MythBEError('Commands cannot be sent on an event connection')
+        return self._command(data)
+
+    def registerevent(self, regex, function):
+        """
+        obj.registerevent(regex, function) -> None
+
+        Calls function(event) on the loop thread for every event matching
+            the compiled regular expression.
+        """
+        self._regevents[regex] = function
+
+    def unregisterevent(self, regex):
+        self._regevents.pop(regex, None)
+
+    def close(self):
+        """Close the connection, failing any outstanding commands."""
+        self.loop.call(self._close)
+
+    def _close(self):
+        if self.closed:
+            return
+        try:
+            self.socket.send('%-8d%s' % (4, 'DONE'))
+        except socket.error:
+            pass
+        self.handleClose(MythError('Connection closed'))
+
+    def _send(self, data, future):
+        if self.closed:
+            future.setError(MythError('Connection closed'))
+            return
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.log(MythLog.SOCKET|MythLog.NETWORK, MythLog.DEBUG,
+                 'write --> %d', data, args=(len(data),))
+        self._wbuff += '%-8d%s' % (len(data), data)
+        self._pending.append((future, time()+self.timeout))
+
+    def _dispatch(self, msg):
+        try:
+            msg = unicode(msg, 'utf8')
+        except:
+            msg = unicode(msg, 'latin-1')
+        if self.events and self.connected:
+            if msg[:15] != 'BACKEND_MESSAGE':
+                return
+            for r,f in self._regevents.items():
+                if r.match(msg):
+                    try:
+                        f(msg)
+                    except:
+                        self.log.logTB(MythLog.SOCKET)
+        elif self._pending:
+            self._pending.popleft()[0].setResult(msg)
+
+    # reactor interface
+    def wantsWrite(self):
+        return self._connecting or (len(self._wbuff) > 0)
+
+    def deadline(self):
+        if self._pending:
+            return self._pending[0][1]
+        return None
+
+    def checkDeadline(self, now):
+        if self._pending and (self._pending[0][1] < now):
+            # replies are ordered, the stream cannot be resynchronized
+            raise MythError(MythError.SOCKET,
+                            (errno.ETIMEDOUT, 'Timed out waiting for response'))
+
+    def _finishconnect(self):
+        err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            raise MythBEError(MythError.PROTO_CONNECTION,
+                              self.host, self.port)
+        self._connecting = False
+
+    def handleWrite(self):
+        if self._connecting:
+            self._finishconnect()
+        if self._wbuff:
+            try:
+                ct = self.socket.send(self._wbuff)
+            except socket.error, e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return
+                raise MythError(MythError.SOCKET, e.args)
+            del self._wbuff[:ct]
+
+    def handleRead(self):
+        if self._connecting:
+            self._finishconnect()
+        try:
+            data = self.socket.recv(2**16)
+        except socket.error, e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise MythError(MythError.SOCKET, e.args)
+        if not data:
+            raise MythError(MythError.SOCKET, (54, 'Connection reset by peer'))
+        self._rbuff += data
+        self._parse()
+
+    def _parse(self):
+        while self._framed and (len(self._rbuff) >= 8):
+            size = int(str(self._rbuff[:8]))
+            if len(self._rbuff) < size+8:
+                break
+            msg = str(self._rbuff[8:size+8])
+            del self._rbuff[:size+8]
+            self.log(MythLog.SOCKET|MythLog.NETWORK, MythLog.DEBUG,
+                     'read <-- %d', msg, args=(size,))
+            self._dispatch(msg)
+
+    def handleClose(self, error):
+        if self.closed:
+            return
+        self.closed = True
+        self.connected = False
+        self.loop.unregister(self)
+        if not isinstance(error, MythError) or (error.args != \
+                ('Connection closed',)):
+            self.log(MythLog.SOCKET|MythLog.NETWORK, MythLog.ERR,
+                     "Connection to [%s]:%d failed" % (self.host, self.port),
+                     str(error))
+        try:
+            self.socket.close()
+        except socket.error:
+            pass
+        pending, self._pending = self._pending, deque()
+        for future, deadline in pending:
+            future.setError(error)
+        self.ready.setError(error)
+
 class FEConnection( object ):
     """
     This is the basic frontend connection object.
@@ -10,9 +10,16 @@ from MythTV.logging import MythLog
 from MythTV.msearch import MSearch
 from MythTV.utility import datetime, _donothing, QuickProperty
 from MythTV.exceptions import MythError, MythDBError, MythTZError
-from MythTV.connections import DBConnection, LoggedCursor, XMLConnection
+from MythTV.connections import DBConnection, LoggedCursor, LoggedSSCursor, \
+                               XMLConnection
 
 from socket import gethostname
+from array import array
+from collections import namedtuple
+from itertools import izip, imap, islice
+from operator import itemgetter
+from thread import allocate_lock
+from time import time
 from uuid import UUID, uuid1, uuid4
 from lxml import etree
 import datetime as _pydt
@@ -60,6 +67,7 @@ class DBData( DictData, MythSchema ):
     _key   = None
     _wheredat    = None
     _setwheredat = None
+    _batchsize   = 500
 
     @classmethod
     def _setClassDefs(cls, db=None):
@@ -104,23 +112,28 @@ class DBData( DictData, MythSchema ):
         cls._setClassDefs = classmethod(_donothing)
 
     @classmethod
-    def getAllEntries(cls, db=None):
-        """cls.getAllEntries() -> tuple of DBData objects"""
-        return cls._fromQuery("", ())
+    def getAllEntries(cls, db=None, stream=False):
+        """
+        cls.getAllEntries(db=None, stream=False) -> iterator of DBData objects
+
+        If 'stream' is True, rows are streamed from the server rather than
+            held client-side, keeping memory flat for large tables.
+        """
+        return cls._fromQuery("", (), db, stream)
 
     @classmethod
-    def _fromQuery(cls, where, args, db=None):
+    def _fromQuery(cls, where, args, db=None, stream=False):
         db = DBCache(db)
         cls._setClassDefs(db)
-        with db as cursor:
+        with db.cursor(db.log, stream) as cursor:
             cursor.execute("""SELECT * FROM %s %s""" \
                         % (cls._table, where), args)
-            for row in cursor:
-                try:
-                    yield cls.fromRaw(row, db)
-                except MythDBError, e:
-                    if e.ecode == MythError.DB_RESTRICT:
-                        pass
+            while True:
+                rows = cursor.fetchmany(cls._batchsize)
+                if not rows:
+                    break
+                for dbdata in cls._fromRawIter(rows, db, True):
+                    yield dbdata
 
     @classmethod
     def fromRaw(cls, raw, db=None):
@@ -132,6 +145,110 @@ class DBData( DictData, MythSchema ):
         dbdata._postinit()
         return dbdata
 
+    @classmethod
+    def fromRawBatch(cls, rows, db=None):
+        """
+        cls.fromRawBatch(rows, db=None) -> list of DBData objects
+
+        Bulk equivalent of fromRaw(), for a sequence of rows as returned
+            by 'select * from mytable'.
+        """
+        return list(cls._fromRawIter(rows, DBCache(db)))
+
+    @classmethod
+    def _fromRawIter(cls, rows, db, skiprestricted=False):
+        conv = cls._compileRaw(db)
+        if conv is None:
+            # subclass has custom processing, build each row individually
+            for row in rows:
+                try:
+                    yield cls.fromRaw(row, db)
+                except MythDBError, e:
+                    if (not skiprestricted) or \
+                            (e.ecode != MythError.DB_RESTRICT):
+                        raise
+            return
+
+        # objects are cloned from a single uninitialized instance, rather
+        # than repeating the connection and schema setup for every row
+        proto = cls(None, db=db)
+        state = proto.__dict__
+        extra = [(k,v) for k,v in dict.iteritems(proto)
+                    if k not in cls._field_order]
+        new = dict.__new__
+        for row in rows:
+            data, wheredat = conv(row)
+            dbdata = new(cls)
+            dbdata.__dict__.update(state)
+            if extra:
+                dict.update(dbdata, extra)
+            dict.update(dbdata, data)
+            try:
+                dbdata._evalwheredat(wheredat)
+                dbdata._postinit()
+            except MythDBError, e:
+                if (not skiprestricted) or (e.ecode != MythError.DB_RESTRICT):
+                    raise
+                continue
+            yield dbdata
+
+    @classmethod
+    def _compileRaw(cls, db):
+        """
+        Returns a function converting a raw row into a list of processed
+            (field, value) pairs and the row's 'wheredat', with the field
+            type checks of _process() and the eval() of _evalwheredat()
+            resolved once per class. Returns None if the class overrides
+            either step, as its rows must then pass through fromRaw().
+        """
+        if '_rawconv' in cls.__dict__:
+            return cls.__dict__['_rawconv']
+        cls._setClassDefs(db)
+
+        conv = None
+        if (cls._process.__func__ is DBData._process.__func__) and \
+                (cls.fromRaw.__func__ is DBData.fromRaw.__func__):
+            fields = list(cls._field_order)
+            dtcols = [i for i,(k,v) in enumerate(cls._field_order.items())
+                            if v.type in ('datetime','timestamp')]
+
+            keycols = None
+            if (cls._setwheredat == ''.join(['self.%s,' % k
+                                                for k in cls._key])) and \
+                    not [k for k in cls._key if hasattr(cls, k)]:
+                keycols = [fields.index(k) for k in cls._key]
+
+            # resolve the UTC timezone once, rather than for every value
+            utc = datetime.UTCTZ()
+            def convdatetime(value):
+                value = datetime.fromDatetime(value, utc)
+                try:
+                    return value.astimezone(datetime.localTZ())
+                except MythTZError:
+                    return value
+
+            def conv(raw):
+                data = list(raw)
+                for i in dtcols:
+                    if data[i] is not None:
+                        data[i] = convdatetime(data[i])
+                if keycols is None:
+                    # non-standard wheredat, left to _evalwheredat()
+                    return zip(fields, data), None
+                return zip(fields, data), tuple([data[i] for i in keycols])
+
+        cls._rawconv = conv
+        return conv
+
+    @staticmethod
+    def _convdatetime(value):
+        try:
+            # try converting to local time
+            return datetime.fromnaiveutc(value)
+        except MythTZError:
+            # just store as UTC
+            return datetime.fromDatetime(value, tzinfo=datetime.UTCTZ())
+
     def __setitem__(self, key, value):
         for k,v in self._field_order.items():
             if k == key:
@@ -184,13 +301,7 @@ class DBData( DictData, MythSchema ):
         for key, val in self._field_order.items():
             if (val.type in ('datetime','timestamp')) \
                     and (data[key] is not None):
-                try:
-                    # try converting to local time
-                    data[key] = datetime.fromnaiveutc(data[key])
-                except MythTZError:
-                    # just store as UTC
-                    data[key] = datetime.fromDatetime(dt,
-                                                tzinfo=datetime.UTCTZ())
+                data[key] = self._convdatetime(data[key])
         return data
 
     def _pull(self):
@@ -441,7 +552,63 @@ class DBDataWrite( DBData ):
             cursor.execute("""DELETE FROM %s WHERE %s""" \
                         % (self._table, self._where), self._wheredat)
 
-class DBDataRef( list ):
+class _PrefetchRef( object ):
+    """
+    Shared handling for loading many reference lists of the same class,
+        such as recordedmarkup for a set of recordings, in one query.
+    Subclasses must provide '_ref', '_datfields', '_populated',
+        '_refdat', and accept 'data' in '_populate'.
+    """
+    @classmethod
+    def prefetch(cls, refs, db=None):
+        """
+        obj.prefetch(refs, db=None) -> None
+
+        Populates a list of reference lists of this class using a single
+            query, rather than one query per object. Objects that are
+            already populated are left untouched.
+        """
+        db = DBCache(db)
+        cls._setClassDefs(db)
+        pending = {}
+        for ref in refs:
+            if not ref._populated:
+                pending.setdefault(tuple(ref._refdat), []).append(ref)
+        if len(pending) == 0:
+            return
+
+        data = dict([(key, []) for key in pending])
+        for key, row in cls._prefetchrows(db, pending.keys()):
+            if key in data:
+                data[key].append(row)
+        for key, reflist in pending.items():
+            for ref in reflist:
+                ref._populate(data=data[key])
+
+    @classmethod
+    def _prefetchwhere(cls, keys, table):
+        # match each reference field against the set of values in use,
+        # and let the caller discard any rows from unwanted combinations
+        where = []
+        args = []
+        for i,f in enumerate(cls._ref):
+            values = list(set([key[i] for key in keys]))
+            where.append('%s.%s IN (%s)' % \
+                            (table, f, ','.join(['?' for v in values])))
+            args += values
+        return ' AND '.join(where), args
+
+    @classmethod
+    def _prefetchrows(cls, db, keys):
+        where, args = cls._prefetchwhere(keys, cls._table)
+        nref = len(cls._ref)
+        with db as cursor:
+            cursor.execute("""SELECT %s FROM %s WHERE %s""" % \
+                        (','.join(cls._ref+cls._datfields), cls._table, where),
+                    args)
+            return [(tuple(row[:nref]), row[nref:]) for row in cursor]
+
+class DBDataRef( list, _PrefetchRef ):
     """
     DBDataRef.__init__(where, db=None) --> DBDataRef object
 
@@ -453,10 +620,17 @@ class DBDataRef( list ):
             list of fields for WHERE argument in lookup
     """
     _readonly = False
+    _bulkthreshold = 100
+    _index = None
+    _indexgen = None
 
     class SubData( OrdDict ):
         # this is one matching entry
         _localvars = ['_field_order', '_changed', '_hash']
+        # bumped whenever an entry is modified in place, so any hash
+        # index built over it can be recognized as stale. each subclass
+        # is given its own counter by _setClassDefs()
+        _generation = [0]
         def __init__(self, data):
             OrdDict.__init__(self, data)
             self._changed = True
@@ -465,12 +639,14 @@ class DBDataRef( list ):
         def __repr__(self): return str(self).encode('utf-8')
         def __hash__(self):
             if self._changed:
-                self._hash = hash(sum(map(hash,self.values())))
+                self._hash = hash(tuple(self.values()))
                 self._changed = False
             return self._hash
         def __setitem__(self, key, value):
             OrdDict.__setitem__(self, key, value)
             self._changed = True
+            if '_hash' in self.__dict__:
+                self._generation[0] += 1
 
     def __str__(self):
         self._populate()
@@ -486,33 +662,78 @@ class DBDataRef( list ):
     def __setitem__(self, key, value):
         list.__setitem__(self, key, \
                     self.SubData(zip(self._datfields, list(value))))
+        self._index = None
+
+    def __delitem__(self, key):
+        list.__delitem__(self, key)
+        self._index = None
+
+    def __setslice__(self, i, j, seq):
+        list.__setslice__(self, i, j, seq)
+        self._index = None
+
+    def __delslice__(self, i, j):
+        list.__delslice__(self, i, j)
+        self._index = None
+
+    def __iadd__(self, other):
+        self.extend(other)
+        return self
+
+    def extend(self, seq):
+        list.extend(self, seq)
+        self._index = None
+
+    def insert(self, i, value):
+        list.insert(self, i, value)
+        self._index = None
+
+    def pop(self, i=-1):
+        self._index = None
+        return list.pop(self, i)
+
+    def remove(self, value):
+        list.remove(self, value)
+        self._index = None
 
     def __iter__(self):
         self._populate()
         return list.__iter__(self)
 
+    def _getindex(self):
+        # count of entries by hash, rebuilt if the list has been modified
+        # other than through append() and delete(), or if any entry
+        # has been modified in place
+        if (self._index is None) or \
+                (self._indexgen != self.SubData._generation[0]):
+            index = {}
+            for sd in list.__iter__(self):
+                h = sd.__hash__()
+                index[h] = index.get(h, 0)+1
+            self._index = index
+            self._indexgen = self.SubData._generation[0]
+        return self._index
+
+    @staticmethod
+    def _hashes(seq):
+        if isinstance(seq, DBDataRef):
+            seq._populate()
+            return seq._getindex()
+        return set([dat.__hash__() for dat in seq])
+
     def __contains__(self, other):
-        h = other.__hash__()
-        for sd in self:
-            if sd.__hash__() == h:
-                return True
-        return False
+        return other.__hash__() in self._hashes(self)
 
     def __xor__(self, other):
-        data = []
-        for dat in self:
-            if dat not in other:
-                data.append(dat)
-        for dat in other:
-            if dat not in self:
-                data.append(dat)
+        ours = self._hashes(self)
+        theirs = self._hashes(other)
+        data = [dat for dat in self if dat.__hash__() not in theirs]
+        data += [dat for dat in other if dat.__hash__() not in ours]
         return self.fromCopy(data, self._db)
         
     def __and__(self, other):
-        data = []
-        for dat in self:
-            if dat in other:
-                data.append(dat)
+        theirs = self._hashes(other)
+        data = [dat for dat in self if dat.__hash__() in theirs]
         return self.fromCopy(data, self._db)
 
     @classmethod
@@ -527,8 +748,15 @@ class DBDataRef( list ):
         if cls._readonly:
             cls.commit = _donothing
 
+        cls._setSubData()
         cls._setClassDefs = classmethod(_donothing)
 
+    @classmethod
+    def _setSubData(cls):
+        # count in-place modifications per class, so editing entries of
+        # one table does not invalidate the hash indexes of all others
+        cls.SubData = type('SubData', (cls.SubData,), {'_generation':[0]})
+
     def __init__(self, where, db=None, bypass=False):
         list.__init__(self)
         self._db = DBCache(db)
@@ -559,6 +787,7 @@ class DBDataRef( list ):
             for row in data:
                 list.append(self, self.SubData(zip(self._datfields, row)))
         self._populated = True
+        self._index = None
         self._origdata = self.deepcopy()
 
     @classmethod
@@ -566,7 +795,7 @@ class DBDataRef( list ):
         c = cls('', db=db, bypass=True)
         c._populated = True
         for dat in data:
-            list.append(c, c.SubData(zip(self._datfields, row)))
+            list.append(c, c.SubData(zip(cls._datfields, dat)))
         return c
 
     @classmethod
@@ -588,20 +817,35 @@ class DBDataRef( list ):
         self._populate()
         for i in reversed(range(len(self))): del self[i]
         for i in self._origdata: list.append(self, i)
+        self._index = None
 
-    def commit(self):
-        """Push all local changes to database."""
+    def commit(self, replace=None):
+        """
+        Push all local changes to database.
+
+        If 'replace' is True, all stored entries for this reference are
+            deleted and the full list inserted again in a single
+            transaction. If None, this is done automatically when more
+            than '_bulkthreshold' entries would otherwise have to be
+            deleted individually.
+        """
         if not self._populated:
             return
         # push changes to database
         diff = self^self._origdata
         if len(diff) == 0:
             return
+        removed = self._origdata&diff
+        if replace is None:
+            replace = len(removed) > self._bulkthreshold
+        if replace:
+            self._replace()
+            return
         fields = list(self._ref)+list(self._datfields)
 
         with self._db as cursor:
             # remove old entries
-            for v in (self._origdata&diff):
+            for v in removed:
                 data = list(self._refdat)+v.values()
                 wf = []
                 for i,v in enumerate(data):
@@ -624,13 +868,33 @@ class DBDataRef( list ):
                                      ','.join(['?' for a in fields])), data)
         self._origdata = self.deepcopy()
 
+    def _replace(self):
+        fields = list(self._ref)+list(self._datfields)
+        data = [list(self._refdat)+v.values() for v in list.__iter__(self)]
+
+        with self._db as cursor:
+            cursor.execute("""START TRANSACTION""")
+            cursor.execute("""DELETE FROM %s WHERE %s""" % \
+                        (self._table,
+                         ' AND '.join(['%s=?' % f for f in self._ref])),
+                    self._refdat)
+            if len(data) > 0:
+                cursor.executemany("""INSERT INTO %s (%s) VALUES(%s)""" % \
+                                    (self._table,
+                                     ','.join(fields),
+                                     ','.join(['?' for a in fields])), data)
+        self._origdata = self.deepcopy()
+
     def append(self, *data):
         """Adds a list of data matching those specified in '_datfields'."""
         self._populate()
         sd = self.SubData(zip(self._datfields, data))
-        if sd in self:
+        index = self._getindex()
+        h = sd.__hash__()
+        if h in index:
             return
         list.append(self, sd)
+        index[h] = 1
     def add(self, *data): self.append(*data)
 
     def delete(self, *data):
@@ -638,7 +902,14 @@ class DBDataRef( list ):
         # delete entry from local copy
         self._populate()
         sd = self.SubData(zip(self._datfields, data))
-        del self[self.index(sd)]
+        h = sd.__hash__()
+        index = self._getindex()
+        if h not in index:
+            raise ValueError('list.index(x): x not in list')
+        list.__delitem__(self, list.index(self, sd))
+        index[h] -= 1
+        if index[h] == 0:
+            del index[h]
 
     def clean(self):
         """Remove all entries and commit."""
@@ -663,7 +934,13 @@ class DBDataCRef( DBDataRef ):
             List of fields for WHERE argument in lookup
         _cref
             2-list of fields used for cross reference
+    Subclasses may provide:
+        _lookup
+            If True, the cross reference table is small enough to be
+            held in the shared lookup cache, rather than queried each
+            time it is accessed
     """
+    _lookup = False
 
     class SubData( DBDataRef.SubData ):
         _localvars = DBDataRef.SubData._localvars+['_cref']
@@ -684,8 +961,22 @@ class DBDataCRef( DBDataRef ):
         cls._crdatfields = crfields
         cls._datfields = crfields+rfields
 
+        if cls._lookup:
+            # the cache stores values in table order, so it can only be used
+            # if the cross reference field is the primary key
+            table = db.lookups[cls._table[1]]
+            if (table._idfield != cls._cref[-1]) or \
+                    (table._fields != crfields):
+                cls._lookup = False
+
+        cls._setSubData()
         cls._setClassDefs = classmethod(_donothing)
 
+    def _getlookup(self):
+        if self._lookup:
+            return self._db.lookups[self._table[1]]
+        return None
+
     def __init__(self, where, db=None, bypass=False):
         list.__init__(self)
         self._db = DBCache(db)
@@ -705,8 +996,26 @@ class DBDataCRef( DBDataRef ):
             return
         datfields = self._datfields
         reffield = '%s.%s' % (self._table[1],self._cref[-1])
+        lookup = self._getlookup()
 
-        if data is None:
+        if (data is None) and (lookup is not None):
+            with self._db as cursor:
+                cursor.execute("""SELECT %s FROM %s WHERE %s""" % \
+                          (','.join(self._rdatfields+self._cref[:1]),
+                             self._table[0],
+                             ' AND '.join(['%s=?' % f for f in self._ref])),
+                        self._refdat)
+
+                for row in cursor:
+                    try:
+                        values = lookup.getvalue(row[-1])
+                    except KeyError:
+                        # dangling reference, skipped as the JOIN would
+                        continue
+                    sd = self.SubData(zip(datfields, values+tuple(row[:-1])))
+                    sd._cref = row[-1]
+                    list.append(self, sd)
+        elif data is None:
             with self._db as cursor:
                 cursor.execute("""SELECT %s FROM %s JOIN %s ON %s WHERE %s""" % \
                           (','.join(datfields+[reffield]),
@@ -729,8 +1038,43 @@ class DBDataCRef( DBDataRef ):
                 list.append(self, sd)
 
         self._populated = True
+        self._index = None
         self._origdata = self.deepcopy()
 
+    @classmethod
+    def _prefetchrows(cls, db, keys):
+        where, args = cls._prefetchwhere(keys, cls._table[0])
+        nref = len(cls._ref)
+        reffields = ['%s.%s' % (cls._table[0], f) for f in cls._ref]
+        with db as cursor:
+            if cls._lookup:
+                lookup = db.lookups[cls._table[1]]
+                cursor.execute("""SELECT %s FROM %s WHERE %s""" % \
+                            (','.join(reffields+cls._rdatfields+cls._cref[:1]),
+                             cls._table[0], where),
+                        args)
+                rows = []
+                for row in cursor:
+                    try:
+                        values = lookup.getvalue(row[-1])
+                    except KeyError:
+                        # dangling reference, skipped as the JOIN would
+                        continue
+                    rows.append((tuple(row[:nref]), values+tuple(row[nref:])))
+                return rows
+
+            cursor.execute("""SELECT %s FROM %s JOIN %s ON %s WHERE %s""" % \
+                        (','.join(reffields+cls._datfields+
+                                  ['%s.%s' % (cls._table[1], cls._cref[-1])]),
+                         cls._table[0],
+                         cls._table[1],
+                         '%s.%s=%s.%s' % \
+                                (cls._table[0], cls._cref[0],
+                                 cls._table[1], cls._cref[-1]),
+                         where),
+                    args)
+            return [(tuple(row[:nref]), row[nref:]) for row in cursor]
+
     def commit(self):
         if not self._populated:
             return
@@ -739,11 +1083,17 @@ class DBDataCRef( DBDataRef ):
         if len(diff) == 0:
             return
 
+        lookup = self._getlookup()
         with self._db as cursor:
             # add new cross-references
             newdata = self&diff
             for d in newdata:
                 data = [d[a] for a in self._crdatfields]
+                if lookup is not None:
+                    d._cref = lookup.getid(data)
+                    if d._cref is None:
+                        d._cref = lookup.insert(data, cursor)
+                    continue
                 fields = self._crdatfields
                 cursor.execute("""SELECT %s FROM %s WHERE %s""" % \
                             (self._cref[-1], self._table[1],
@@ -788,6 +1138,8 @@ class DBDataCRef( DBDataRef ):
                 if cursor.fetchone()[0] == 0:
                     cursor.execute("""DELETE FROM %s WHERE %s=?""" % \
                             (self._table[1], self._cref[-1]), [cr])
+                    if lookup is not None:
+                        lookup.discard(cr)
                 cursor.nextset()
 
         self._origdata = self.deepcopy()
@@ -796,6 +1148,208 @@ class DBDataCRef( DBDataRef ):
         self._populate()
         return [a.values()+[a._cref] for a in self.copy()]
 
+class DBDataRefArray( _PrefetchRef ):
+    """
+    DBDataRefArray.__init__(where, db=None) --> DBDataRefArray object
+
+    Class for managing large lists of referenced integer data, such as
+        recordedseek. Each field is held in its own array, rather than
+        each row in its own SubData, and rows are only built as namedtuples
+        when accessed. Changes are written by replacing all stored rows
+        for the reference in one transaction.
+    Subclasses must provide:
+        _table
+            Name of database table to be accessed
+        _ref
+            list of fields for WHERE argument in lookup
+    """
+    # python 2 arrays have no 'q' type, so use a C long where it is
+    # 64 bits, and a double (exact to 2**53) elsewhere
+    _typecode = 'l' if array('l').itemsize >= 8 else 'd'
+    # stand-in for NULL in nullable fields
+    _NULL = -2**53
+    _batchsize = 1000
+    _readonly = False
+
+    @classmethod
+    def _setClassDefs(cls, db=None):
+        db = DBCache(db)
+        fields = db.tablefields[cls._table]
+        datfields = [f for f in fields if f not in cls._ref]
+        cls._datfields = datfields
+        cls._nullable = [fields[f].null == 'YES' for f in datfields]
+        cls.Row = namedtuple(cls.__name__+'Row', datfields)
+
+        if cls._readonly:
+            cls.commit = _donothing
+
+        cls._setClassDefs = classmethod(_donothing)
+
+    def __init__(self, where, db=None, bypass=False):
+        self._db = DBCache(db)
+        self._setClassDefs(self._db)
+        self._columns = [array(self._typecode) for f in self._datfields]
+        self._changed = False
+        if bypass: return
+
+        self._populated = False
+
+        where = list(where)
+        for i,v in enumerate(where):
+            if isinstance(v, datetime):
+                where[i] = v.asnaiveutc()
+        self._refdat = tuple(where)
+
+    def __str__(self):
+        return str(list(self))
+    def __repr__(self):
+        return "<%s %s, %d rows at %s>" % (self.__class__.__name__,
+                    str(self._refdat), len(self), hex(id(self)))
+
+    def __len__(self):
+        self._populate()
+        return len(self._columns[0])
+
+    def __iter__(self):
+        self._populate()
+        return imap(self._makerow, *self._columns)
+
+    def __getitem__(self, key):
+        self._populate()
+        if isinstance(key, slice):
+            return [self._makerow(*row) for row in \
+                        izip(*[col[key] for col in self._columns])]
+        return self._makerow(*[col[key] for col in self._columns])
+
+    def __contains__(self, other):
+        return self._find(other) is not None
+
+    def _makerow(self, *values):
+        if True in self._nullable:
+            values = [None if (n and v == self._NULL) else v \
+                            for n,v in zip(self._nullable, values)]
+        return self.Row._make(values)
+
+    def _pack(self, values):
+        values = list(values)
+        if len(values) != len(self._datfields):
+            raise MythDBError('%s requires %d fields, %d given' % \
+                    (self.__class__.__name__, len(self._datfields),
+                     len(values)))
+        return [self._NULL if v is None else v for v in values]
+
+    def _find(self, values):
+        target = tuple(self._pack(values))
+        self._populate()
+        for i,row in enumerate(izip(*self._columns)):
+            if row == target:
+                return i
+        return None
+
+    def _populate(self, force=False, data=None):
+        if self._populated and (not force):
+            return
+        self._columns = [array(self._typecode) for f in self._datfields]
+        if data is None:
+            with self._db as cursor:
+                cursor.execute("""SELECT %s FROM %s WHERE %s""" % \
+                            (','.join(self._datfields),
+                             self._table,
+                             ' AND '.join(['%s=?' % f for f in self._ref])),
+                         self._refdat)
+                while True:
+                    rows = cursor.fetchmany(self._batchsize)
+                    if not rows:
+                        break
+                    self._load(rows)
+        else:
+            self._load(data)
+        self._populated = True
+        self._changed = False
+
+    def _load(self, rows):
+        # extend each column in turn from the block of rows
+        for i,col in enumerate(self._columns):
+            values = imap(itemgetter(i), rows)
+            if self._nullable[i]:
+                values = [self._NULL if v is None else v for v in values]
+            col.extend(values)
+
+    def column(self, name):
+        """
+        obj.column(name) -> array
+
+        Returns the array holding all values of the given field. Changes
+            made directly to the array are not tracked for commit().
+        """
+        self._populate()
+        return self._columns[self._datfields.index(name)]
+
+    def append(self, *data):
+        """Adds a list of data matching those specified in '_datfields'."""
+        self._populate()
+        for col,v in zip(self._columns, self._pack(data)):
+            col.append(v)
+        self._changed = True
+    def add(self, *data): self.append(*data)
+
+    def extend(self, rows):
+        """Adds a sequence of rows matching those specified in '_datfields'."""
+        self._populate()
+        self._load([self._pack(row) for row in rows])
+        self._changed = True
+
+    def delete(self, *data):
+        """Deletes an entry matching the provided list of data."""
+        i = self._find(data)
+        if i is None:
+            raise ValueError('list.index(x): x not in list')
+        for col in self._columns:
+            del col[i]
+        self._changed = True
+
+    def revert(self):
+        """Delete all local changes to database."""
+        self._populated = False
+        self._populate()
+
+    def clean(self):
+        """Remove all entries and commit."""
+        self._populate()
+        self._columns = [array(self._typecode) for f in self._datfields]
+        self._changed = True
+        self.commit()
+
+    def commit(self):
+        """Push all local changes to database."""
+        if not (self._populated and self._changed):
+            return
+        fields = list(self._ref)+list(self._datfields)
+        refdat = list(self._refdat)
+        rows = izip(*self._columns)
+        if True in self._nullable:
+            rows = imap(self._makerow, *self._columns)
+
+        with self._db as cursor:
+            cursor.execute("""START TRANSACTION""")
+            cursor.execute("""DELETE FROM %s WHERE %s""" % \
+                        (self._table,
+                         ' AND '.join(['%s=?' % f for f in self._ref])),
+                    self._refdat)
+            while True:
+                data = [refdat+list(row) \
+                            for row in islice(rows, self._batchsize)]
+                if len(data) == 0:
+                    break
+                cursor.executemany("""INSERT INTO %s (%s) VALUES(%s)""" % \
+                                    (self._table,
+                                     ','.join(fields),
+                                     ','.join(['?' for a in fields])), data)
+        self._changed = False
+
+    def _picklelist(self):
+        return [list(row) for row in self]
+
 class DatabaseConfig( object ):
     class _WakeOnLanConfig( object ):
         def __init__(self):
@@ -1097,6 +1651,11 @@ class DBCache( MythSchema ):
         successful, will populate '~/.mythtv/config.xml' with the necessary
         information.
 
+    Available attributes:
+        obj.tablefields         - cached field definitions for each table
+        obj.settings            - cached settings for each host
+        obj.lookups             - cached contents of small reference tables
+
     Available methods:
         obj.cursor()            - open a cursor for direct database
                                   manipulation
@@ -1104,6 +1663,7 @@ class DBCache( MythSchema ):
     """
     logmodule = 'Python Database Connection'
     cursorclass = LoggedCursor
+    sscursorclass = LoggedSSCursor
     shared = weakref.WeakValueDictionary()
 
     def __repr__(self):
@@ -1245,10 +1805,163 @@ class DBCache( MythSchema ):
                 self[key] = self._HostSettings(self._db, self._log, key)
             return OrdDict.__getitem__(self,key)
 
+    class _Lookups( OrdDict ):
+        """
+        Provides a dictionary-like cache of small reference tables, such as
+            videocategory, shared by all users of the connection.
+        """
+        class _LookupTable( object ):
+            """
+            Maps the primary key of a reference table to the tuple of its
+                remaining fields, and back. The table is read in full on
+                first use, and again once the cached copy is older than
+                'ttl' seconds. A lookup that misses queries just the
+                requested entry. String values are matched
+                case-insensitively, as MySQL would.
+            """
+            ttl = 300.0
+            def __init__(self, db, log, table):
+                self._db = db
+                self._log = log
+                self._table = table
+                self._lock = allocate_lock()
+                fields = db.tablefields[table]
+                key = [k for k,v in fields.items() if v.key == 'PRI']
+                self._idfield = key[0] if key else list(fields)[0]
+                self._fields = [f for f in fields if f != self._idfield]
+                self._byid = {}
+                self._byvalue = {}
+                self._loaded = None
+
+            def __repr__(self):
+                return "<LookupTable '%s', %d entries at %s>" % \
+                            (self._table, len(self._byid), hex(id(self)))
+
+            @staticmethod
+            def _norm(values):
+                return tuple([v.lower() if isinstance(v, basestring) else v
+                                    for v in values])
+
+            def _check(self):
+                if (self._loaded is None) or \
+                        (time() - self._loaded > self.ttl):
+                    self.refresh()
+
+            def refresh(self):
+                """Re-read the table from the database."""
+                byid = {}
+                byvalue = {}
+                with self._db.cursor(self._log) as cursor:
+                    cursor.execute("""SELECT %s FROM %s""" % \
+                            (','.join([self._idfield]+self._fields),
+                             self._table))
+                    for row in cursor:
+                        byid[row[0]] = tuple(row[1:])
+                        byvalue[self._norm(row[1:])] = row[0]
+                with self._lock:
+                    self._byid = byid
+                    self._byvalue = byvalue
+                    self._loaded = time()
+
+            def _fetch(self, where, args):
+                # look up a single entry missing from the cache
+                with self._db.cursor(self._log) as cursor:
+                    cursor.execute("""SELECT %s FROM %s WHERE %s LIMIT 1""" % \
+                            (','.join([self._idfield]+self._fields),
+                             self._table, where), args)
+                    row = cursor.fetchone()
+                if row is None:
+                    return None
+                with self._lock:
+                    self._byid[row[0]] = tuple(row[1:])
+                    self._byvalue[self._norm(row[1:])] = row[0]
+                return row[0]
+
+            def invalidate(self):
+                """Force the table to be re-read on next use."""
+                with self._lock:
+                    self._loaded = None
+
+            def getvalue(self, id):
+                """
+                obj.getvalue(id) -> tuple of field values
+                    Raises KeyError if 'id' does not exist.
+                """
+                self._check()
+                try:
+                    return self._byid[id]
+                except KeyError:
+                    if self._fetch('%s=?' % self._idfield, (id,)) is None:
+                        raise
+                    return self._byid[id]
+
+            def getid(self, values):
+                """
+                obj.getid(values) -> id, or None if no entry matches
+                """
+                self._check()
+                try:
+                    return self._byvalue[self._norm(values)]
+                except KeyError:
+                    pass
+                where = []
+                args = []
+                for field, value in zip(self._fields, values):
+                    if value is None:
+                        where.append('%s IS NULL' % field)
+                    else:
+                        where.append('%s=?' % field)
+                        args.append(value)
+                return self._fetch(' AND '.join(where), args)
+
+            def insert(self, values, cursor=None):
+                """
+                obj.insert(values, cursor=None) -> id of new entry
+                """
+                if cursor is None:
+                    with self._db.cursor(self._log) as cursor:
+                        return self.insert(values, cursor)
+                values = tuple(values)
+                cursor.execute("""INSERT INTO %s (%s) VALUES(%s)""" % \
+                        (self._table, ','.join(self._fields),
+                         ','.join(['?' for v in values])), values)
+                id = cursor.lastrowid
+                with self._lock:
+                    self._byid[id] = values
+                    self._byvalue[self._norm(values)] = id
+                return id
+
+            def discard(self, id):
+                """Remove an entry deleted from the database."""
+                with self._lock:
+                    values = self._byid.pop(id, None)
+                    if values is not None:
+                        self._byvalue.pop(self._norm(values), None)
+
+        _localvars = ['_field_order','_log','_db']
+        def __str__(self): return str(list(self))
+        def __repr__(self): return str(self).encode('utf-8')
+        def __iter__(self): return self.iterkeys()
+        def __init__(self, db, log):
+            OrdDict.__init__(self)
+            self._db = weakref.proxy(db)
+            self._log = log
+
+        def __getitem__(self, key):
+            if key not in self:
+                self[key] = self._LookupTable(self._db, self._log, key)
+            return OrdDict.__getitem__(self,key)
+
+        def invalidate(self):
+            """Force all cached tables to be re-read on next use."""
+            for table in self.itervalues():
+                table.invalidate()
+
     def __init__(self, db=None, args=None, **dbconn):
         self.db = None
         self.log = MythLog(self.logmodule)
         self.settings = None
+        self.lookups = None
         if db is not None:
             # load existing database connection
             self.log(MythLog.DATABASE, MythLog.DEBUG,
@@ -1306,10 +2019,12 @@ class DBCache( MythSchema ):
             # create special attributes
             self.db.tablefields = self._TableFields(self.db, self.db.log)
             self.db.settings = self._Settings(self.db, self.db.log)
+            self.db.lookups = self._Lookups(self.db, self.db.log)
 
         # connect special attributes to database
         self.tablefields = self.db.tablefields
         self.settings = self.db.settings
+        self.lookups = self.db.lookups
         return True
 
     def _check_schema(self, value, local, name='Database', update=None):
@@ -1432,9 +2147,18 @@ class DBCache( MythSchema ):
         query = query.replace('?', '%s')
         return query % tuple(args)
 
-    def cursor(self, log=None):
+    def cursor(self, log=None, stream=False):
+        """
+        obj.cursor(log=None, stream=False) -> cursor object
+
+        If 'stream' is True, rows are read from the server as they are
+            fetched rather than all at once. The cursor's connection is
+            held until all rows have been read or the cursor is closed.
+        """
         if not log:
             log = self.log
+        if stream:
+            return self.db.cursor(log, self.sscursorclass)
         return self.db.cursor(log, self.cursorclass)
 
     def __enter__(self): return self.db.__enter__()
@@ -6,7 +6,7 @@ Provides data access classes for accessing and managing MythTV data
 
 from MythTV.static import *
 from MythTV.exceptions import *
-from MythTV.altdict import DictData, DictInvertCI
+from MythTV.altdict import DictData
 from MythTV.database import *
 from MythTV.system import Grabber, InternetMetadata, VideoMetadata
 from MythTV.mythproto import ftopen, FileOps, Program
@@ -289,6 +289,7 @@ class Recorded( CMPRecord, DBDataWrite ):
                  'watched':0,        'storagegroup':'Default',
                  'inetref':'',       'season':0,            'episode':0}
     _artwork = None
+    _compactmarkup = False
 
     class _Cast( DBDataCRef ):
         _table = ['recordedcredits','people']
@@ -302,14 +303,14 @@ class Recorded( CMPRecord, DBDataWrite ):
     class _Markup( DBDataRef, MARKUP, MARKUPLIST ):
         _table = 'recordedmarkup'
         _ref = ['chanid','starttime']
-        def getskiplist(self):
-            return self._buildlist(self.MARK_COMM_START, self.MARK_COMM_END)
-        def getunskiplist(self):
-            return self._buildlist(self.MARK_COMM_END, self.MARK_COMM_START)
-        def getcutlist(self):
-            return self._buildlist(self.MARK_CUT_START, self.MARK_CUT_END)
-        def getuncutlist(self):
-            return self._buildlist(self.MARK_CUT_END, self.MARK_CUT_START)
+
+    class _SeekArray( DBDataRefArray, MARKUP ):
+        _table = 'recordedseek'
+        _ref = ['chanid','starttime']
+
+    class _MarkupArray( DBDataRefArray, MARKUP, MARKUPLIST ):
+        _table = 'recordedmarkup'
+        _ref = ['chanid','starttime']
 
     class _Rating( DBDataRef ):
         _table = 'recordedrating'
@@ -331,12 +332,27 @@ class Recorded( CMPRecord, DBDataWrite ):
         DBDataWrite.__init__(self, data, db)
 
     def _postinit(self):
-        self.seek = self._Seek(self._wheredat, self._db)
-        self.markup = self._Markup(self._wheredat, self._db)
+        if self._compactmarkup:
+            self.seek = self._SeekArray(self._wheredat, self._db)
+            self.markup = self._MarkupArray(self._wheredat, self._db)
+        else:
+            self.seek = self._Seek(self._wheredat, self._db)
+            self.markup = self._Markup(self._wheredat, self._db)
         wheredat = (self.chanid, self.progstart)
         self.cast = self._Cast(wheredat, self._db)
         self.rating = self._Rating(wheredat, self._db)
 
+    @classmethod
+    def setCompactMarkup(cls, enable=True):
+        """
+        Recorded.setCompactMarkup(enable=True) -> None
+
+        Holds the seek and markup tables of subsequently loaded recordings
+            in array-backed lists, using a fraction of the memory.
+            Entries are returned as namedtuples rather than dictionaries.
+        """
+        cls._compactmarkup = bool(enable)
+
     @classmethod
     def fromProgram(cls, program):
         return cls((program.chanid, program.recstartts), program._db)
@@ -826,59 +842,44 @@ class Video( CMPVideo, VideoSchema, DBDataWrite ):
                  'browse':True,              'hash':u'',
                  'season':0,                 'episode':0,
                  'releasedate':date(1,1,1),  'childid':-1}
-    _cm_toid, _cm_toname = DictInvertCI.createPair({0:'none'})
-
-    @classmethod
-    def _setClassDefs(cls, db=None):
-        db = DBCache(db)
-        super(Video, cls)._setClassDefs(db)
-        cls._fill_cm(db)
-
-    @classmethod
-    def _fill_cm(cls, db=None):
-        db = DBCache(db)
-        with db.cursor() as cursor:
-            cursor.execute("""SELECT * FROM videocategory""")
-            for row in cursor:
-                cls._cm_toname[row[0]] = row[1]
 
     def _cat_toname(self):
         if self.category is not None:
             try:
-                self.category = self._cm_toname[int(self.category)]
+                category = int(self.category)
             except ValueError:
                 # already a named category
-                pass
+                return
+            if category == 0:
+                self.category = 'none'
+                return
+            try:
+                self.category = \
+                        self._db.lookups['videocategory'].getvalue(category)[0]
             except KeyError:
-                self._fill_cm(self._db)
-                if int(self.category) in self._cm_toname:
-                    self.category = self._cm_toname[int(self.category)]
-                else:
-                    raise MythDBError('Video defined with unknown category id')
+                raise MythDBError('Video defined with unknown category id')
         else:
             self.category = 'none'
 
     def _cat_toid(self):
         if self.category is not None:
             try:
-                if self.category.lower() not in self._cm_toid:
-                    self._fill_cm(self._db)
-                if self.category.lower() not in self._cm_toid:
-                    with self._db.cursor(self._log) as cursor:
-                        cursor.execute("""INSERT INTO videocategory
-                                          SET category=%s""",
-                                      self.category)
-                        self._cm_toid[self.category] = cursor.lastrowid
-                self.category = self._cm_toid[self.category]
+                if self.category.lower() == 'none':
+                    self.category = 0
+                    return
             except AttributeError:
                 # already an integer category
-                pass
+                return
+            lookup = self._db.lookups['videocategory']
+            category = lookup.getid((self.category,))
+            if category is None:
+                category = lookup.insert((self.category,))
+            self.category = category
         else:
             self.category = 0
 
     def _pull(self):
         DBDataWrite._pull(self)
-        self._fill_cm()
         self._cat_toname()
 
     def _push(self):
@@ -901,7 +902,6 @@ class Video( CMPVideo, VideoSchema, DBDataWrite ):
         return u"<Video '%s' at %s>" % (res, hex(id(self)))
 
     def _postinit(self):
-        self._fill_cm()
         self._cat_toname()
         self.cast = self._Cast(self._wheredat, self._db)
         self.genre = self._Genre(self._wheredat, self._db)
@@ -932,16 +932,19 @@ class Video( CMPVideo, VideoSchema, DBDataWrite ):
         _table = ['videometadatacast','videocast']
         _ref = ['idvideo']
         _cref = ['idcast','intid']
+        _lookup = True
 
     class _Genre( DBDataCRef ):
         _table = ['videometadatagenre','videogenre']
         _ref = ['idvideo']
         _cref = ['idgenre','intid']
+        _lookup = True
 
     class _Country( DBDataCRef ):
         _table = ['videometadatacountry','videocountry']
         _ref = ['idvideo']
         _cref = ['idcountry','intid']
+        _lookup = True
 
     class _Markup( DBDataRef, MARKUP ):
         _table = 'filemarkup'
@@ -159,11 +159,11 @@ class MythFileError( MythError ):
         if args[0] == self.FILE_ERROR:
             self.ename = 'FILE_ERROR'
             self.ecode, self.reason = args
-            self.args = ("Error accessing file: " % self.reason,)
+            self.args = ("Error accessing file: %s" % self.reason,)
         elif args[0] == self.FILE_FAILED_READ:
             self.ename = 'FILE_FAILED_READ'
             self.ecode, self.file = args
-            self.args = ("Error accessing %s" %(self.file,self.mode),)
+            self.args = ("Error accessing %s" % self.file,)
         elif args[0] == self.FILE_FAILED_WRITE:
             self.ename = 'FILE_FAILED_WRITE'
             self.ecode, self.file, self.reason = args
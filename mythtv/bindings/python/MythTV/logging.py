@@ -7,10 +7,13 @@ from MythTV.exceptions import MythError
 import os
 import syslog
 import codecs
+import atexit
 
 from sys import version_info, stdout, argv
 from datetime import datetime
 from thread import allocate_lock
+from threading import Thread, Condition, current_thread
+from collections import deque
 from StringIO import StringIO
 from traceback import format_exc
 
@@ -20,8 +23,149 @@ def _donothing(*args, **kwargs):
 class DummyLogger( LOGLEVEL, LOGMASK, LOGFACILITY ):
     def __init__(self, module=None, db=None): pass
     def logTB(self, mask): pass
-    def log(self, mask, level, message, detail=None): pass
-    def __call__(self, mask, level, message, detail=None): pass
+    def isEnabledFor(self, mask, level): return False
+    def log(self, mask, level, message, detail=None, args=None): pass
+    def __call__(self, mask, level, message, detail=None, args=None): pass
+
+class _LogWriter( Thread ):
+    """
+    Background thread taking log messages from a bounded queue, and writing
+        them out in batches, with a single flush of the log file and a
+        single multi-row insert into the database per batch.
+    """
+    def __init__(self, logcls, interval=1.0, maxsize=4096, batchsize=512):
+        Thread.__init__(self, name='Python Log Writer')
+        self.daemon = True
+        self.logcls = logcls
+        self.interval = interval
+        self.maxsize = maxsize
+        self.batchsize = batchsize
+
+        self._queue = deque()
+        self._cond = Condition()
+        self._running = True
+        self._queued = 0
+        self._done = 0
+        self._dropped = 0
+        self._reported = 0
+        self.stats = {'written':0, 'dropped':0, 'coalesced':0,
+                      'dberrors':0, 'peak':0}
+
+    def put(self, log, mask, level, message, detail):
+        with self._cond:
+            if len(self._queue) >= self.maxsize:
+                last = self._queue[-1]
+                if (last[0].module == log.module) and (last[2] == level) and \
+                        (last[3] == message) and (last[4] == detail):
+                    last[6] += 1
+                    self.stats['coalesced'] += 1
+                    return
+                if level > LOGLEVEL.ERR:
+                    self._dropped += 1
+                    self.stats['dropped'] += 1
+                    return
+                # never discard errors, wait for the writer instead, unless
+                # logged by the writer itself, which would wait forever
+                while self._running and (len(self._queue) >= self.maxsize) \
+                        and (current_thread() is not self):
+                    self._cond.notify_all()
+                    self._cond.wait(self.interval)
+
+            self._queue.append([log, mask, level, message, detail,
+                                log.time(), 0])
+            self._queued += 1
+            if len(self._queue) > self.stats['peak']:
+                self.stats['peak'] = len(self._queue)
+            if len(self._queue) >= self.batchsize:
+                self._cond.notify_all()
+
+    def run(self):
+        while True:
+            with self._cond:
+                if self._running and (len(self._queue) < self.batchsize):
+                    self._cond.wait(self.interval)
+                batch = self._queue
+                self._queue = deque()
+                dropped = self._dropped - self._reported
+                self._reported = self._dropped
+                running = self._running
+                self._cond.notify_all()
+
+            if len(batch) or dropped:
+                try:
+                    self._write(batch, dropped)
+                except:
+                    pass
+
+            with self._cond:
+                self._done += len(batch)
+                self.stats['written'] += len(batch)
+                self._cond.notify_all()
+            batch = None
+
+            if not running:
+                with self._cond:
+                    if not len(self._queue):
+                        break
+
+    def _write(self, batch, dropped):
+        cls = self.logcls
+        lines = []
+        rows = {}
+        for rec in batch:
+            log, mask, level, message, detail, msgtime, repeat = rec
+            msgs = [(level, message, detail)]
+            if repeat:
+                msgs.append((level,
+                             "Last message repeated %d times" % repeat, None))
+            for msg in msgs:
+                if cls._SYSLOG:
+                    log._logsyslog(mask, *msg)
+                elif not (cls._QUIET and (cls._LOGFILE == stdout)):
+                    lines.append(log._formatfile(*(msg+(msgtime,))))
+                if log.db and cls._DBLOG:
+                    rows.setdefault(id(log.db), (log.db, []))[1]\
+                                .append(log._dbrow(*(msg+(msgtime,))))
+
+        if dropped:
+            msg = (LOGLEVEL.WARNING, "Log queue full, %d messages dropped" \
+                                        % dropped, None)
+            if cls._SYSLOG:
+                syslog.syslog(*msg[:2])
+            else:
+                lines.append(MythLog('pythonbindings')._formatfile(*msg))
+
+        if lines:
+            with cls._lock:
+                if cls._LOGFILE:
+                    cls._LOGFILE.write(''.join(lines))
+                    cls._LOGFILE.flush()
+
+        for db, dbrows in rows.values():
+            try:
+                with db.cursor(DummyLogger()) as cursor:
+                    cursor.executemany(MythLog._dbquery, dbrows)
+            except:
+                self.stats['dberrors'] += 1
+
+    def flush(self):
+        with self._cond:
+            target = self._queued
+            self._cond.notify_all()
+            while (self._done < target) and self.isAlive():
+                self._cond.wait(self.interval)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self.join()
+
+    def getStats(self):
+        with self._cond:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._queue)
+            return stats
 
 class MythLog( LOGLEVEL, LOGMASK, LOGFACILITY ):
     """
@@ -36,6 +180,8 @@ class MythLog( LOGLEVEL, LOGMASK, LOGFACILITY ):
 
     The filter level is global values, shared between all logging instances.
     The logging object is callable, and implements the MythLog.log() method.
+    Messages are written synchronously, unless MythLog.setAsync() has been
+    called to hand them to a background writer.
     """
 
     helptext = """Verbose debug levels.
@@ -98,6 +244,7 @@ class MythLog( LOGLEVEL, LOGMASK, LOGFACILITY ):
         cls._QUIET = 0
         cls._DBLOG = True
         cls._SYSLOG = None
+        cls._WRITER = None
         cls._lock = allocate_lock()
         cls._parseinput()
 
@@ -303,6 +450,65 @@ class MythLog( LOGLEVEL, LOGMASK, LOGFACILITY ):
                 cls._LOGFILE.close()
             cls._LOGFILE = None
 
+    @classmethod
+    def setAsync(cls, enable=True, interval=1.0, maxsize=4096):
+        """
+        MythLog.setAsync(enable=True, interval=1.0, maxsize=4096) -> None
+
+        Hand log messages to a background thread, which writes them out in
+            batches at least every 'interval' seconds, rather than writing
+            and flushing each message on the calling thread. Up to 'maxsize'
+            messages are held. When full, repeats of the last message are
+            counted rather than queued, other messages below error level
+            are dropped, and errors wait for the writer to catch up.
+            Pending messages are flushed on exit.
+        """
+        cls._initlogger()
+        if cls._WRITER is not None:
+            cls._WRITER.stop()
+            cls._WRITER = None
+        if enable:
+            cls._WRITER = _LogWriter(cls, interval, maxsize)
+            cls._WRITER.start()
+            cls._registerexit()
+
+    @classmethod
+    def _registerexit(cls):
+        cls._registerexit = classmethod(_donothing)
+        atexit.register(cls._stopasync)
+
+    @classmethod
+    def _stopasync(cls):
+        if cls._WRITER is not None:
+            cls._WRITER.stop()
+            cls._WRITER = None
+
+    @classmethod
+    def flush(cls):
+        """
+        MythLog.flush() -> None
+
+        Blocks until all messages queued by the background writer have
+            been written.
+        """
+        cls._initlogger()
+        if cls._WRITER is not None:
+            cls._WRITER.flush()
+
+    @classmethod
+    def getLogStats(cls):
+        """
+        MythLog.getLogStats() -> dict
+
+        Returns counts of messages written, dropped, and coalesced by the
+            background writer, along with failed database inserts, and the
+            current and peak queue depth. Empty if not in use.
+        """
+        cls._initlogger()
+        if cls._WRITER is None:
+            return {}
+        return cls._WRITER.getStats()
+
     @classmethod
     def _parsemask(cls, mstr=None):
         bwlist = (  'important','general','record','playback','channel','osd',
@@ -348,9 +554,19 @@ class MythLog( LOGLEVEL, LOGMASK, LOGFACILITY ):
         """
         self.log(mask, self.CRIT, format_exc())
 
-    def log(self, mask, level, message, detail=None):
+    def isEnabledFor(self, mask, level):
+        """
+        MythLog.isEnabledFor(mask, level) -> bool
+
+        Returns whether a message with the given mask and level would be
+            logged. Use to skip building expensive messages.
+        """
+        return (level <= self._LEVEL) and bool(mask&self._MASK) and \
+               (self._QUIET < 2)
+
+    def log(self, mask, level, message, detail=None, args=None):
         """
-        MythLog.log(mask, message, detail=None) -> None
+        MythLog.log(mask, level, message, detail=None, args=None) -> None
 
         'mask' sets the bitwise log mask, to be matched against the log
                     filter. If any bits match true, the message will be logged.
@@ -358,6 +574,8 @@ class MythLog( LOGLEVEL, LOGMASK, LOGFACILITY ):
                 <timestamp> <module>: <message>
                         ---- or ----
                 <timestamp> <module>: <message> -- <detail>
+        'args', if given, is a tuple substituted into 'message' using the
+                    '%' operator, only if the message is to be logged.
         """
         if level > self._LEVEL:
             return
@@ -365,6 +583,13 @@ class MythLog( LOGLEVEL, LOGMASK, LOGFACILITY ):
             return
         if self._QUIET > 1:
             return
+        if args:
+            message = message % args
+
+        writer = self._WRITER
+        if writer is not None:
+            writer.put(self, mask, level, message, detail)
+            return
 
         with self._lock:
             self._logwrite(mask, level, message, detail)
@@ -374,9 +599,13 @@ class MythLog( LOGLEVEL, LOGMASK, LOGFACILITY ):
         if self._QUIET and (self._LOGFILE == stdout):
             return
 
+        self._LOGFILE.write(self._formatfile(level, message, detail))
+        self._LOGFILE.flush()
+
+    def _formatfile(self, level, message, detail, msgtime=None):
         buff = StringIO()
         buff.write("{0} {3} [{1}] {2} "\
-            .format(self.time(), os.getpid(), self.module,
+            .format(msgtime or self.time(), os.getpid(), self.module,
                     ['!','A','C','E','W','N','I','D'][level]))
 
         multiline = False
@@ -398,28 +627,30 @@ class MythLog( LOGLEVEL, LOGMASK, LOGFACILITY ):
                 buff.write(' -- %s' % detail)
 
         buff.write('\n')
-
-        self._LOGFILE.write(buff.getvalue())
-        self._LOGFILE.flush()
+        return buff.getvalue()
 
     def _logsyslog(self, mask, level, message, detail):
         syslog.syslog(level,
                       message + (' -- {0}'.format(detail) if detail else ''))
 
+    _dbquery = """INSERT INTO logging
+                        (host, application, pid, thread,
+                         msgtime, level, message)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
+    def _dbrow(self, level, message, detail, msgtime=None):
+        application = argv[0]
+        if '/' in application:
+            application = application.rsplit('/', 1)[1]
+        return (self.db.gethostname(), application,
+                os.getpid(), self.module, msgtime or self.time(), level,
+                message + (' -- {0}'.format(detail) if detail else ''))
+
     def _logdatabase(self, mask, level, message, detail):
         if self.db and self._DBLOG:
             with self.db.cursor(DummyLogger()) as cursor:
-                application = argv[0]
-                if '/' in application:
-                    application = application.rsplit('/', 1)[1]
-
-                cursor.execute("""INSERT INTO logging
-                                    (host, application, pid, thread,
-                                     msgtime, level, message)
-                                  VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                    (self.db.gethostname(), application,
-                     os.getpid(), self.module, self.time(), level,
-                     message + (' -- {0}'.format(detail) if detail else '')))
-
-    def __call__(self, mask, level, message, detail=None):
-        self.log(mask, level, message, detail)
+                cursor.execute(self._dbquery,
+                               self._dbrow(level, message, detail))
+
+    def __call__(self, mask, level, message, detail=None, args=None):
+        self.log(mask, level, message, detail, args)
@@ -622,6 +622,10 @@ class MythDB( DBCache ):
         obj.searchRecord()      - return a list of matching Record rules
         obj.getFrontends()      - return a list of available Frontends
         obj.getFrontend()       - return a single Frontend object
+
+    The search methods also accept 'order', 'limit' and 'after' keywords
+        for paging through results, and provide a 'count' method taking
+        the same keywords, e.g. obj.searchRecorded.count(title='News').
     """
 
 
@@ -8,15 +8,19 @@ from MythTV.static import PROTO_VERSION, BACKEND_SEP, RECSTATUS, AUDIO_PROPS, \
                           VIDEO_PROPS, SUBTITLE_TYPES
 from MythTV.exceptions import MythError, MythDBError, MythBEError, MythFileError
 from MythTV.logging import MythLog
-from MythTV.altdict import DictData
-from MythTV.connections import BEConnection, BEEventConnection
+from MythTV.altdict import DictData, LazyDictData
+from MythTV.connections import BEConnection, BEEventConnection, \
+                               BECommandPool, AsyncBEConnection, MythFuture
 from MythTV.database import DBCache
 from MythTV.utility import CMPRecord, datetime, \
                            ParseEnum, CopyData, CopyData2, check_ipv6
 
 from datetime import date
-from time import sleep
+from time import sleep, time
 from thread import allocate_lock
+from threading import Thread, Condition
+from collections import deque
+from itertools import islice
 from random import randint
 import socket
 import weakref
@@ -41,15 +45,27 @@ class BECache( object ):
     Available methods:
         backendCommand()    - Sends a formatted command to the backend
                               and returns the response.
+        setCommandPool()    - Dispatch commands over a pool of connections
+        getCommandStats()   - Return per-command latency counters
     """
 
     class _ConnHolder( object ):
         blockshutdown = 0
         command = None
         event = None
+        pool = None
 
     logmodule = 'Python Backend Connection'
     _shared = weakref.WeakValueDictionary()
+    _defcommandpool = None
+
+    @classmethod
+    def setDefaultCommandPool(cls, maxsize):
+        """
+        Set the default number of concurrent commands for new backend
+            connections. 'None' disables the command pool.
+        """
+        cls._defcommandpool = maxsize
     _reip = re.compile('(?:\d{1,3}\.){3}\d{1,3}')
 
     def __repr__(self):
@@ -121,6 +137,8 @@ class BECache( object ):
                     self._conn.blockshutdown = 1
             if self.receiveevents:
                 self._conn.event = self._neweventconn()
+            if self.sendcommands and self._defcommandpool:
+                self.setCommandPool(self._defcommandpool)
 
             self._shared[self._ident] = self._conn
 
@@ -150,19 +168,89 @@ class BECache( object ):
 
         Sends a formatted command via a socket to the mythbackend.
         """
+        if self._conn.pool is not None:
+            return self._conn.pool.backendCommand(data)
         if self._conn.command is None:
             return ""
         return self._conn.command.backendCommand(data)
 
+    def backendCommandStream(self, data):
+        """
+        obj.backendCommandStream(data) -> field iterator
+
+        Sends a formatted command to the mythbackend, yielding the fields of
+            the response as they are received.
+        """
+        if self._conn.pool is not None:
+            return self._conn.pool.backendCommandStream(data)
+        if self._conn.command is None:
+            return iter([])
+        return self._conn.command.backendCommandStream(data)
+
+    def setCommandPool(self, maxsize=4):
+        """
+        obj.setCommandPool(maxsize=4) -> None
+
+        Dispatch commands for this backend over a pool of up to 'maxsize'
+            additional connections, rather than serializing all threads
+            on the shared command socket. The setting applies to every
+            object sharing this connection. 'None' closes the pool.
+        """
+        pool = self._conn.pool
+        if maxsize is None:
+            self._conn.pool = None
+            if pool is not None:
+                pool.close()
+        elif pool is None:
+            self._conn.pool = BECommandPool(self.host, self.port,
+                                        self.db.gethostname(), maxsize)
+        else:
+            pool.resizePool(pool._poolsize, maxsize)
+
+    def getCommandStats(self):
+        """
+        obj.getCommandStats() -> dict
+
+        Returns latency counters keyed by command name, along with pool
+            occupancy under the 'pool' key. Empty if no pool is in use.
+        """
+        if self._conn.pool is None:
+            return {}
+        stats = self._conn.pool.getCommandStats()
+        stats['pool'] = self._conn.pool.getPoolStats()
+        return stats
+
     def _listhandlers(self):
         return []
 
-    def registerevent(self, func, regex=None):
+    def registerevent(self, func, regex=None, since=None):
         if self._conn.event is None:
             return
         if regex is None:
             regex = func()
-        self._conn.event.registerevent(regex, func)
+        self._conn.event.registerevent(regex, func, since)
+
+    def setEventBuffer(self, maxsize=None, policy=None, replaysize=None):
+        """
+        obj.setEventBuffer(maxsize=None, policy=None, replaysize=None) -> None
+
+        Changes the size, overflow policy, and replay window of the event
+            buffer shared by all listeners on this backend. See EventBuffer.
+        """
+        if self._conn.event is not None:
+            self._conn.event.eventqueue.configure(maxsize, policy, replaysize)
+
+    def getEventStats(self):
+        """
+        obj.getEventStats() -> dict
+
+        Returns event buffer counters, and per handler lag. The 'lastseq'
+            of a handler can be passed to registerevent() as 'since' to
+            receive events it has missed.
+        """
+        if self._conn.event is None:
+            return {}
+        return self._conn.event.getEventStats()
 
     def clearevents(self):
         self._events = []
@@ -192,7 +280,7 @@ def findfile(filename, sgroup, db=None):
     return None
 
 def ftopen(file, mode, forceremote=False, nooverwrite=False, db=None, \
-                       chanid=None, starttime=None, download=False):
+                       chanid=None, starttime=None, download=False, streams=1):
     """
     ftopen(file, mode, forceremote=False, nooverwrite=False, db=None)
                                         -> FileTransfer object
@@ -205,6 +293,8 @@ def ftopen(file, mode, forceremote=False, nooverwrite=False, db=None, \
     'mode' takes a 'r' or 'w'
     'nooverwrite' will refuse to open a file writable,
                 if a local file is found.
+    'streams' greater than 1 opens remote files for reading as a
+                ParallelFileTransfer, copying over that many sockets.
     """
     db = DBCache(db)
     log = MythLog('Python File Transfer', db=db)
@@ -223,6 +313,10 @@ def ftopen(file, mode, forceremote=False, nooverwrite=False, db=None, \
         protoopen = lambda host, lfile, storagegroup: \
                       DownloadFileTransfer(host, lfile, storagegroup, \
                                            mode, file, db)
+    elif (streams > 1) and (mode == 'r'):
+        protoopen = lambda host, file, storagegroup: \
+                      ParallelFileTransfer(host, file, storagegroup, \
+                                           mode, streams, db)
     else:
         protoopen = lambda host, file, storagegroup: \
                       FileTransfer(host, file, storagegroup, mode, db)
@@ -312,6 +406,217 @@ def ftopen(file, mode, forceremote=False, nooverwrite=False, db=None, \
         # file not found, open remote
             return protoopen(host, filename, sgroup)
 
+class _ReadAhead( Thread ):
+    """
+    Background reader for FileTransfer.  Keeps several REQUEST_BLOCK
+        commands in flight on a dedicated control connection, queueing the
+        returned data in a bounded buffer for FileTransfer.read().  Block
+        size and pipeline depth are adjusted to the measured throughput.
+    """
+    _minblock = 2**15
+    _maxblock = 2**21
+    _maxdepth = 16
+    _window = 0.5
+    _poll = 0.1
+
+    def __init__(self, ft, buffersize):
+        Thread.__init__(self, name='FileTransfer read-ahead')
+        self.daemon = True
+        self.log = ft.log
+        self._ft = weakref.ref(ft)
+        self._sockno = str(ft._sockno)
+        self._data = ft.ftsock
+        self._deadline = self._data.socket.getdeadline()
+        # REQUEST_BLOCK replies cannot be pipelined on the shared control
+        # socket without holding its lock for the whole exchange
+        self._conn = BEConnection(ft.host, ft.port,
+                                  ft._conn.command.localname)
+
+        self._cond = Condition()
+        self._blocks = deque()
+        self._offset = 0
+        self._buffered = 0
+        self._buffersize = max(buffersize, 4*self._minblock)
+        self._reqpos = ft._pos
+        self._stopped = False
+        self._error = None
+
+        self.blocksize = max(self._minblock, ft._tsize)
+        self.depth = 2
+        self.rate = 0.0
+
+    def _getsize(self):
+        ft = self._ft()
+        if ft is None:
+            self._stopped = True
+            return self._reqpos
+        return ft._size
+
+    def _adapt(self, stats, now):
+        # called once per measurement window with bytes received, the
+        # smallest request round trip seen, and the window start time
+        count, minrtt, start = stats
+        rate = count/(now-start)
+        if rate > self.rate*1.05:
+            # larger blocks are still paying off
+            self.blocksize = min(self.blocksize*2, self._maxblock,
+                                 self._buffersize/4)
+        elif rate < self.rate*0.9:
+            self.blocksize = max(self.blocksize/2, self._minblock)
+        self.rate = rate
+        # keep enough requests queued to cover the bandwidth-delay product
+        depth = int(rate*minrtt/self.blocksize)+2
+        self.depth = max(2, min(depth, self._maxdepth,
+                                self._buffersize/self.blocksize))
+        if self.log.isEnabledFor(self.log.FILE, self.log.DEBUG):
+            self.log(self.log.FILE, self.log.DEBUG, 'Read-ahead adjusted',
+                     'rate=%d/s rtt=%.3fs block=%d depth=%d' % \
+                            (rate, minrtt, self.blocksize, self.depth))
+
+    def _recvblock(self, deadline):
+        res = self._conn.socket.recvheader(deadline=deadline)
+        try:
+            ct = int(res)
+        except ValueError:
+            raise MythFileError(MythError.FILE_FAILED_READ, self._sockno)
+        if ct < 0:
+            raise MythFileError(MythError.FILE_FAILED_READ, self._sockno)
+        if ct == 0:
+            return ''
+        data = bytearray(ct)
+        if self._data.recv_into(data, ct) != ct:
+            raise MythFileError(MythError.FILE_FAILED_READ, self._sockno)
+        return data
+
+    def run(self):
+        inflight = deque()
+        pending = 0
+        stats = [0, self._deadline, time()]
+        try:
+            while True:
+                sizes = []
+                with self._cond:
+                    if not self._stopped:
+                        size = self._getsize()
+                        room = self._buffersize - self._buffered - pending
+                        while len(inflight)+len(sizes) < self.depth:
+                            ct = min(self.blocksize, size - self._reqpos)
+                            if (ct <= 0) or (ct > room):
+                                break
+                            sizes.append(ct)
+                            room -= ct
+                            pending += ct
+                            self._reqpos += ct
+                    if not (inflight or sizes):
+                        if self._stopped:
+                            return
+                        # wait for buffer space, or for the file to grow
+                        self._cond.wait(self._poll)
+                        continue
+
+                sent = time()
+                for ct in sizes:
+                    self._conn.socket.sendheader('QUERY_FILETRANSFER '+\
+                            BACKEND_SEP.join(
+                                [self._sockno, 'REQUEST_BLOCK', str(ct)]))
+                    inflight.append((ct, sent))
+
+                ct, sent = inflight.popleft()
+                data = self._recvblock(time()+self._deadline)
+                now = time()
+                pending -= ct
+
+                with self._cond:
+                    # backend only advances by the amount actually sent
+                    self._reqpos -= ct - len(data)
+                    if data and not self._stopped:
+                        self._blocks.append(data)
+                        self._buffered += len(data)
+                        self._cond.notify_all()
+                    elif not data:
+                        # nothing available yet, back off briefly
+                        self._cond.wait(self._poll)
+
+                stats[0] += len(data)
+                stats[1] = min(stats[1], now-sent)
+                if now - stats[2] > self._window:
+                    self._adapt(stats, now)
+                    stats = [0, self._deadline, now]
+        except Exception, e:
+            self.log(self.log.FILE, self.log.ERR,
+                     'Read-ahead failed', str(e))
+            with self._cond:
+                self._error = e
+                self._stopped = True
+                self._cond.notify_all()
+            # the data socket is only usable again once every outstanding
+            # reply has been consumed
+            try:
+                while inflight:
+                    inflight.popleft()
+                    self._recvblock(time()+self._deadline)
+            except Exception:
+                self._error = MythFileError(MythError.FILE_ERROR,
+                                  'transfer socket out of sync')
+
+    def readinto(self, view):
+        """
+        Copy up to len(view) bytes into 'view', copying blocks as they
+            arrive, so requests larger than the buffer can be filled.
+            Returns the number of bytes copied, which is short only if
+            the read-ahead has stopped.
+        """
+        size = len(view)
+        pos = 0
+        with self._cond:
+            while pos < size:
+                # deadline applies to each wait for more data
+                deadline = time()+self._deadline
+                while (self._buffered == 0) and (self._error is None):
+                    if self._stopped:
+                        break
+                    if time() > deadline:
+                        raise MythFileError(MythError.FILE_FAILED_READ,
+                                            self._sockno)
+                    self._cond.wait(deadline-time())
+                if self._buffered == 0:
+                    if (self._error is not None) and (pos == 0):
+                        raise self._error
+                    break
+
+                end = min(size, pos+self._buffered)
+                start = pos
+                while pos < end:
+                    block = self._blocks[0]
+                    ct = min(len(block)-self._offset, end-pos)
+                    view[pos:pos+ct] = \
+                            memoryview(block)[self._offset:self._offset+ct]
+                    self._offset += ct
+                    if self._offset == len(block):
+                        self._blocks.popleft()
+                        self._offset = 0
+                    pos += ct
+                self._buffered -= pos-start
+                # wake the reader to refill the space just freed
+                self._cond.notify_all()
+            return pos
+
+    def stop(self):
+        """
+        Stop issuing requests and wait for outstanding replies to drain.
+            Returns the backend file position.
+        """
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self.isAlive():
+            self.join()
+        self._conn.disconnect()
+        if isinstance(self._error, MythFileError) and \
+                (self._error.ecode == MythError.FILE_ERROR):
+            raise self._error
+        return self._reqpos
+
 class FileTransfer( BEEvent ):
     """
     A connection to mythbackend intended for file transfers.
@@ -345,8 +650,8 @@ class FileTransfer( BEEvent ):
                 self._size = int(sp[2])
 
         def __del__(self):
-            self.socket.shutdown(1)
-            self.socket.close()
+            if self.connected:
+                self.disconnect(True)
 
         def send(self, buffer):
             return self.socket.send(buffer)
@@ -354,6 +659,12 @@ class FileTransfer( BEEvent ):
         def recv(self, count):
             return self.socket.dlrecv(count)
 
+        def recv_into(self, buffer, count=None):
+            return self.socket.dlrecv_into(buffer, count)
+
+        def sendall(self, buffer):
+            return self.socket.dlsendall(buffer)
+
     def __str__(self):
         return 'myth://%s@%s/%s' % (self.sgroup, self.host, self.filename)
 
@@ -381,12 +692,31 @@ class FileTransfer( BEEvent ):
         self._tmax = 2**17
         self._count = 0
         self._step = 2**12
+        self._readahead = None
+        self._rasize = None
+        self._wbuff = bytearray()
+        self._wconn = None
+        self._wpending = deque()
+        self._wsize = self._tsize
+        self._wmax = 2**21
+        self._wdepth = 4
 
     def __del__(self):
-        self.backendCommand('QUERY_FILETRANSFER '+BACKEND_SEP.join(
-                                        [str(self._sockno), 'DONE']))
-        del self.ftsock
-        self.open = False
+        if self._readahead is not None:
+            self._readahead.stop()
+            self._readahead = None
+        self._rasize = None
+        try:
+            if self.mode == 'w':
+                self.flush()
+        finally:
+            if self._wconn is not None:
+                self._wconn.disconnect()
+                self._wconn = None
+            self.backendCommand('QUERY_FILETRANSFER '+BACKEND_SEP.join(
+                                            [str(self._sockno), 'DONE']))
+            del self.ftsock
+            self.open = False
 
     def tell(self):
         """FileTransfer.tell() -> current offset in file"""
@@ -400,23 +730,73 @@ class FileTransfer( BEEvent ):
         """FileTransfer.rewind() -> None"""
         self.seek(0)
 
+    def setReadAhead(self, enable=True, buffersize=2**24):
+        """
+        FileTransfer.setReadAhead(enable=True, buffersize=2**24) -> None
+            Serve reads from a background thread that keeps multiple
+            block requests in flight on a second control connection.
+            'buffersize' bounds the memory used for buffered and
+            requested data.
+        """
+        if self.mode != 'r':
+            raise MythFileError('read-ahead requires a read-only socket')
+        if self._readahead is not None:
+            self._stopreadahead()
+        self._rasize = buffersize if enable else None
+
+    def _stopreadahead(self):
+        ra = self._readahead
+        self._readahead = None
+        if ra.stop() != self._pos:
+            # discard the backend position of anything read ahead
+            self.seek(self._pos)
+
     def read(self, size):
         """
         FileTransfer.read(size) -> string of <size> characters
             Requests over 128KB will be buffered internally.
         """
+        if self.mode != 'r':
+            raise MythFileError('attempting to read from a write-only socket')
+        if self._pos + size > self._size:
+            size = self._size - self._pos
+        if size <= 0:
+            return ''
+
+        buff = bytearray(size)
+        ct = self.readinto(buff)
+        if ct < size:
+            del buff[ct:]
+        return str(buff)
+
+    def readinto(self, buffer):
+        """
+        FileTransfer.readinto(buffer) -> number of bytes read
+            Reads up to len(buffer) bytes directly into a writable
+            bytearray or memoryview.
+        """
 
         # some sanity checking
         if self.mode != 'r':
             raise MythFileError('attempting to read from a write-only socket')
-        if size == 0:
-            return ''
+        view = memoryview(buffer)
+        size = len(view)
         if self._pos + size > self._size:
             size = self._size - self._pos
+        if size <= 0:
+            return 0
+
+        if self._rasize is not None:
+            if self._readahead is None:
+                self._readahead = _ReadAhead(self, self._rasize)
+                self._readahead.start()
+            ct = self._readahead.readinto(view[:size])
+            self._pos += ct
+            return ct
 
-        buff = ''
-        while len(buff) < size:
-            ct = size - len(buff)
+        pos = 0
+        while pos < size:
+            ct = size - pos
             if ct > self._tsize:
                 # drop size and bump counter if over limit
                 self._count += 1
@@ -455,40 +835,118 @@ class FileTransfer( BEEvent ):
                 if self._tsize < self._step:
                     self._tsize = self._step
 
-            # append data and move position
-            buff += self.ftsock.recv(ct)
-            self._pos += ct
-        return buff
+            # receive data in place and move position. the backend has
+            # already sent 'ct' bytes, so wait for all of them rather than
+            # leave any to be mistaken for data from a later request
+            got = 0
+            while got < ct:
+                n = self.ftsock.recv_into(view[pos+got:pos+ct], ct-got)
+                if n == 0:
+                    # nothing within a full deadline, the stream is lost
+                    self._pos += got
+                    raise MythFileError(MythError.FILE_FAILED_READ, str(self))
+                got += n
+                if got < ct:
+                    self._count = 0
+            pos += got
+            self._pos += got
+        return pos
 
     def write(self, data):
         """
         FileTransfer.write(data) -> None
-            Requests over 128KB will be buffered internally
+            Writes are buffered, and sent to the backend in blocks whose
+            size grows with sustained transfers.  Blocks are acknowledged
+            asynchronously; flush() waits for all outstanding
+            acknowledgements.
         """
         if self.mode != 'w':
             raise MythFileError('attempting to write to a read-only socket')
-        while len(data) > 0:
-            size = len(data)
-            # check size for buffering
-            if size > self._tsize:
-                size = self._tsize
-                buff = data[:size]
-                data = data[size:]
-            else:
-                buff = data
-                data = ''
-            # push data to server
-            self._pos += int(self.ftsock.send(buff))
-            if self._pos > self._size:
-                self._size = self._pos
-            # inform server of new data
-            self.backendCommand('QUERY_FILETRANSFER '\
-                    +BACKEND_SEP.join(\
-                            [str(self._sockno),
-                             'WRITE_BLOCK',
-                             str(size)]))
+        size = len(data)
+        if size == 0:
+            return
+
+        if (len(self._wbuff) == 0) and (size >= self._wsize):
+            # large write, push directly without copying into the buffer
+            view = memoryview(data)
+            pos = 0
+            while size - pos >= self._wsize:
+                ct = self._wsize
+                self._pushblock(view[pos:pos+ct])
+                pos += ct
+            self._wbuff += view[pos:]
+        else:
+            self._wbuff += data
+            while len(self._wbuff) >= self._wsize:
+                ct = self._wsize
+                self._pushblock(self._wbuff[:ct])
+                del self._wbuff[:ct]
+
+        self._pos += size
+        if self._pos > self._size:
+            self._size = self._pos
         return
 
+    def _pushblock(self, data):
+        # send a block, pipelining WRITE_BLOCK on a dedicated connection
+        if self._wconn is None:
+            self._wconn = BEConnection(self.host, self.port,
+                                       self._conn.command.localname)
+        while len(self._wpending) >= self._wdepth:
+            self._ackblock()
+
+        ct = len(data)
+        self._wconn.socket.sendheader('QUERY_FILETRANSFER '+BACKEND_SEP.join(
+                            [str(self._sockno), 'WRITE_BLOCK', str(ct)]))
+        self._wpending.append(ct)
+        if self.ftsock.sendall(data) != ct:
+            raise MythFileError(MythError.FILE_FAILED_WRITE, str(self),
+                                'transfer socket timed out')
+
+    def _ackblock(self):
+        ct = self._wpending.popleft()
+        try:
+            res = int(self._wconn.socket.recvheader(
+                            deadline=self._wconn.socket.getdeadline()))
+        except ValueError:
+            res = -1
+        if res != ct:
+            self._wpending.clear()
+            self._wconn.disconnect(True)
+            self._wconn = None
+            raise MythFileError(MythError.FILE_FAILED_WRITE, str(self),
+                                'backend wrote %d of %d bytes' % (res, ct))
+        if self._wsize < self._wmax:
+            # full block acknowledged, try a larger one
+            self._wsize *= 2
+
+    def flush(self):
+        """
+        FileTransfer.flush() -> None
+            Send any buffered data, and wait for the backend to
+            acknowledge all outstanding blocks.
+        """
+        if self.mode != 'w':
+            return
+        if len(self._wbuff):
+            data = str(self._wbuff)
+            del self._wbuff[:]
+            if (self._wconn is None) and (len(data) <= self._tsize):
+                # small single block, no need for a second connection
+                self.ftsock.sendall(data)
+                res = self.backendCommand('QUERY_FILETRANSFER '+\
+                            BACKEND_SEP.join(
+                                [str(self._sockno),
+                                 'WRITE_BLOCK',
+                                 str(len(data))]))
+                if res != str(len(data)):
+                    raise MythFileError(MythError.FILE_FAILED_WRITE,
+                                str(self), 'backend returned %s' % res)
+            else:
+                self._pushblock(data)
+        while self._wpending:
+            self._ackblock()
+
     def seek(self, offset, whence=0):
         """
         FileTransfer.seek(offset, whence=0) -> None
@@ -515,6 +973,16 @@ class FileTransfer( BEEvent ):
             whence = 0
             offset = self._size+offset
 
+        self.flush()
+        if self._readahead is not None:
+            if whence == 1:
+                offset += self._pos
+                whence = 0
+            ra = self._readahead
+            self._readahead = None
+            # backend is positioned past any data read ahead
+            self._pos = ra.stop()
+
         res = self.backendCommand('QUERY_FILETRANSFER '\
                 +BACKEND_SEP.join(
                         [str(self._sockno),'SEEK',
@@ -527,9 +995,6 @@ class FileTransfer( BEEvent ):
                                     str(self), offset, whence)
         self._pos = int(res[0])
 
-    def flush(self):
-        pass
-
 class RecordFileTransfer( FileTransfer ):
     """
     A connection to mythbackend intended for file transfers.
@@ -611,6 +1076,401 @@ class DownloadFileTransfer( FileTransfer ):
             FileOps(self.host, db=self.db).\
                         deleteFile(self.filename, self.sgroup)
 
+class ParallelFileTransfer( FileTransfer ):
+    """
+    A connection to mythbackend intended for copying large files.
+    Behaves as a read-only FileTransfer, and additionally provides
+        copyTo(), which downloads the file over several transfer sockets
+        at once, each working through its own byte ranges.
+    """
+    logmodule = 'Python ParallelFileTransfer'
+    _rangesize = 2**26
+    _blocksize = 2**20
+
+    def __init__(self, host, filename, sgroup, mode='r', streams=4, db=None):
+        if mode != 'r':
+            raise MythFileError('parallel transfers are read-only')
+        self.streams = max(1, streams)
+        FileTransfer.__init__(self, host, filename, sgroup, mode, db)
+
+    def copyTo(self, dest, progress=None, retries=3):
+        """
+        ParallelFileTransfer.copyTo(dest, progress=None, retries=3)
+                                                        -> bytes copied
+            Copy the remote file to the local path 'dest'.  'progress' is
+            called as progress(copied, total) from the transfer threads.
+            Each range is restarted on a fresh connection up to 'retries'
+            times before the copy is abandoned.
+        """
+        size = self._size
+        fp = open(dest, 'wb')
+        fp.truncate(size)
+        fp.close()
+
+        ranges = deque((start, min(start+self._rangesize, size))
+                            for start in xrange(0, size, self._rangesize))
+        state = {'copied':0, 'errors':[]}
+        lock = allocate_lock()
+
+        def update(count):
+            with lock:
+                state['copied'] += count
+                copied = state['copied']
+            if progress is not None:
+                progress(copied, size)
+
+        def worker():
+            try:
+                stream = None
+                with open(dest, 'r+b') as fp:
+                    while True:
+                        with lock:
+                            if (not ranges) or state['errors']:
+                                break
+                            start, end = ranges.popleft()
+                        pos = [start]
+                        attempt = 0
+                        while pos[0] < end:
+                            try:
+                                if stream is None:
+                                    stream = self._openstream()
+                                self._copyrange(stream, fp, pos, end, update)
+                            except (MythError, socket.error), e:
+                                self._closestream(stream)
+                                stream = None
+                                attempt += 1
+                                if attempt > retries:
+                                    raise
+                                self.log(self.log.FILE, self.log.WARNING,
+                                         'Retrying range %d-%d' % (pos[0], end),
+                                         str(e))
+                self._closestream(stream)
+            except Exception, e:
+                with lock:
+                    state['errors'].append(e)
+
+        threads = [Thread(target=worker, name='ParallelFileTransfer')
+                        for i in range(min(self.streams, len(ranges)))]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            t.join()
+        if state['errors']:
+            raise state['errors'][0]
+        return state['copied']
+
+    def _openstream(self):
+        localname = self._conn.command.localname
+        control = BEConnection(self.host, self.port, localname)
+        data = self.BETransConn(self.host, self.port, localname,
+                                self.filename, self.sgroup, 'r')
+        return control, data
+
+    def _closestream(self, stream):
+        if stream is None:
+            return
+        # best effort, this is also used to drop a stream that has failed
+        control, data = stream
+        try:
+            control.backendCommand('QUERY_FILETRANSFER '+BACKEND_SEP.join(
+                                            [str(data._sockno), 'DONE']))
+            control.disconnect()
+        except (MythError, socket.error):
+            try:
+                control.disconnect(True)
+            except socket.error:
+                pass
+        try:
+            data.disconnect(True)
+        except socket.error:
+            pass
+
+    def _copyrange(self, stream, fp, pos, end, update):
+        # copy [pos[0], end), advancing pos[0] as data is written
+        control, data = stream
+        sockno = str(data._sockno)
+        start = pos[0]
+        res = control.backendCommand('QUERY_FILETRANSFER '+BACKEND_SEP.join(
+                        [sockno, 'SEEK', str(start), '0', '0']))
+        if res.split(BACKEND_SEP)[0] != str(start):
+            raise MythFileError(MythError.FILE_FAILED_SEEK, str(self), start, 0)
+
+        buff = bytearray(self._blocksize)
+        view = memoryview(buff)
+        while start < end:
+            ct = min(self._blocksize, end-start)
+            res = control.backendCommand('QUERY_FILETRANSFER '+\
+                        BACKEND_SEP.join([sockno, 'REQUEST_BLOCK', str(ct)]))
+            if res in ('', '-1'):
+                raise MythFileError(MythError.FILE_FAILED_READ, str(self))
+            ct = int(res)
+            if ct == 0:
+                raise MythFileError(MythError.FILE_FAILED_READ, str(self))
+            got = data.recv_into(view, ct)
+            if got != ct:
+                raise MythFileError(MythError.FILE_FAILED_READ, str(self))
+            fp.seek(start)
+            fp.write(view[:got])
+            start += got
+            pos[0] = start
+            update(got)
+
+class _AsyncTransferConnection( AsyncBEConnection ):
+    # data socket of an AsyncFileTransfer, unframed once announced
+    def __init__(self, backend, port, localname, filename, sgroup,
+                    loop=None, timeout=10.0):
+        self.filename = filename
+        self.sgroup = sgroup
+        self.sockno = None
+        self.size = None
+        self._waiting = deque()
+        AsyncBEConnection.__init__(self, backend, port, localname,
+                                   loop=loop, timeout=timeout)
+
+    def _announcement(self):
+        return BACKEND_SEP.join(['ANN FileTransfer %s 0 0 2000' % \
+                                        self.localname,
+                                 self.filename, self.sgroup])
+
+    def _checkannounce(self, f):
+        res = f.result().split(BACKEND_SEP)
+        if res[0] != 'OK':
+            raise MythBEError(MythError.PROTO_ANNOUNCE,
+                              self.host, self.port, f.result())
+        self.sockno = int(res[1])
+        self.size = int(res[2])
+        self._framed = False
+        self._announced()
+
+    def expect(self, count):
+        """Return a future resolving to the next 'count' bytes received."""
+        future = MythFuture(self.loop)
+        self._waiting.append((count, future))
+        self._feed()
+        return future
+
+    def _parse(self):
+        AsyncBEConnection._parse(self)
+        self._feed()
+
+    def _feed(self):
+        while self._waiting and (len(self._rbuff) >= self._waiting[0][0]):
+            count, future = self._waiting.popleft()
+            data = str(self._rbuff[:count])
+            del self._rbuff[:count]
+            future.setResult(data)
+
+    def handleClose(self, error):
+        waiting, self._waiting = self._waiting, deque()
+        AsyncBEConnection.handleClose(self, error)
+        for count, future in waiting:
+            future.setError(error)
+
+class AsyncFileTransfer( object ):
+    """
+    Read-only backend file transfer driven by an AsyncLoop, using an
+        AsyncBEConnection for control commands. AsyncFileTransfer.open()
+        returns a future resolving to the transfer once it has been
+        announced. read() and seek() return futures, and may be issued
+        back to back to keep several requests in flight.
+    """
+    _blocksize = 2**20
+
+    @classmethod
+    def open(cls, conn, filename, sgroup='Default'):
+        """
+        AsyncFileTransfer.open(conn, filename, sgroup='Default')
+                                                        -> MythFuture
+        """
+        return cls(conn, filename, sgroup).ready
+
+    def __init__(self, conn, filename, sgroup='Default'):
+        self.conn = conn
+        self.loop = conn.loop
+        self.filename = filename
+        self.sgroup = sgroup
+        self._pos = 0
+        self._reqpos = 0
+        self._size = None
+        self._sockno = None
+
+        self.ready = MythFuture(self.loop)
+        self._data = _AsyncTransferConnection(conn.host, conn.port,
+                            conn.localname, filename, sgroup,
+                            conn.loop, conn.timeout)
+        self._data.ready.addCallback(self._announced)
+
+    def __str__(self):
+        return 'myth://%s@%s/%s' % (self.sgroup, self.conn.host, self.filename)
+
+    def _announced(self, f):
+        try:
+            f.result()
+        except Exception, e:
+            self.ready.setError(e)
+            return
+        self._sockno = str(self._data.sockno)
+        self._size = self._data.size
+        self.ready.setResult(self)
+
+    def tell(self):
+        """AsyncFileTransfer.tell() -> offset of completed reads"""
+        return self._pos
+
+    def read(self, size):
+        """
+        AsyncFileTransfer.read(size) -> MythFuture
+            Resolves to a string of up to 'size' bytes.
+        """
+        result = MythFuture(self.loop)
+        self.loop.call(self._read, size, result)
+        return result
+
+    def _read(self, size, result):
+        size = min(size, self._size - self._reqpos)
+        blocks = []
+        while size > 0:
+            ct = min(size, self._blocksize)
+            blocks.append(self._requestblock(ct))
+            self._reqpos += ct
+            size -= ct
+        if not blocks:
+            result.setResult('')
+            return
+
+        remaining = [len(blocks)]
+        def collect(f):
+            remaining[0] -= 1
+            if remaining[0]:
+                return
+            try:
+                data = ''.join([b.result() for b in blocks])
+            except Exception, e:
+                result.setError(e)
+                return
+            self._pos += len(data)
+            result.setResult(data)
+        for b in blocks:
+            b.addCallback(collect)
+
+    def _requestblock(self, ct):
+        block = MythFuture(self.loop)
+        def reply(f):
+            try:
+                res = int(f.result())
+            except Exception, e:
+                block.setError(e)
+                return
+            if res < 0:
+                block.setError(MythFileError(MythError.FILE_FAILED_READ,
+                                             str(self)))
+                return
+            # backend only advances by the amount actually sent
+            self._reqpos -= ct - res
+            self._data.expect(res).addCallback(deliver)
+        def deliver(f):
+            try:
+                block.setResult(f.result())
+            except Exception, e:
+                block.setError(e)
+        self.conn.backendCommand('QUERY_FILETRANSFER '+BACKEND_SEP.join(
+                    [self._sockno, 'REQUEST_BLOCK', str(ct)]))\
+                .addCallback(reply)
+        return block
+
+    def seek(self, offset, whence=0):
+        """
+        AsyncFileTransfer.seek(offset, whence=0) -> MythFuture
+            Resolves to the new offset once the backend has seeked.
+            Relative seeks are taken from the end of any requests
+            already issued.
+        """
+        result = MythFuture(self.loop)
+        self.loop.call(self._seek, offset, whence, result)
+        return result
+
+    def _seek(self, offset, whence, result):
+        if whence == 1:
+            offset += self._reqpos
+        elif whence == 2:
+            offset += self._size
+        offset = max(0, min(offset, self._size))
+        self._reqpos = offset
+        def reply(f):
+            try:
+                res = int(f.result().split(BACKEND_SEP)[0])
+                if res < 0:
+                    raise MythFileError(MythError.FILE_FAILED_SEEK,
+                                        str(self), offset, 0)
+            except Exception, e:
+                result.setError(e)
+                return
+            self._pos = res
+            result.setResult(res)
+        self.conn.backendCommand('QUERY_FILETRANSFER '+BACKEND_SEP.join(
+                    [self._sockno, 'SEEK', str(offset), '0',
+                     str(self._reqpos)])).addCallback(reply)
+
+    def close(self):
+        """AsyncFileTransfer.close() -> MythFuture"""
+        if self._sockno is None:
+            self._data.close()
+            return self.ready
+        done = self.conn.backendCommand('QUERY_FILETRANSFER '+\
+                    BACKEND_SEP.join([self._sockno, 'DONE']))
+        done.addCallback(lambda f: self._data.close())
+        return done
+
+def asyncprograms(conn, query, header_length=0, recstatus=None, db=None):
+    """
+    asyncprograms(conn, query, header_length=0, recstatus=None, db=None)
+                                                        -> MythFuture
+    Issues a program list query, such as 'QUERY_RECORDINGS Ascending', on
+        an AsyncBEConnection. The future resolves to a list of Program
+        objects.
+    """
+    result = MythFuture(conn.loop)
+    def parse(f):
+        try:
+            result.setResult(list(_parseprograms(
+                                    f.result().split(BACKEND_SEP),
+                                    header_length, recstatus, db=db)))
+        except Exception, e:
+            result.setError(e)
+    conn.backendCommand(query).addCallback(parse)
+    return result
+
+def _parseprograms(fields, header_length=0, recstatus=None, handler=None,
+                   db=None):
+    # group a sequence of program list fields into individual records,
+    # consuming them incrementally so responses can be streamed
+    if handler is None:
+        handler = Program
+    pgfieldcount = len(Program._field_order)
+    pgrecstatus = Program._field_order.index('recstatus')
+
+    fields = iter(fields)
+    try:
+        for i in xrange(header_length):
+            fields.next()
+        num_progs = int(fields.next())
+    except (StopIteration, ValueError):
+        raise MythBEError(MythBEError.PROTO_PROGRAMINFO)
+
+    for i in xrange(num_progs):
+        rec = list(islice(fields, pgfieldcount))
+        if len(rec) != pgfieldcount:
+            raise MythBEError(MythBEError.PROTO_PROGRAMINFO)
+        if recstatus is not None:
+            # filter before paying for object construction
+            if int(rec[pgrecstatus]) != recstatus:
+                continue
+        yield handler(rec, db=db)
+
+    if next(fields, None) is not None:
+        raise MythBEError(MythBEError.PROTO_PROGRAMINFO)
+
 class FileOps( BECache ):
     __doc__ = BECache.__doc__+"""
         getRecording()      - return a Program object for a recording
@@ -778,24 +1638,10 @@ class FileOps( BECache ):
             return cls
 
         def run(self, *args, **kwargs):
-            pgfieldcount = len(Program._field_order)
-            pgrecstatus = Program._field_order.index('recstatus')
-            pgrecordid = Program._field_order.index('recordid')
-
-            res = self.inst.backendCommand(self.query).split(BACKEND_SEP)
-            for i in xrange(self.header_length):
-                res.pop(0)
-            num_progs = int(res.pop(0))
-            if num_progs*pgfieldcount != len(res):
-                raise MythBEError(MythBEError.PROTO_PROGRAMINFO)
-
-            for i in range(num_progs):
-                offs = i * pgfieldcount
-                if self.recstatus is not None:
-                    if int(res[offs+pgrecstatus]) != self.recstatus:
-                        continue
-                pg = self.handler(res[offs:offs+pgfieldcount],
-                                  db=self.inst.db)
+            fields = self.inst.backendCommandStream(self.query)
+            for pg in _parseprograms(fields, self.header_length,
+                                     self.recstatus, self.handler,
+                                     self.inst.db):
                 pg = self.func(pg, *args, **kwargs)
                 if pg is not None:
                     yield pg
@@ -821,9 +1667,12 @@ class FreeSpace( DictData ):
         DictData.__init__(self, raw)
         self.freespace = self.totalspace - self.usedspace
 
-class Program( CMPRecord, DictData, RECSTATUS, AUDIO_PROPS, \
+class Program( CMPRecord, LazyDictData, RECSTATUS, AUDIO_PROPS, \
                          VIDEO_PROPS, SUBTITLE_TYPES ):
-    """Represents a program with all detail returned by the backend."""
+    """
+    Represents a program with all detail returned by the backend.
+    Fields are converted from the raw protocol strings on first access.
+    """
 
     _field_order = [ 'title',        'subtitle',     'description',
                      'season',       'episode',      'totalepisodes',
@@ -869,11 +1718,22 @@ class Program( CMPRecord, DictData, RECSTATUS, AUDIO_PROPS, \
         return str(self).encode('utf-8')
 
     def __init__(self, raw, db=None):
-        DictData.__init__(self, raw)
+        LazyDictData.__init__(self, raw)
         self._db = db
-        self.AudioProps = ParseEnum(self, 'audio_props', AUDIO_PROPS, False)
-        self.VideoProps = ParseEnum(self, 'video_props', VIDEO_PROPS, False)
-        self.SubtitleType = ParseEnum(self, 'subtitle_type', SUBTITLE_TYPES, False)
+
+    def _getenum(self, field, enum):
+        # ParseEnum helpers are built on first use, and cached
+        enums = self.__dict__.setdefault('_enums', {})
+        if field not in enums:
+            enums[field] = ParseEnum(self, field, enum, False)
+        return enums[field]
+
+    AudioProps = property(lambda self: \
+                            self._getenum('audio_props', AUDIO_PROPS))
+    VideoProps = property(lambda self: \
+                            self._getenum('video_props', VIDEO_PROPS))
+    SubtitleType = property(lambda self: \
+                            self._getenum('subtitle_type', SUBTITLE_TYPES))
 
     @classmethod
     def fromEtree(cls, etree, db=None):
@@ -7,13 +7,15 @@ Provides base classes for managing system calls.
 from MythTV.exceptions import MythError, MythDBError, MythFileError
 from MythTV.logging import MythLog
 from MythTV.altdict import DictData, OrdDict
-from MythTV.utility import levenshtein, DequeBuffer
+from MythTV.utility import levenshtein, DequeBuffer, MythFuture
 from MythTV.database import DBCache
 
 from subprocess import Popen
 from select import select
+from threading import Thread, Timer, Lock
+from collections import deque
 from lxml import etree
-from time import sleep
+import signal
 import shlex
 import os
 
@@ -27,14 +29,18 @@ class System( DBCache ):
     logmodule = 'Python system call handler'
 
     class Process( object ):
-        def __init__(self, cmd, useshell, log):
+        def __init__(self, cmd, useshell, log, group=False):
             self.cmd = cmd
             self.log = log
             log(MythLog.SYSTEM, MythLog.INFO, 'Running external command', cmd)
 
             if not useshell:
                 cmd = shlex.split(cmd)
-            self._fd = Popen(cmd, stdout=-1, stderr=-1, shell=useshell)
+            # a separate process group allows kill() to reach any children
+            # spawned by the shell
+            self._group = group
+            self._fd = Popen(cmd, stdout=-1, stderr=-1, shell=useshell,
+                             preexec_fn=os.setpgrp if group else None)
 
             self.stdout = DequeBuffer(inp=self._fd.stdout)
             self.stderr = DequeBuffer(inp=self._fd.stderr)
@@ -44,12 +50,59 @@ class System( DBCache ):
 
         def wait(self):
             res = self._fd.wait()
+            # wait until pipes have been drained and closed
+            self.stdout.wait()
+            self.stderr.wait()
+            return res
+
+        def kill(self):
+            try:
+                if self._group:
+                    os.killpg(self._fd.pid, signal.SIGKILL)
+                else:
+                    self._fd.kill()
+            except OSError:
+                # already exited
+                pass
+
+    class _Executor( object ):
+        """
+        Runs queued jobs on up to 'maxworkers' threads, started as needed,
+            and exiting once the queue is empty.
+        """
+        def __init__(self, maxworkers):
+            self.maxworkers = maxworkers
+            self._jobs = deque()
+            self._lock = Lock()
+            self._workers = 0
+
+        def submit(self, func, *args):
+            future = MythFuture()
+            with self._lock:
+                self._jobs.append((future, func, args))
+                if self._workers < self.maxworkers:
+                    self._workers += 1
+                    t = Thread(target=self._worker,
+                               name='Python System Worker')
+                    t.daemon = True
+                    t.start()
+            return future
+
+        def _worker(self):
             while True:
-                # wait until pipes have been closed
-                if self.stdout._closed and self.stderr._closed:
-                    break
-                sleep(0.01)
-            return self._fd.wait()
+                with self._lock:
+                    if (not len(self._jobs)) or \
+                            (self._workers > self.maxworkers):
+                        self._workers -= 1
+                        return
+                    future, func, args = self._jobs.popleft()
+                try:
+                    future.setResult(func(future, *args))
+                except Exception, e:
+                    future.setError(e)
+                future = None
+
+    maxworkers = 4
 
     @classmethod
     def system(cls, command, db=None):
@@ -170,6 +223,82 @@ class System( DBCache ):
         cmd = '%s %s' % (self.path, ' '.join(['%s' % a for a in args]))
         return self.Process(cmd, self.useshell, self.log)
 
+    def submit(self, *args, **kwargs):
+        """
+        obj.submit(*args, timeout=None) -> MythFuture
+
+        Queues the command to run in the background, with at most
+            'maxworkers' commands from this object running at once.
+            future.result() returns the output, or raises a MythError
+            as command() does. 'returncode' and 'stderr' are set on the
+            future once finished, and 'process' as soon as it starts,
+            allowing output to be read as it is produced. The command
+            is killed if it runs longer than 'timeout' seconds.
+        """
+        timeout = kwargs.pop('timeout', None)
+        if kwargs:
+            raise TypeError("submit() got an unexpected keyword argument '%s'"\
+                                % kwargs.keys()[0])
+        return self._submit(None, args, timeout)
+
+    def _submit(self, executor, args, timeout):
+        if executor is None:
+            if getattr(self, '_executor', None) is None:
+                self._executor = self._Executor(self.maxworkers)
+            self._executor.maxworkers = self.maxworkers
+            executor = self._executor
+        cmd = '%s %s' % (self.path, ' '.join(['%s' % a for a in args]))
+        return executor.submit(self._runjob, cmd, timeout)
+
+    def map(self, args_list, max_workers=None, timeout=None):
+        """
+        obj.map(args_list, max_workers=None, timeout=None) -> list of futures
+
+        Submits the command once for each entry of 'args_list', being
+            either a single argument or a sequence of arguments, and
+            returns the futures in the same order. If 'max_workers' is
+            given, the batch runs on its own threads under that limit,
+            rather than sharing those of submit().
+        """
+        executor = None
+        if max_workers is not None:
+            executor = self._Executor(max_workers)
+        futures = []
+        for args in args_list:
+            if isinstance(args, basestring) or \
+                    not hasattr(args, '__iter__'):
+                args = (args,)
+            futures.append(self._submit(executor, args, timeout))
+        return futures
+
+    def _runjob(self, future, cmd, timeout):
+        if self.path is '':
+            future.returncode = 0
+            future.stderr = ''
+            return ''
+        p = self.Process(cmd, self.useshell, self.log, True)
+        future.process = p
+
+        timer = None
+        if timeout is not None:
+            timer = Timer(timeout, p.kill)
+            timer.daemon = True
+            timer.start()
+        try:
+            returncode = p.wait()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        future.returncode = returncode
+        future.stderr = p.stderr.read()
+        if returncode:
+            if (timer is not None) and (returncode == -signal.SIGKILL):
+                self.log(MythLog.SYSTEM, MythLog.ERR,
+                         'External command timed out', cmd)
+            raise MythError(MythError.SYSTEM, returncode, cmd, future.stderr)
+        return p.stdout.read()
+
 class Metadata( DictData ):
     _global_type = {'title':3,      'subtitle':3,       'tagline':3,
                     'description':3,'season':0,         'episode':0,
@@ -7,4 +7,4 @@ from altdict import OrdDict, DictInvert, DictInvertCI
 
 from other import _donothing, SchemaUpdate, databaseSearch, deadlinesocket, \
                   MARKUPLIST, levenshtein, ParseEnum, ParseSet, CopyData, \
-                  CopyData2, check_ipv6, QuickProperty
+                  CopyData2, check_ipv6, QuickProperty, MythFuture
@@ -6,157 +6,275 @@
 
 from cStringIO import StringIO
 from time import time, sleep
-from threading import Thread, Lock
+from threading import Thread, Lock, Condition
 from collections import deque
 from Queue import Queue
+from io import FileIO
 import weakref
+import fcntl
+import errno
+import os
 
 try:
-    from select import poll, POLLHUP, POLLIN, POLLOUT
+    from select import epoll, EPOLLIN, EPOLLOUT, EPOLLHUP, EPOLLERR, EPOLLET
     class _PollingThread( Thread ):
         """
-        This polling thread listens on selected pipes, and automatically reads
-        and writes data between the buffer and those pipes. This will self
-        terminate when there are no more pipes defined, and will need to be
-        restarted.
+        This reactor thread listens on selected pipes using edge-triggered
+        epoll, reading data directly into the blocks of the attached buffer,
+        and writing data out of them. Pipes are registered directly with the
+        epoll object, so the thread sleeps until there is work to do. This
+        will self terminate when there have been no pipes defined for the
+        idle period, and will need to be restarted.
         """
+        idletimeout = 20
         def __init__(self, group=None, target=None, name=None,
                            args=(), kwargs={}):
-            self.inputqueue = Queue()
-            self.idletime = time()
+            self.poller = epoll()
+            self.fds = {}
+            self.lock = Lock()
+            self.running = True
             super(_PollingThread, self).__init__(group,
                         target, name, args, kwargs)
         def add_pipe(self, buff, pipe, mode):
-            self.inputqueue.put((buff, pipe, mode))
+            """
+            Returns False if the thread has already terminated on idle, and
+            a new one must be started.
+            """
+            fd = pipe.fileno()
+            if 'r' in mode:
+                events = EPOLLIN|EPOLLET
+                raw = FileIO(fd, 'r', closefd=False)
+            elif 'w' in mode:
+                events = EPOLLOUT|EPOLLET
+                raw = FileIO(fd, 'w', closefd=False)
+            else:
+                return True
+            fcntl.fcntl(fd, fcntl.F_SETFL,
+                        fcntl.fcntl(fd, fcntl.F_GETFL)|os.O_NONBLOCK)
+            with self.lock:
+                if not self.running:
+                    return False
+                self.fds[fd] = (weakref.ref(buff), pipe, raw, events)
+                self.poller.register(fd, events)
+            return True
+        def rearm(self, pipe):
+            # new data to write, re-registering triggers a fresh edge if
+            # the pipe is already writable
+            with self.lock:
+                entry = self.fds.get(pipe.fileno())
+                if entry is not None:
+                    self.poller.modify(pipe.fileno(), entry[3])
+        def _remove(self, fd):
+            with self.lock:
+                entry = self.fds.pop(fd, None)
+                if entry is None:
+                    return
+                self.poller.unregister(fd)
+            entry[1].close()
         def run(self):
-            poller = poll()
-            fds = {}
-            events = []
+            idletime = time()
             while True:
-                while not self.inputqueue.empty():
-                    # loop though the queue and add new pipes to the
-                    # poll object
-                    buff, pipe, mode = self.inputqueue.get()
-                    if 'r' in mode:
-                        poller.register(pipe.fileno(), POLLIN|POLLHUP)
-                    elif 'w' in mode:
-                        poller.register(pipe.fileno(), POLLOUT|POLLHUP)
+                with self.lock:
+                    if len(self.fds):
+                        timeout = -1
+                    elif idletime + self.idletimeout < time():
+                        # idle timeout reached, terminate
+                        self.running = False
+                        self.poller.close()
+                        break
                     else:
+                        timeout = self.idletimeout
+
+                try:
+                    events = self.poller.poll(timeout)
+                except IOError, e:
+                    if e.errno == errno.EINTR:
                         continue
-                    fds[pipe.fileno()] = (weakref.ref(buff), pipe)
+                    raise
 
-                for fd,event in poller.poll(100):
+                for fd,event in events:
                     # loop through file numbers and handle events
-                    buff, pipe = fds[fd]
-                    if buff() is None:
+                    entry = self.fds.get(fd)
+                    if entry is None:
+                        continue
+                    buff, pipe, raw, mask = entry
+                    buff = buff()
+                    if buff is None:
                         # buffer object has closed out from underneath us
                         # remove reference from poller
-                        pipe.close()
-                        del fds[fd]
-                        poller.unregister(fd)
+                        self._remove(fd)
                         continue
 
-                    if event & POLLIN:
-                        # read as much data from the pipe as it has available
-                        buff().write(pipe.read(2**16))
-                    if event & POLLOUT:
-                        # write as much data to the pipe as there is space for
-                        # roll back buffer if data is not fully written
-                        data = buff().read(2**16)
-                        nbytes = pipe.write(data)
-                        if nbytes != len(data):
-                            buff()._rollback(len(data) - nbytes)
-                    if event & POLLHUP:
+                    try:
+                        if mask & EPOLLIN:
+                            # drain the pipe, as no further event will be
+                            # received until more data arrives
+                            isopen = buff._readfrom(raw)
+                        else:
+                            isopen = buff._writeto(raw) and \
+                                        not (event & (EPOLLHUP|EPOLLERR))
+                    except (IOError, OSError):
+                        isopen = False
+                    if not isopen:
                         # pipe has closed, and all reads have been processed
                         # remove reference from poller
-                        buff().close()
-                        pipe.close()
-                        del fds[fd]
-                        poller.unregister(fd)
-
-                if len(fds) == 0:
-                    # no pipes referenced
-                    if self.idletime + 20 < time():
-                        # idle timeout reached, terminate
-                        break
-                    sleep(0.1)
-                else:
-                    self.idletime = time()
+                        self._remove(fd)
+                        buff.close()
+                    buff = None
+
+                if len(self.fds):
+                    idletime = time()
 except ImportError:
-    from select import kqueue, kevent, KQ_FILTER_READ, KQ_FILTER_WRITE, \
-                         KQ_EV_ADD, KQ_EV_DELETE, KQ_EV_EOF
-    class _PollingThread( Thread ):
-        """
-        This polling thread listens on selected pipes, and automatically reads
-        and writes data between the buffer and those pipes. This will self
-        terminate when there are no more pipes defined, and will need to be
-        restarted.
-        """
-        def __init__(self, group=None, target=None, name=None,
-                           args=(), kwargs={}):
-            self.inputqueue = Queue()
-            self.idletime = time()
-            super(_PollingThread, self).__init__(group,
-                        target, name, args, kwargs)
-        def add_pipe(self, buff, pipe, mode):
-            self.inputqueue.put((buff, pipe, mode))
-        def run(self):
-            poller = kqueue()
-            fds = {}
-            events = []
-            while True:
-                while not self.inputqueue.empty():
-                    # loop through the queue and gather new pipes to add the
-                    # kernel queue
-                    buff, pipe, mode = self.inputqueue.get()
-                    if 'r' in mode:
-                        events.append(kevent(pipe, KQ_FILTER_READ, KQ_EV_ADD))
-                    elif 'w' in mode:
-                        events.append(kevent(pipe, KQ_FILTER_WRITE, KQ_EV_ADD))
+    try:
+        from select import poll, POLLHUP, POLLIN, POLLOUT
+        class _PollingThread( Thread ):
+            """
+            This polling thread listens on selected pipes, and automatically reads
+            and writes data between the buffer and those pipes. This will self
+            terminate when there are no more pipes defined, and will need to be
+            restarted.
+            """
+            def __init__(self, group=None, target=None, name=None,
+                               args=(), kwargs={}):
+                self.inputqueue = Queue()
+                self.idletime = time()
+                super(_PollingThread, self).__init__(group,
+                            target, name, args, kwargs)
+            def add_pipe(self, buff, pipe, mode):
+                self.inputqueue.put((buff, pipe, mode))
+            def rearm(self, pipe):
+                pass
+            def run(self):
+                poller = poll()
+                fds = {}
+                events = []
+                while True:
+                    while not self.inputqueue.empty():
+                        # loop though the queue and add new pipes to the
+                        # poll object
+                        buff, pipe, mode = self.inputqueue.get()
+                        if 'r' in mode:
+                            poller.register(pipe.fileno(), POLLIN|POLLHUP)
+                        elif 'w' in mode:
+                            poller.register(pipe.fileno(), POLLOUT|POLLHUP)
+                        else:
+                            continue
+                        fds[pipe.fileno()] = (weakref.ref(buff), pipe)
+
+                    for fd,event in poller.poll(100):
+                        # loop through file numbers and handle events
+                        buff, pipe = fds[fd]
+                        if buff() is None:
+                            # buffer object has closed out from underneath us
+                            # remove reference from poller
+                            pipe.close()
+                            del fds[fd]
+                            poller.unregister(fd)
+                            continue
+
+                        if event & POLLIN:
+                            # read as much data from the pipe as it has available
+                            buff().write(pipe.read(2**16))
+                        if event & POLLOUT:
+                            # write as much data to the pipe as there is space for
+                            # roll back buffer if data is not fully written
+                            data = buff().read(2**16)
+                            nbytes = pipe.write(data)
+                            if nbytes != len(data):
+                                buff()._rollback(len(data) - nbytes)
+                        if event & POLLHUP:
+                            # pipe has closed, and all reads have been processed
+                            # remove reference from poller
+                            buff().close()
+                            pipe.close()
+                            del fds[fd]
+                            poller.unregister(fd)
+
+                    if len(fds) == 0:
+                        # no pipes referenced
+                        if self.idletime + 20 < time():
+                            # idle timeout reached, terminate
+                            break
+                        sleep(0.1)
                     else:
-                        continue
-                    fds[pipe.fileno()] = (weakref.ref(buff), pipe)
-
-                if len(events) == 0:
-                    events = None
-                events = poller.control(events, 16, 0.1)
-
-                for i in range(len(events)):
-                    # loop through response and handle events
-                    event = events.pop()
-                    buff, pipe = fds[event.ident]
-
-                    if buff() is None:
-                        # buffer object has closed out from underneath us
-                        # pipe will be automatically removed from kqueue
-                        pipe.close()
-                        del fds[event.ident]
-                        continue
-
-                    if (abs(event.filter) & abs(KQ_FILTER_READ)) and event.data:
-                        # new data has come in, push into the buffer
-                        buff().write(pipe.read(event.data))
-
-                    if (abs(event.filter) & abs(KQ_FILTER_WRITE)) and event.data:
-                        # space is available to write data
-                        pipe.write(buff().read(\
-                                    min(buff()._nbytes, event.data, 2**16)))
-
-                    if abs(event.flags) & abs(KQ_EV_EOF):
-                        # pipe has been closed and all IO has been processed
-                        # pipe will be automatically removed from kqueue
-                        buff().close()
-                        pipe.close()
-                        del fds[event.ident]
-
-                if len(fds) == 0:
-                    # no pipes referenced
-                    if self.idletime + 20 < time():
-                        # idle timeout reached, terminate
-                        break
-                    sleep(0.1)
-                else:
-                    self.idletime = time()
+                        self.idletime = time()
+    except ImportError:
+        from select import kqueue, kevent, KQ_FILTER_READ, KQ_FILTER_WRITE, \
+                             KQ_EV_ADD, KQ_EV_DELETE, KQ_EV_EOF
+        class _PollingThread( Thread ):
+            """
+            This polling thread listens on selected pipes, and automatically reads
+            and writes data between the buffer and those pipes. This will self
+            terminate when there are no more pipes defined, and will need to be
+            restarted.
+            """
+            def __init__(self, group=None, target=None, name=None,
+                               args=(), kwargs={}):
+                self.inputqueue = Queue()
+                self.idletime = time()
+                super(_PollingThread, self).__init__(group,
+                            target, name, args, kwargs)
+            def add_pipe(self, buff, pipe, mode):
+                self.inputqueue.put((buff, pipe, mode))
+            def rearm(self, pipe):
+                pass
+            def run(self):
+                poller = kqueue()
+                fds = {}
+                events = []
+                while True:
+                    while not self.inputqueue.empty():
+                        # loop through the queue and gather new pipes to add the
+                        # kernel queue
+                        buff, pipe, mode = self.inputqueue.get()
+                        if 'r' in mode:
+                            events.append(kevent(pipe, KQ_FILTER_READ, KQ_EV_ADD))
+                        elif 'w' in mode:
+                            events.append(kevent(pipe, KQ_FILTER_WRITE, KQ_EV_ADD))
+                        else:
+                            continue
+                        fds[pipe.fileno()] = (weakref.ref(buff), pipe)
+
+                    if len(events) == 0:
+                        events = None
+                    events = poller.control(events, 16, 0.1)
+
+                    for i in range(len(events)):
+                        # loop through response and handle events
+                        event = events.pop()
+                        buff, pipe = fds[event.ident]
+
+                        if buff() is None:
+                            # buffer object has closed out from underneath us
+                            # pipe will be automatically removed from kqueue
+                            pipe.close()
+                            del fds[event.ident]
+                            continue
+
+                        if (abs(event.filter) & abs(KQ_FILTER_READ)) and event.data:
+                            # new data has come in, push into the buffer
+                            buff().write(pipe.read(event.data))
+
+                        if (abs(event.filter) & abs(KQ_FILTER_WRITE)) and event.data:
+                            # space is available to write data
+                            pipe.write(buff().read(\
+                                        min(buff()._nbytes, event.data, 2**16)))
+
+                        if abs(event.flags) & abs(KQ_EV_EOF):
+                            # pipe has been closed and all IO has been processed
+                            # pipe will be automatically removed from kqueue
+                            buff().close()
+                            pipe.close()
+                            del fds[event.ident]
+
+                    if len(fds) == 0:
+                        # no pipes referenced
+                        if self.idletime + 20 < time():
+                            # idle timeout reached, terminate
+                            break
+                        sleep(0.1)
+                    else:
+                        self.idletime = time()
 
 class DequeBuffer( object ):
     """
@@ -167,63 +285,54 @@ class DequeBuffer( object ):
     """
     class _Buffer( object ):
         """
-        This subclass contains a buffer object and a read/write lock, as
-        well as independent read and write positions.
+        This subclass contains a preallocated bytearray, as well as
+        independent read and write positions. Locking is handled by the
+        owning DequeBuffer.
         """
-        __slots__ = ['buffer', 'lock', 'blocksize', 'EOF', 'rpos', 'wpos']
+        __slots__ = ['buffer', 'blocksize', 'EOF', 'rpos', 'wpos']
         def __init__(self, size=2**18):
-            self.buffer = StringIO()
-            self.lock = Lock()
+            self.buffer = bytearray(size)
             self.blocksize = size
             self.EOF = False
             self.rpos = 0
             self.wpos = 0
 
-        def __del__(self):
-            self.buffer.close()
-
         def read(self, nbytes):
-            with self.lock:
-                self.buffer.seek(self.rpos)
-                buff = self.buffer.read(nbytes)
-                self.rpos = self.buffer.tell()
-                if self.rpos == self.blocksize:
-                    self.EOF = True
-                return buff
+            end = min(self.wpos, self.rpos+nbytes)
+            buff = str(self.buffer[self.rpos:end])
+            self.rpos = end
+            if self.rpos == self.blocksize:
+                self.EOF = True
+            return buff
 
         def write(self, data):
-            with self.lock:
-                nbytes = self.blocksize-self.wpos
-                if nbytes < len(data):
-                    data = data[:nbytes]
-                else:
-                    nbytes = len(data)
-                self.buffer.seek(self.wpos)
-                self.buffer.write(data)
-                self.wpos += nbytes
+            nbytes = min(len(data), self.blocksize-self.wpos)
+            self.buffer[self.wpos:self.wpos+nbytes] = data[:nbytes]
+            self.wpos += nbytes
             return nbytes
 
         def rollback(self, nbytes):
-            with self.lock:
-                self.EOF = False
-                if self.rpos < nbytes:
-                    nbytes -= self.rpos
-                    self.rpos = 0
-                    return nbytes
-                else:
-                    self.rpos -= nbytes
-                    return 0
+            self.EOF = False
+            if self.rpos < nbytes:
+                nbytes -= self.rpos
+                self.rpos = 0
+                return nbytes
+            else:
+                self.rpos -= nbytes
+                return 0
 
         def close(self):
-            with self.lock:
-                self.buffer.close()
+            pass
 
     _pollingthread = None
+    _minblock = 2**12
+    _maxblock = 2**18
 
     def __init__(self, data=None, inp=None, out=None):
         self._nbytes = 0
         self._buffer = deque()
         self._rollback_pool = []
+        self._lock = Condition()
         self._rpipe = None
         self._wpipe = None
         self._closed = False
@@ -237,88 +346,164 @@ class DequeBuffer( object ):
     def __len__(self):
         return self._nbytes
 
+    def _newblock(self, hint=0):
+        # start small, so short outputs do not each allocate a full block
+        size = self._minblock
+        if len(self._buffer):
+            size = self._buffer[-1].blocksize*2
+        size = min(self._maxblock, max(size, hint))
+        tmp = self._Buffer(size)
+        self._buffer.append(tmp)
+        return tmp
+
     def read(self, nbytes=None):
         """
         Read up to specified amount from buffer, or whatever is available. 
         """
-        # flush existing buffer
-        self._rollback_pool = []
-        data = StringIO()
-        while True:
-            try:
-                # get first item, or return if no more blocks are avaialable
-                tmp = self._buffer[0]
-            except IndexError:
-                break
-
-            if nbytes:
-                # read only what is requested
-                data.write(tmp.read(nbytes-data.tell()))
-            else:
-                # read all that is available
-                data.write(tmp.read(tmp.blocksize))
+        with self._lock:
+            # flush existing buffer
+            self._rollback_pool = []
+            data = StringIO()
+            while True:
+                try:
+                    # get first item, or return if no more blocks are avaialable
+                    tmp = self._buffer[0]
+                except IndexError:
+                    break
+
+                if nbytes:
+                    # read only what is requested
+                    data.write(tmp.read(nbytes-data.tell()))
+                else:
+                    # read all that is available
+                    data.write(tmp.read(tmp.blocksize))
 
-            if tmp.EOF:
-                # block is exhausted, cycle it into the rollback pool
-                self._rollback_pool.append(self._buffer.popleft())
-            else:
-                # end of data or request reached, return
-                break
-        self._nbytes -= data.tell()
-        return data.getvalue()
+                if tmp.EOF:
+                    # block is exhausted, cycle it into the rollback pool
+                    self._rollback_pool.append(self._buffer.popleft())
+                else:
+                    # end of data or request reached, return
+                    break
+            self._nbytes -= data.tell()
+            return data.getvalue()
 
     def write(self, data):
         """Write provide data into buffer."""
-        data = StringIO(data)
-        data.seek(0, 2)
-        end = data.tell()
+        data = memoryview(data)
+        end = len(data)
         pos = 0
-        while True:
-            data.seek(pos)
-            try:
-                # grab last entry in buffer
-                tmp = self._buffer[-1]
-            except IndexError:
-                # buffer is empty, add a new block
-                tmp = self._Buffer()
-                self._buffer.append(tmp)
-            # write as much data as possible, and update progress
-            pos += tmp.write(data.read(tmp.blocksize))
-            if pos == end:
-                # no more data to write
-                break
-            else:
-                # add another block, and loop back through
-                self._buffer.append(self._Buffer())
-        self._nbytes += end
+        with self._lock:
+            while pos < end:
+                try:
+                    # grab last entry in buffer
+                    tmp = self._buffer[-1]
+                except IndexError:
+                    # buffer is empty, add a new block
+                    tmp = self._newblock(end)
+                if tmp.wpos == tmp.blocksize:
+                    # block is full, add another
+                    tmp = self._newblock(end-pos)
+                # write as much data as possible, and update progress
+                pos += tmp.write(data[pos:])
+            self._nbytes += end
+        if (self._wpipe is not None) and (self._pollingthread is not None):
+            self._pollingthread.rearm(self._wpipe)
         return end
 
+    def _readfrom(self, raw):
+        """
+        Read from a non-blocking pipe directly into the buffer blocks until
+        it would block. Returns False once the pipe has reached end of file.
+        """
+        while True:
+            with self._lock:
+                try:
+                    tmp = self._buffer[-1]
+                except IndexError:
+                    tmp = self._newblock()
+                if tmp.wpos == tmp.blocksize:
+                    tmp = self._newblock()
+                view = memoryview(tmp.buffer)[tmp.wpos:]
+            # only this thread writes to the block, so the read can be
+            # performed without holding the lock
+            nbytes = raw.readinto(view)
+            if nbytes is None:
+                return True
+            if nbytes == 0:
+                return False
+            with self._lock:
+                tmp.wpos += nbytes
+                self._nbytes += nbytes
+
+    def _writeto(self, raw):
+        """
+        Write buffered data to a non-blocking pipe until it would block, or
+        the buffer is empty.
+        """
+        while True:
+            with self._lock:
+                self._rollback_pool = []
+                try:
+                    tmp = self._buffer[0]
+                except IndexError:
+                    return True
+                if tmp.rpos == tmp.wpos:
+                    if tmp.wpos < tmp.blocksize:
+                        return True
+                    self._buffer.popleft()
+                    continue
+                view = memoryview(tmp.buffer)[tmp.rpos:tmp.wpos]
+            nbytes = raw.write(view)
+            if not nbytes:
+                return True
+            with self._lock:
+                tmp.rpos += nbytes
+                self._nbytes -= nbytes
+                if tmp.rpos == tmp.blocksize:
+                    self._buffer.popleft()
+
     def _rollback(self, nbytes):
         """
         Roll back buffer specified number of bytes, pulling from a pool of
         expired blocks if needed. Pool will be flushed at the beginning of
         each read.
         """
-        orig, nbytes = nbytes, self._buffer[0].rollback(nbytes)
-        while nbytes:
-            try:
-                tmp = self._rollback_pool.pop()
-            except IndexError:
-                raise RuntimeError(('Tried to roll back {0} bytes into '+\
-                        'DequeBuffer, but only {1} was available')\
-                            .format(orig, orig-nbytes))
-            else:
-                self._buffer.appendleft(tmp)
-                nbytes = tmp.rollback(nbytes)
-        self._nbytes += nbytes
+        with self._lock:
+            orig, nbytes = nbytes, self._buffer[0].rollback(nbytes)
+            while nbytes:
+                try:
+                    tmp = self._rollback_pool.pop()
+                except IndexError:
+                    raise RuntimeError(('Tried to roll back {0} bytes into '+\
+                            'DequeBuffer, but only {1} was available')\
+                                .format(orig, orig-nbytes))
+                else:
+                    self._buffer.appendleft(tmp)
+                    nbytes = tmp.rollback(nbytes)
+            self._nbytes += orig
 
     def flush(self):
         pass
 
     def close(self):
-        self._rpipe = None
-        self._wpipe = None
-        self._closed = True
+        with self._lock:
+            self._rpipe = None
+            self._wpipe = None
+            self._closed = True
+            self._lock.notify_all()
+
+    def wait(self, timeout=None):
+        """
+        Block until the buffer has been closed, such as when an attached
+        input pipe reaches end of file. Returns whether the buffer is closed.
+        """
+        with self._lock:
+            if timeout is None:
+                while not self._closed:
+                    self._lock.wait()
+            elif not self._closed:
+                self._lock.wait(timeout)
+            return self._closed
 
     def attach_input(self, pipe):
         if self._rpipe is not None:
@@ -347,10 +532,14 @@ class DequeBuffer( object ):
             # get IO mode from pipe
             mode = pipe.mode
 
-        if (cls._pollingthread is None) or not cls._pollingthread.isAlive():
-            # create new thread, and set it to not block shutdown
-            cls._pollingthread = _PollingThread()
-            cls._pollingthread.daemon = True
-            cls._pollingthread.start()
-        cls._pollingthread.add_pipe(buffer, pipe, mode)
-
+        while True:
+            if (cls._pollingthread is None) or \
+                    not cls._pollingthread.isAlive():
+                # create new thread, and set it to not block shutdown
+                cls._pollingthread = _PollingThread()
+                cls._pollingthread.daemon = True
+                cls._pollingthread.start()
+            if cls._pollingthread.add_pipe(buffer, pipe, mode) is not False:
+                break
+            # thread terminated on idle as the pipe was being added
+            cls._pollingthread = None
@@ -11,6 +11,7 @@ from datetime import datetime as _pydatetime, \
                      tzinfo as _pytzinfo, \
                      timedelta
 from collections import namedtuple
+from bisect import bisect_right
 import os
 import re
 import time
@@ -26,60 +27,66 @@ class basetzinfo( _pytzinfo ):
     _Transition = namedtuple('Transition', \
                              'time utc local offset abbrev isdst')
 
+    _EPOCHORD = _pydatetime(1970, 1, 1).toordinal()
+    _utctimes = None
+    _last = 0
+
     def _get_transition(self, dt=None):
         if len(self._transitions) == 0:
             self._get_transition = self._get_transition_empty
         elif len(self._transitions) == 1:
             self._get_transition = self._get_transition_single
         else:
-            self.__last = 0
             self._compute_ranges()
             self._get_transition = self._get_transition_search
         return self._get_transition(dt)
 
+    @classmethod
+    def _seconds(cls, dt):
+        """Return the fields of a datetime as seconds since the epoch."""
+        return (dt.toordinal() - cls._EPOCHORD)*86400 + \
+                dt.hour*3600 + dt.minute*60 + dt.second
+
     def _get_transition_search(self, dt=None):
         if dt is None:
             dt = _pydatetime.now()
-        dt = (dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second)
-
-        index = self.__last
-        direction = 0
-        while True:
-            if dt < self._ranges[index][0]:
-                if direction == 1:
-                    # gap found, use later transition
-                    break
-                else:
-                    index -= 1
-                    direction = -1
-            elif dt >= self._ranges[index][1]:
-                if direction == -1:
-                    # gap found, use later transition
-                    index += 1
-                    break
-                else:
-                    index += 1
-                    direction = 1
-            else:
-                break
-
-            if index >= len(self._ranges):
-                # out of bounds future, use final transition
-                index = len(self._ranges) - 1
-                break
-            elif index < 0:
-                # out of bounds past, undefined time frame
-                raise MythTZError(MythTZError.TZ_CONVERSION_ERROR, 
-                                  self.tzname(), dt)
 
-        self.__last = index
-        return self._transitions[self._ranges[index][2]]
+        secs = self._seconds(dt)
+        # first range not yet ended, or the gap before it
+        index = bisect_right(self._rangeends, secs)
+        if (index == 0) and (secs < self._localstarts[0]):
+            # out of bounds past, undefined time frame
+            raise MythTZError(MythTZError.TZ_CONVERSION_ERROR,
+                              self.tzname(), dt)
+        if (index+1 < len(self._localstarts)) and \
+                (secs >= self._localstarts[index+1]) and \
+                (self._last == index+1):
+            # ambiguous time, repeated when clocks go back, prefer the
+            # transition last used, as set by fromutc()
+            index += 1
+        # beyond the final range, the final transition applies
+        index = min(index, len(self._transitions)-1)
+        self._last = index
+        return self._transitions[index]
 
     def _get_transition_empty(self, dt=None):
         return self._Transition(0, None, None, 0, 'UTC', False)
     def _get_transition_single(self, dt=None):
         return self._transitions[0]
 
+    def _get_utc_transition(self, dt):
+        """Return the transition in effect at naive UTC time 'dt'."""
+        if len(self._transitions) < 2:
+            return self._get_transition(dt)
+        if self._utctimes is None:
+            self._compute_ranges()
+        index = bisect_right(self._utctimes, self._seconds(dt)) - 1
+        if index < 0:
+            raise MythTZError(MythTZError.TZ_CONVERSION_ERROR,
+                              self.tzname(), dt)
+        self._last = index
+        return self._transitions[index]
+
     def _compute_ranges(self):
         self._ranges = []
         for i in range(0, len(self._transitions)-1):
@@ -98,6 +105,19 @@ class basetzinfo( _pytzinfo ):
 
             self._ranges.append((rstart, tuple(rend), i))
 
+        # local wall clock bounds of each range, as sorted epoch seconds,
+        # taken from the UTC transition times so offsets keep their seconds
+        transitions = self._transitions
+        self._localstarts = [t.time+t.offset for t in transitions]
+        self._rangeends = [n.time+p.offset
+                                for p,n in zip(transitions, transitions[1:])]
+        self._utctimes = [t.time for t in transitions]
+
+    def fromutc(self, dt):
+        if dt.tzinfo is not self:
+            raise ValueError('fromutc: dt.tzinfo is not self')
+        return dt + timedelta(0, self._get_utc_transition(dt).offset)
+
     def utcoffset(self, dt=None):
         return timedelta(0, self._get_transition(dt).offset)
 
@@ -320,6 +340,35 @@ class datetime( _pydatetime ):
         return cls.fromDatetime(dt).replace(tzinfo=cls.UTCTZ())\
                                    .astimezone(cls.localTZ())
 
+    @classmethod
+    def fromnaiveutclist(cls, dts):
+        """
+        datetime.fromnaiveutclist(dts) -> list of datetimes
+
+        Converts a sequence of naive UTC datetimes to local time, as
+            fromnaiveutc() does for one. 'None' entries are passed through.
+        """
+        tz = cls.localTZ()
+        if isinstance(tz, basetzinfo):
+            getoffset = lambda dt: tz._get_utc_transition(dt).offset
+        else:
+            getoffset = lambda dt: tz.utcoffset(dt).seconds + \
+                                   tz.utcoffset(dt).days*86400
+        deltas = {}
+        res = []
+        for dt in dts:
+            if dt is None:
+                res.append(None)
+                continue
+            offset = getoffset(dt)
+            delta = deltas.get(offset)
+            if delta is None:
+                delta = deltas[offset] = timedelta(0, offset)
+            dt = dt + delta
+            res.append(cls(dt.year, dt.month, dt.day, dt.hour, dt.minute,
+                           dt.second, dt.microsecond, tz))
+        return res
+
     @classmethod
     def frommythtime(cls, mtime, tz=None):
         if tz in ('UTC', 'Etc/UTC'):
@@ -8,6 +8,8 @@ from dt import datetime
 from cStringIO import StringIO
 from select import select
 from time import time
+from thread import allocate_lock
+from threading import Event
 from itertools import imap
 import weakref
 import socket
@@ -78,8 +80,8 @@ class databaseSearch( object ):
                     (<table name>,   -- Primary table to pull data from.
                      <data class>,   -- Data handling class to use to process
                                         data. Ideally a subclass of DBData, 
-                                        this class must provide a 'fromRaw'
-                                        classmethod.
+                                        this class must provide a
+                                        'fromRawBatch' classmethod.
                      <required keywords>, -- Tuple of keywords that must be
                                              sent to the decorated function.
                                              If not provided by the user when
@@ -111,7 +113,37 @@ class databaseSearch( object ):
                     )
                 4-field  -- Special response consisting of:
                     (see example in methodheap.py:MythDB.searchRecorded)
+
+        Results are fetched from the database 'batchsize' rows at a time,
+            and built in bulk through the handler's 'fromRawBatch'
+            classmethod.
+
+        The SQL text for each combination of keywords is built once and
+            cached, keyed by the WHERE statements and joins returned for
+            each keyword, and the number of items given to crossreferenced
+            keywords.
+
+        All searches accept the following keywords for paging:
+            order  -- field name, or comma separated list of field names,
+                      to sort by. Prefix a field with '-' to sort in
+                      descending order. The primary key of the data class is
+                      added as a tie-breaker to give a stable order.
+            limit  -- maximum number of results to return
+            after  -- continue from the last result of a previous page,
+                      given either as that object or as the tuple returned
+                      by 'token'. Pages are selected by comparing sort
+                      fields, rather than by offset, so the database can
+                      seek directly to the start of the page using an index.
+        A companion method 'count' returns the number of matching results.
+
+        The 'prefetch' keyword accepts a tuple of attribute names of
+            DBDataRef collections on the results, such as ('cast','markup').
+            Each named collection is loaded for a whole batch of results
+            at once, rather than queried individually on first access.
     """
+    batchsize = 500
+    querycachesize = 256
+
     class Join( object ):
         def __init__(self, table=None, tableto=None, fields=None, \
                            fieldsto=None, fieldsfrom=None):
@@ -148,6 +180,7 @@ class databaseSearch( object ):
         self.handler = None
         self.require = ()
         self.joins = ()
+        self.querycache = {}
 
         # pull in properties
         self.func(self, self)
@@ -162,30 +195,213 @@ class databaseSearch( object ):
         return self
 
     def __call__(self, **kwargs):
-        where,fields,joinbit = self.parseInp(kwargs)
+        for chunk in self.chunks(**kwargs):
+            for obj in chunk:
+                yield obj
 
+    def count(self, **kwargs):
+        """
+        obj.count(**kwargs) -> int
+
+        Returns the number of results the search would return. 'limit' is
+            ignored, and 'after' counts the results following a page.
+        """
+        kwargs.pop('limit', None)
+        order = kwargs.pop('order', None)
+        after = kwargs.pop('after', None)
+        query,fields = self.compileQuery(kwargs, 'COUNT(*)', order, None,
+                                         after)
         for i,val in enumerate(fields):
             if isinstance(val, datetime):
                 fields[i] = val.asnaiveutc()
 
-        # process query
-        query = self.buildQuery(where, joinbit=joinbit)
         with self.inst.cursor(self.inst.log) as cursor:
-            if len(where) > 0:
+            if len(fields) > 0:
+                cursor.execute(query, fields)
+            else:
+                cursor.execute(query)
+            return int(cursor.fetchone()[0])
+
+    def token(self, obj, order=None):
+        """
+        obj.token(obj, order=None) -> tuple
+
+        Returns the sort values of a result, to be passed as 'after' to
+            continue a paged search with the same 'order'.
+        """
+        return tuple(self._keysetvalues(self.parseOrder(order, True), obj))
+
+    def chunks(self, batchsize=None, prefetch=None, stream=False,
+                     order=None, limit=None, after=None, **kwargs):
+        """
+        obj.chunks(batchsize=None, prefetch=None, stream=False, **kwargs)
+                    -> iterator of lists
+
+        Performs the search as calling the object directly would, but
+            yields lists of up to 'batchsize' results at a time, as they are
+            fetched from the database. If 'stream' is True, the results
+            are streamed from the server rather than held client-side.
+        """
+        if isinstance(prefetch, basestring):
+            prefetch = (prefetch,)
+        query,fields = self.compileQuery(kwargs, None, order, limit, after)
+
+        for i,val in enumerate(fields):
+            if isinstance(val, datetime):
+                fields[i] = val.asnaiveutc()
+
+        if batchsize is None:
+            batchsize = self.batchsize
+
+        # process query
+        with self.inst.cursor(self.inst.log, stream) as cursor:
+            if len(fields) > 0:
                 cursor.execute(query, fields)
             else:
                 cursor.execute(query)
 
-            for row in cursor:
-                yield self.handler.fromRaw(row, db=self.inst)
+            while True:
+                rows = cursor.fetchmany(batchsize)
+                if not rows:
+                    break
+                objs = self.handler.fromRawBatch(rows, db=self.inst)
+                if prefetch:
+                    self.prefetch(objs, prefetch)
+                yield objs
+
+    def prefetch(self, objs, names):
+        """
+        obj.prefetch(objs, names) -> None
+
+        Loads the named DBDataRef collections of all given results, with
+            one query per collection.
+        """
+        if len(objs) == 0:
+            return
+        for name in names:
+            refs = [getattr(obj, name, None) for obj in objs]
+            if not hasattr(refs[0], 'prefetch'):
+                raise MythError("%s cannot prefetch '%s'" % \
+                            (self.handler.__name__, name))
+            refs[0].prefetch(refs, self.inst)
+
+    def compileQuery(self, kwargs, select=None, order=None, limit=None,
+                           after=None):
+        """
+        obj.compileQuery(kwargs, select=None, order=None, limit=None,
+                         after=None) -> (query, fields)
 
-    def parseInp(self, kwargs):
+        Returns the SQL text and argument list for a search, reusing
+            previously built SQL for the same statements and joins.
+        """
+        order = self.parseOrder(order, after is not None)
+        where,fields,joinbit,shape = self._parseinp(kwargs, False)
+        shape = (shape, select, tuple(order),
+                 after is not None, limit is not None)
+        query = self.querycache.get(shape)
+        if query is None:
+            where,fields,joinbit = self.parseInp(kwargs)
+            if after is not None:
+                where.append(self._keysetwhere(order))
+            query = self.buildQuery(where, select=select, joinbit=joinbit)
+            if order and (select is None):
+                query += ' ORDER BY '+', '.join(['%s %s' % \
+                            (f, 'DESC' if desc else 'ASC') \
+                                    for f,desc in order])
+            if limit is not None:
+                query += ' LIMIT ?'
+            if len(self.querycache) >= self.querycachesize:
+                self.querycache.clear()
+            self.querycache[shape] = query
+
+        if after is not None:
+            values = self._keysetvalues(order, after)
+            for i,val in enumerate(values):
+                # each field but the last is compared twice
+                fields.append(val)
+                if i < len(values)-1:
+                    fields.append(val)
+        if limit is not None:
+            fields.append(int(limit))
+        return query, fields
+
+    def parseOrder(self, order, keyset=False):
+        """
+        obj.parseOrder(order, keyset=False) -> list of (field, descending)
+        """
+        if order is None:
+            order = ()
+        elif isinstance(order, basestring):
+            order = order.split(',')
+
+        res = []
+        for field in order:
+            field = field.strip()
+            desc = field.startswith('-')
+            field = field.lstrip('-')
+            if not re.match(r'^\w+(\.\w+)?$', field):
+                raise MythDBError("Invalid sort field '%s' in %s" % \
+                            (field, self.__name__))
+            if '.' not in field:
+                field = '%s.%s' % (self.table, field)
+            res.append((field, desc))
+
+        if res or keyset:
+            # break ties on the primary key, so every result has a unique
+            # position to resume from
+            self.handler._setClassDefs(self.inst)
+            desc = res[-1][1] if res else False
+            fields = [f for f,d in res]
+            for key in (getattr(self.handler, '_key', None) or ()):
+                key = '%s.%s' % (self.table, key)
+                if key not in fields:
+                    res.append((key, desc))
+        return res
+
+    def _keysetwhere(self, order):
+        # expands to 'a>=? AND (a>? OR (b>=? AND (b>? OR c>?)))', where
+        # each leading range can be satisfied from an index on the field
+        field, desc = order[0]
+        comp = '<' if desc else '>'
+        if len(order) == 1:
+            return '%s%s?' % (field, comp)
+        return '(%s%s=? AND (%s%s? OR %s))' % \
+                    (field, comp, field, comp, self._keysetwhere(order[1:]))
+
+    def _keysetvalues(self, order, after):
+        if len(order) == 0:
+            raise MythDBError('%s cannot page without a sort order' % \
+                            self.__name__)
+        if isinstance(after, (tuple, list)):
+            if len(after) != len(order):
+                raise MythDBError('%s expected %d sort values, got %d' % \
+                            (self.__name__, len(order), len(after)))
+            return list(after)
+
+        # pull sort values from the last object of the previous page
+        values = []
+        for field, desc in order:
+            try:
+                values.append(after[field.split('.')[-1]])
+            except KeyError:
+                raise MythDBError("Cannot resume %s from object without '%s'"\
+                            % (self.__name__, field))
+        return values
+
+    def parseInp(self, kwargs, build=True):
+        return self._parseinp(kwargs, build)[:3]
+
+    def _parseinp(self, kwargs, build=True):
+        # also returns the statements produced by each keyword, which
+        # determine the SQL text, as opposed to the values
         where = []
         fields = []
         joinbit = 0
+        shape = []
 
-        # loop through inputs
-        for key, val in kwargs.items():
+        # loop through inputs, in a fixed order so cached queries
+        # match the order of their arguments
+        for key, val in sorted(kwargs.items()):
             if val is None:
                 continue
 
@@ -193,9 +409,10 @@ class databaseSearch( object ):
             if key == 'custom':
                 custwhere = {}
                 custwhere.update(val)
-                for k,v in custwhere.items():
+                for k,v in sorted(custwhere.items()):
                     where.append(k)
                     fields.append(v)
+                shape.append((key, tuple(sorted(custwhere.keys()))))
                 continue
 
             # let function process remaining queries
@@ -217,9 +434,15 @@ class databaseSearch( object ):
                 where.append(res[0])
                 fields.append(res[1])
                 joinbit = joinbit|res[2]
+                shape.append((key, res[0], res[2]))
             elif len(res) == 4:
                 # special format for crossreferenced data
                 lval = [f.strip() for f in val.split(',')]
+                fields += lval
+                shape.append((key, res[0], res[1], res[2], res[3],
+                              len(lval)))
+                if not build:
+                    continue
                 where.append('(%s)=%d' %\
                     (self.buildQuery(
                         (   self.joins[res[3]].buildWhere(),
@@ -230,9 +453,8 @@ class databaseSearch( object ):
                         res[1],
                         res[2]),
                     len(lval)))
-                fields += lval
-                            
-        for key in self.require:
+
+        for key in sorted(self.require):
             if key not in kwargs:
                 res = self.func(self.inst, key=key)
                 if res is None:
@@ -240,8 +462,9 @@ class databaseSearch( object ):
                 where.append(res[0])
                 fields.append(res[1])
                 joinbit = joinbit|res[2]
+                shape.append((key, res[0], res[2]))
 
-        return where,fields,joinbit
+        return where,fields,joinbit,tuple(shape)
 
     def buildJoinOn(self, i):
         if len(self.joins[i]) == 3:
@@ -310,35 +533,56 @@ class deadlinesocket( socket.socket ):
     def setdeadline(self, deadline): self._deadline = deadline
 
     def dlrecv(self, bufsize, flags=0, deadline=None):
+        buff = bytearray(bufsize)
+        count, expired = self._dlrecv_into(memoryview(buff), bufsize,
+                                           flags, deadline)
+        if expired:
+            return u''
+        if count < bufsize:
+            del buff[count:]
+        return str(buff)
+
+    def dlrecv_into(self, buffer, nbytes=None, flags=0, deadline=None):
+        """
+        Receive up to 'nbytes' directly into a writable buffer, such as a
+            bytearray or memoryview.  Returns the number of bytes received,
+            which will be short if the deadline is reached.
+        """
+        view = memoryview(buffer)
+        if nbytes is None:
+            nbytes = len(view)
+        return self._dlrecv_into(view, nbytes, flags, deadline)[0]
+
+    def _dlrecv_into(self, view, nbytes, flags=0, deadline=None):
         # pull default timeout
         if deadline is None:
             deadline = self._deadline
         if deadline < 1000:
             deadline += time()
 
-        buff = StringIO()
+        pos = 0
         # loop until necessary data has been received
-        while bufsize > buff.tell():
+        while nbytes > pos:
             # wait for data on the socket
             t = time()
             timeout = (deadline-t) if (deadline-t>0) else 0.0
             if len(select([self],[],[], timeout)[0]) == 0:
                 # deadline reached, terminate
-                return u''
+                return pos, True
 
-            # append response to buffer
-            p = buff.tell()
+            # write response directly into buffer
             try:
-                buff.write(self.recv(bufsize-buff.tell(), flags))
+                ct = self.recv_into(view[pos:nbytes], nbytes-pos, flags)
             except socket.error, e:
                 raise MythError(MythError.SOCKET, e.args)
-            if buff.tell() == p:
+            if ct == 0:
                # no data read from a 'ready' socket, connection terminated
                 raise MythError(MythError.SOCKET, (54, 'Connection reset by peer'))
+            pos += ct
 
             if timeout == 0:
                 break
-        return buff.getvalue()
+        return pos, False
 
     def dlexpect(self, pattern, flags=0, deadline=None):
         """Loop recv listening for a provided regular expression."""
@@ -380,14 +624,68 @@ class deadlinesocket( socket.socket ):
         size = int(self.dlrecv(8, flags, deadline))
         data = self.dlrecv(size, flags, deadline)
         self.log(MythLog.SOCKET|MythLog.NETWORK, MythLog.DEBUG, \
-                            'read <-- %d' % size, data)
+                            'read <-- %d', data, args=(size,))
         return data
 
+    def dlsendall(self, data, flags=0, deadline=None):
+        """
+        Send all of 'data', waiting for the socket to become writable.
+            Returns the number of bytes sent, which will be short if the
+            deadline is reached.
+        """
+        # pull default timeout
+        if deadline is None:
+            deadline = self._deadline
+        if deadline < 1000:
+            deadline += time()
+
+        view = memoryview(data)
+        pos = 0
+        while pos < len(view):
+            t = time()
+            timeout = (deadline-t) if (deadline-t>0) else 0.0
+            if len(select([],[self],[], timeout)[1]) == 0:
+                # deadline reached, terminate
+                break
+            try:
+                pos += self.send(view[pos:], flags)
+            except socket.error, e:
+                raise MythError(MythError.SOCKET, e.args)
+        return pos
+
+    def recvheaderfields(self, sep, chunksize=2**16, flags=0, deadline=None):
+        """
+        Receive a message framed as for recvheader, yielding its 'sep'
+            delimited fields as they complete rather than buffering the
+            entire message.
+        """
+        # pull default timeout
+        if deadline is None:
+            deadline = self._deadline
+        if deadline < 1000:
+            deadline += time()
+
+        remaining = int(self.dlrecv(8, flags, deadline))
+        self.log(MythLog.SOCKET|MythLog.NETWORK, MythLog.DEBUG, \
+                            'read <-- %d (streamed)', args=(remaining,))
+        tail = ''
+        while remaining > 0:
+            chunk = self.dlrecv(min(chunksize, remaining), flags, deadline)
+            if len(chunk) == 0:
+                raise MythError(MythError.SOCKET,
+                                (110, 'Timed out receiving response'))
+            remaining -= len(chunk)
+            fields = (tail+chunk).split(sep)
+            tail = fields.pop()
+            for field in fields:
+                yield field
+        yield tail
+
     def sendheader(self, data, flags=0):
         """Send data, prepending the length in the first 8 bytes."""
         try:
             self.log(MythLog.SOCKET|MythLog.NETWORK, MythLog.DEBUG, \
-                                'write --> %d' % len(data), data)
+                                'write --> %d', data, args=(len(data),))
             data = '%-8d%s' % (len(data), data)
             self.send(data, flags)
         except socket.error, e:
@@ -396,6 +694,7 @@ class deadlinesocket( socket.socket ):
 class MARKUPLIST( object ):
     """
     Utility class for building seek/cutlists from video markup data.
+        Must be combined with MARKUP.
     """
     def _buildlist(self, ms, me):
         start = []
@@ -421,6 +720,15 @@ class MARKUPLIST( object ):
             stop.append(9999999)
         return zip(start, stop)
 
+    def getskiplist(self):
+        return self._buildlist(self.MARK_COMM_START, self.MARK_COMM_END)
+    def getunskiplist(self):
+        return self._buildlist(self.MARK_COMM_END, self.MARK_COMM_START)
+    def getcutlist(self):
+        return self._buildlist(self.MARK_CUT_START, self.MARK_CUT_END)
+    def getuncutlist(self):
+        return self._buildlist(self.MARK_CUT_END, self.MARK_CUT_START)
+
 def levenshtein(s1, s2):
     """Compute the Levenshtein distance of two strings."""
     # http://en.wikibooks.org/wiki/Algorithm_implementation/Strings/Levenshtein_distance
@@ -599,3 +907,64 @@ class QuickProperty( object ):
         if hasattr(inst, self.varname):
             return False
         return True
+
+class MythFuture( object ):
+    """
+    Result of an asynchronous operation. Callbacks added with
+        addCallback() are run on the thread completing the future, such
+        as an AsyncLoop, with the completed future as their only argument.
+    """
+    def __init__(self, loop=None):
+        self.loop = loop
+        self._event = Event()
+        self._lock = allocate_lock()
+        self._result = None
+        self._error = None
+        self._callbacks = []
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for and return the result, raising any error the operation
+            failed with. When called from the loop thread, the loop is run
+            until the future completes.
+        """
+        if (not self.done()) and (self.loop is not None) and \
+                self.loop.inLoop():
+            self.loop.runUntil(self, timeout)
+        elif not self._event.wait(timeout):
+            raise MythError('Timed out waiting for asynchronous result')
+        if not self.done():
+            raise MythError('Timed out waiting for asynchronous result')
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    def addCallback(self, func):
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def setResult(self, result):
+        self._complete(result, None)
+
+    def setError(self, error):
+        self._complete(None, error)
+
+    def _complete(self, result, error):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._result = result
+            self._error = error
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            try:
+                func(self)
+            except:
+                MythLog('Python Future').logTB(MythLog.SOCKET)
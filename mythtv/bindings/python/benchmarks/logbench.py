@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#----------------------
+# Name: logbench.py
+# Python Script
+# Purpose
+#   Measures the cost of MythLog calls for messages that are filtered
+#   out by the default log level, comparing eagerly built messages with
+#   lazy 'args' substitution and isEnabledFor() guards.
+#----------------------
+
+from MythTV.logging import MythLog
+from timeit import repeat
+from optparse import OptionParser
+
+QUERY = """SELECT  *  FROM   recorded
+                WHERE chanid=? AND starttime=?"""
+QARGS = (1001, '2012-01-01 00:00:00')
+DATA = 'x'*200
+
+log = MythLog('Python Log Benchmark')
+
+def query_eager():
+    log(log.DATABASE, log.DEBUG, ' '.join(QUERY.split()), str(QARGS))
+
+def query_guarded():
+    if log.isEnabledFor(log.DATABASE, log.DEBUG):
+        log(log.DATABASE, log.DEBUG, ' '.join(QUERY.split()), str(QARGS))
+
+def socket_eager():
+    log(log.SOCKET|log.NETWORK, log.DEBUG, 'write --> %d' % len(DATA), DATA)
+
+def socket_lazy():
+    log(log.SOCKET|log.NETWORK, log.DEBUG, 'write --> %d', DATA,
+        args=(len(DATA),))
+
+TESTS = [query_eager, query_guarded, socket_eager, socket_lazy]
+
+def main():
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option('-n', '--number', type='int', default=200000,
+                      help='Calls per timing run.')
+    parser.add_option('-r', '--repeat', type='int', default=5,
+                      help='Timing runs per test, the fastest is reported.')
+    opts, args = parser.parse_args()
+
+    for test in TESTS:
+        best = min(repeat(test, number=opts.number, repeat=opts.repeat))
+        print '{0:<16}{1:>8.0f} ns/call'.format(test.__name__,
+                                               best/opts.number*1e9)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#------------------------------
+# tests/test_connections.py
+# Description: Tests of the connection pool, event buffer, and event
+#              handler routing, run without a backend or database
+#------------------------------
+
+from MythTV.connections import _Connection_Pool, EventBuffer, \
+                               BEEventConnection
+from MythTV.exceptions import MythDBError
+from MythTV.static import BACKEND_SEP
+
+from threading import Thread, Lock
+from time import time, sleep
+import unittest
+import weakref
+import Queue
+import re
+
+class FakeConn( object ):
+    def __init__(self):
+        self.closed = False
+    def close(self):
+        self.closed = True
+    def ping(self):
+        pass
+
+class FakePool( _Connection_Pool ):
+    _defpoolsize = 1
+    _defmaxsize = 2
+    _deftimeout = 5.0
+    _defcheckinterval = 3600.0
+    def _connect(self):
+        return FakeConn()
+    def log(self, *args, **kwargs):
+        pass
+
+class TestConnectionPool( unittest.TestCase ):
+    def setUp(self):
+        self.pool = FakePool()
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_fills_base_size(self):
+        stats = self.pool.getPoolStats()
+        self.assertEqual(stats['open'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+    def test_never_exceeds_maxsize(self):
+        a = self.pool.acquire()
+        b = self.pool.acquire()
+        self.assertTrue(a is not b)
+        start = time()
+        self.assertRaises(MythDBError, self.pool.acquire, 0.2)
+        self.assertTrue(time()-start >= 0.2)
+        stats = self.pool.getPoolStats()
+        self.assertEqual(stats['open'], 2)
+        self.assertEqual(stats['inuse'], 2)
+        self.assertEqual(stats['timeouts'], 1)
+
+    def test_release_reuses_connection(self):
+        a = self.pool.acquire()
+        self.pool.acquire()
+        self.pool.release(id(a))
+        self.assertTrue(self.pool.acquire(0.2) is a)
+        self.assertEqual(self.pool.getPoolStats()['connected'], 2)
+
+    def test_release_wakes_waiter(self):
+        a = self.pool.acquire()
+        self.pool.acquire()
+        result = []
+        t = Thread(target=lambda: result.append(self.pool.acquire(5.0)))
+        t.start()
+        sleep(0.1)
+        self.pool.release(id(a))
+        t.join(5.0)
+        self.assertEqual(result, [a])
+        self.assertEqual(self.pool.getPoolStats()['waits'], 1)
+
+    def test_discard_frees_slot(self):
+        a = self.pool.acquire()
+        self.pool.acquire()
+        self.pool.release(id(a), discard=True)
+        self.assertTrue(a.closed)
+        b = self.pool.acquire(0.2)
+        self.assertTrue(b is not a)
+        self.assertEqual(self.pool.getPoolStats()['open'], 2)
+
+    def test_shrink_closes_on_release(self):
+        a = self.pool.acquire()
+        b = self.pool.acquire()
+        self.pool.resizePool(1, 1)
+        self.pool.release(id(a))
+        self.assertTrue(a.closed)
+        self.pool.release(id(b))
+        self.assertFalse(b.closed)
+        stats = self.pool.getPoolStats()
+        self.assertEqual(stats['open'], 1)
+        self.assertEqual(stats['idle'], 1)
+
+def event(body):
+    return 'BACKEND_MESSAGE'+BACKEND_SEP+body+BACKEND_SEP+'empty'
+
+class TestEventBuffer( unittest.TestCase ):
+    def drain(self, buf):
+        res = []
+        while not buf.empty():
+            res.append(buf.get_nowait())
+        return res
+
+    def test_drop_oldest(self):
+        buf = EventBuffer(3, EventBuffer.DROP_OLDEST)
+        for i in range(5):
+            buf.put(str(i))
+        self.assertEqual(self.drain(buf), ['2', '3', '4'])
+        stats = buf.getStats()
+        self.assertEqual(stats['received'], 5)
+        self.assertEqual(stats['dropped'], 2)
+        self.assertEqual(stats['peak'], 3)
+
+    def test_coalesce(self):
+        buf = EventBuffer(10, EventBuffer.COALESCE)
+        buf.put(event('UPDATE_FILE_SIZE 1001 2012-01-01T00:00:00 100'))
+        buf.put(event('REC_STARTED'))
+        buf.put(event('UPDATE_FILE_SIZE 1002 2012-01-01T00:00:00 100'))
+        buf.put(event('UPDATE_FILE_SIZE 1001 2012-01-01T00:00:00 200'))
+        self.assertEqual(self.drain(buf),
+                [event('UPDATE_FILE_SIZE 1001 2012-01-01T00:00:00 200'),
+                 event('REC_STARTED'),
+                 event('UPDATE_FILE_SIZE 1002 2012-01-01T00:00:00 100')])
+        self.assertEqual(buf.getStats()['coalesced'], 1)
+
+    def test_coalesce_after_get(self):
+        buf = EventBuffer(10, EventBuffer.COALESCE)
+        first = event('UPDATE_FILE_SIZE 1001 2012-01-01T00:00:00 100')
+        second = event('UPDATE_FILE_SIZE 1001 2012-01-01T00:00:00 200')
+        buf.put(first)
+        self.assertEqual(buf.get_nowait(), first)
+        buf.put(second)
+        self.assertEqual(self.drain(buf), [second])
+
+    def test_coalesce_overflow_drops_oldest(self):
+        buf = EventBuffer(2, EventBuffer.COALESCE)
+        for name in ('A', 'B', 'C'):
+            buf.put(event(name))
+        self.assertEqual(self.drain(buf), [event('B'), event('C')])
+        self.assertEqual(buf.getStats()['dropped'], 1)
+
+    def test_block(self):
+        buf = EventBuffer(1, EventBuffer.BLOCK)
+        buf.put('0')
+        t = Thread(target=buf.put, args=('1',))
+        t.start()
+        sleep(0.1)
+        self.assertTrue(t.is_alive())
+        self.assertEqual(buf.get_nowait(), '0')
+        t.join(5.0)
+        self.assertFalse(t.is_alive())
+        self.assertEqual(self.drain(buf), ['1'])
+        stats = buf.getStats()
+        self.assertEqual(stats['dropped'], 0)
+        self.assertTrue(stats['blocked'] > 0)
+
+    def test_block_released_on_close(self):
+        buf = EventBuffer(1, EventBuffer.BLOCK)
+        buf.put('0')
+        t = Thread(target=buf.put, args=('1',))
+        t.start()
+        sleep(0.1)
+        buf.close()
+        t.join(5.0)
+        self.assertFalse(t.is_alive())
+
+    def test_get_timeout(self):
+        buf = EventBuffer()
+        self.assertRaises(Queue.Empty, buf.get_nowait)
+        start = time()
+        self.assertRaises(Queue.Empty, buf.get, True, 0.1)
+        self.assertTrue(time()-start >= 0.1)
+
+    def test_replay(self):
+        buf = EventBuffer(2, EventBuffer.DROP_OLDEST, replaysize=3)
+        seqs = [buf.put(str(i)) for i in range(5)]
+        self.assertEqual(seqs, [1, 2, 3, 4, 5])
+        self.assertEqual(buf.lastSequence(), 5)
+        # dropped events remain in the replay window
+        self.assertEqual([h[2] for h in buf.replay()], ['2', '3', '4'])
+        self.assertEqual([h[0] for h in buf.replay(since=3)], [4, 5])
+        self.assertEqual(buf.replay(window=-1), [])
+
+    def test_configure_replaysize(self):
+        buf = EventBuffer(replaysize=4)
+        for i in range(4):
+            buf.put(str(i))
+        buf.configure(replaysize=2)
+        self.assertEqual([h[2] for h in buf.replay()], ['2', '3'])
+
+class EventRouter( BEEventConnection ):
+    # only the handler table, without a backend connection
+    def __init__(self):
+        self._regevents = weakref.WeakValueDictionary()
+        self._regversion = 0
+        self._dispatch = None
+        self._handlerstats = {}
+        self._replayskip = {}
+        self._statslock = Lock()
+        self._funcs = []
+
+    def __del__(self):
+        pass
+
+    def add(self, pattern, flags=0):
+        def func(event): pass
+        self._funcs.append(func)
+        regex = re.compile(pattern, flags)
+        self._regevents[regex] = func
+        self._regversion += 1
+        return regex
+
+    def route(self, body):
+        return set([regex for regex,func in self._handlers(event(body))])
+
+class TestEventRouting( unittest.TestCase ):
+    def name(self, pattern):
+        return BEEventConnection._eventname(pattern)
+
+    def test_eventname(self):
+        prefix = 'BACKEND_MESSAGE\[\]:\[\]'
+        self.assertEqual(self.name(prefix+'REC_STARTED '), 'REC_STARTED')
+        self.assertEqual(self.name(prefix+'SYSTEM_EVENT (.*)'),
+                         'SYSTEM_EVENT')
+        self.assertEqual(self.name(prefix+'DOWNLOAD_FILE UPDATE'),
+                         'DOWNLOAD_FILE')
+        self.assertEqual(self.name(prefix+'LIVETV_CHAIN\[\]:\[\]'),
+                         'LIVETV_CHAIN')
+
+    def test_eventname_unrestricted(self):
+        prefix = 'BACKEND_MESSAGE\[\]:\[\]'
+        self.assertEqual(self.name('BACKEND_MESSAGE'), None)
+        self.assertEqual(self.name(prefix), None)
+        # also matches longer names, such as REC_STARTED_WRITING
+        self.assertEqual(self.name(prefix+'REC_STARTED'), None)
+        self.assertEqual(self.name(prefix+'REC_.*'), None)
+        self.assertEqual(self.name(prefix+'REC_STARTED?'), None)
+        self.assertEqual(self.name('.*REC_STARTED'), None)
+
+    def test_eventname_alternation(self):
+        prefix = 'BACKEND_MESSAGE\[\]:\[\]'
+        self.assertEqual(self.name(prefix+'REC_STARTED|.*REC_FINISHED'),
+                         None)
+        self.assertEqual(self.name(prefix+'REC_STARTED [a|b]'),
+                         'REC_STARTED')
+        self.assertEqual(self.name(prefix+'REC_STARTED (a|b)'),
+                         'REC_STARTED')
+        self.assertEqual(self.name(prefix+'REC_STARTED \|'),
+                         'REC_STARTED')
+        self.assertEqual(self.name(prefix+'REC_STARTED []|]'),
+                         'REC_STARTED')
+
+    def test_routing(self):
+        router = EventRouter()
+        started = router.add('BACKEND_MESSAGE\[\]:\[\]REC_STARTED ')
+        prefixed = router.add('BACKEND_MESSAGE\[\]:\[\]REC_STARTED')
+        system = router.add('BACKEND_MESSAGE\[\]:\[\]SYSTEM_EVENT .*')
+        anything = router.add('BACKEND_MESSAGE')
+        self.assertEqual(router.route('REC_STARTED 1001'),
+                         set([started, prefixed, anything]))
+        self.assertEqual(router.route('REC_STARTED_WRITING 1001'),
+                         set([prefixed, anything]))
+        self.assertEqual(router.route('SYSTEM_EVENT CLIENT_CONNECTED'),
+                         set([system, anything]))
+        self.assertEqual(router.route('REC_FINISHED'), set([anything]))
+
+    def test_routing_alternation(self):
+        router = EventRouter()
+        either = router.add('BACKEND_MESSAGE\[\]:\[\]REC_STARTED|'
+                            'BACKEND_MESSAGE\[\]:\[\]REC_FINISHED')
+        self.assertEqual(router.route('REC_STARTED'), set([either]))
+        self.assertEqual(router.route('REC_FINISHED'), set([either]))
+        self.assertEqual(router.route('REC_DELETED'), set())
+
+    def test_routing_ignorecase(self):
+        router = EventRouter()
+        started = router.add('BACKEND_MESSAGE\[\]:\[\]rec_started', re.I)
+        self.assertEqual(router.route('REC_STARTED'), set([started]))
+
+    def test_routing_updates(self):
+        router = EventRouter()
+        router.add('BACKEND_MESSAGE\[\]:\[\]REC_STARTED')
+        self.assertEqual(len(router.route('REC_STARTED')), 1)
+        del router._funcs[:]
+        self.assertEqual(router.route('REC_STARTED'), set())
+        finished = router.add('BACKEND_MESSAGE\[\]:\[\]REC_FINISHED')
+        self.assertEqual(router.route('REC_FINISHED'), set([finished]))
+
+if __name__ == '__main__':
+    unittest.main()
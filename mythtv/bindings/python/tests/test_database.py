@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#------------------------------
+# tests/test_database.py
+# Description: Tests of keyset paging SQL and referenced data lists,
+#              run against a fake database connection
+#------------------------------
+
+from MythTV import database
+from MythTV.database import DBDataRef
+from MythTV.utility import databaseSearch
+
+from itertools import product
+import unittest
+import re
+
+class FakeDB( object ):
+    # stands in for both the connection and its cursor
+    tablefields = {'recordedmarkup':['chanid','starttime','mark','type'],
+                   'recordedrating':['chanid','starttime','system','rating']}
+    def __init__(self):
+        self.executed = []
+    def __enter__(self):
+        return self
+    def __exit__(self, type, value, traceback):
+        pass
+    def execute(self, sql, args=None):
+        self.executed.append((' '.join(sql.split()), args))
+    def executemany(self, sql, args):
+        self.executed.append((' '.join(sql.split()), list(args)))
+
+class Handler( object ):
+    _key = ['recordedid']
+    @classmethod
+    def _setClassDefs(cls, db=None):
+        pass
+
+@databaseSearch
+def searchRecorded(self, init=False, key=None, value=None):
+    if init:
+        init.table = 'recorded'
+        init.handler = Handler
+        return None
+    if key in ('title', 'chanid'):
+        return ('recorded.%s=?' % key, value, 0)
+
+class TestKeysetPaging( unittest.TestCase ):
+    def setUp(self):
+        self.search = searchRecorded
+        self.search.querycache.clear()
+        self.search.inst = None
+
+    def test_where_single(self):
+        self.assertEqual(self.search._keysetwhere([('t.a', False)]), 't.a>?')
+        self.assertEqual(self.search._keysetwhere([('t.a', True)]), 't.a<?')
+
+    def test_where_nested(self):
+        self.assertEqual(self.search._keysetwhere(
+                            [('t.a', False), ('t.b', True), ('t.c', False)]),
+                         '(t.a>=? AND (t.a>? OR '
+                                '(t.b<=? AND (t.b<? OR t.c>?))))')
+
+    def test_parse_order(self):
+        self.assertEqual(self.search.parseOrder('title,-starttime'),
+                         [('recorded.title', False),
+                          ('recorded.starttime', True),
+                          ('recorded.recordedid', True)])
+        self.assertEqual(self.search.parseOrder(None, True),
+                         [('recorded.recordedid', False)])
+        self.assertRaises(database.MythDBError,
+                          self.search.parseOrder, 'title;DROP')
+
+    def test_compile_query(self):
+        query, args = self.search.compileQuery({'title':'News'},
+                                order='-starttime', limit=10,
+                                after=('2012-01-01 00:00:00', 5))
+        self.assertEqual(query,
+                'SELECT recorded.* FROM recorded  '
+                'WHERE recorded.title=? AND '
+                '(recorded.starttime<=? AND (recorded.starttime<? OR '
+                    'recorded.recordedid<?)) '
+                'ORDER BY recorded.starttime DESC, recorded.recordedid DESC '
+                'LIMIT ?')
+        self.assertEqual(args, ['News', '2012-01-01 00:00:00',
+                                '2012-01-01 00:00:00', 5, 10])
+
+    def test_compile_query_cached(self):
+        first = self.search.compileQuery({'title':'A'}, order='title',
+                                         after=('A', 1))
+        second = self.search.compileQuery({'title':'B'}, order='title',
+                                          after=('B', 2))
+        self.assertEqual(first[0], second[0])
+        self.assertEqual(second[1], ['B', 'B', 'B', 2])
+        self.assertEqual(len(self.search.querycache), 1)
+
+    def test_after_object(self):
+        order = self.search.parseOrder('title')
+        after = {'title':'News', 'recordedid':7}
+        self.assertEqual(self.search._keysetvalues(order, after),
+                         ['News', 7])
+        self.assertRaises(database.MythDBError,
+                          self.search._keysetvalues, order, {'title':'News'})
+        self.assertRaises(database.MythDBError,
+                          self.search._keysetvalues, order, ('News',))
+
+    def evaluate(self, where, order, row, after):
+        # evaluate the generated SQL against one row in python
+        values = iter(after[i] for i in range(len(order))
+                               for j in range(1 if i == len(order)-1 else 2))
+        expr = where.replace('AND', 'and').replace('OR', 'or')
+        expr = re.sub(r'\?', lambda m: repr(next(values)), expr)
+        for i, (field, desc) in enumerate(order):
+            expr = expr.replace(field, repr(row[i]))
+        return eval(expr)
+
+    def test_where_matches_sort_order(self):
+        for desc in product((False, True), repeat=3):
+            order = zip(('t.a', 't.b', 't.c'), desc)
+            where = self.search._keysetwhere(order)
+            rows = list(product(range(3), repeat=3))
+            def key(row):
+                return [-v if d else v for v,d in zip(row, desc)]
+            for after in rows:
+                expected = [row for row in rows if key(row) > key(after)]
+                found = [row for row in rows
+                            if self.evaluate(where, order, row, after)]
+                self.assertEqual(sorted(found), sorted(expected))
+
+class Markup( DBDataRef ):
+    _table = 'recordedmarkup'
+    _ref = ['chanid','starttime']
+
+class Rating( DBDataRef ):
+    _table = 'recordedrating'
+    _ref = ['chanid','starttime']
+
+class TestDBDataRef( unittest.TestCase ):
+    def setUp(self):
+        self._dbcache = database.DBCache
+        database.DBCache = lambda db=None: db
+        self.db = FakeDB()
+
+    def tearDown(self):
+        database.DBCache = self._dbcache
+
+    def make(self, cls, rows):
+        ref = cls((1001, '2012-01-01 00:00:00'), db=self.db)
+        ref._populate(data=rows)
+        return ref
+
+    def entry(self, cls, *data):
+        return cls.SubData(zip(cls._datfields, data))
+
+    def test_contains(self):
+        ref = self.make(Markup, [(0, 4), (100, 5)])
+        self.assertTrue(self.entry(Markup, 0, 4) in ref)
+        self.assertFalse(self.entry(Markup, 0, 5) in ref)
+
+    def test_append_delete(self):
+        ref = self.make(Markup, [(0, 4)])
+        ref.append(0, 4)
+        self.assertEqual(len(ref), 1)
+        ref.append(100, 5)
+        self.assertEqual(len(ref), 2)
+        self.assertTrue(self.entry(Markup, 100, 5) in ref)
+        ref.delete(0, 4)
+        self.assertFalse(self.entry(Markup, 0, 4) in ref)
+        self.assertRaises(ValueError, ref.delete, 0, 4)
+
+    def test_modified_in_place(self):
+        ref = self.make(Markup, [(0, 4), (100, 5)])
+        self.assertTrue(self.entry(Markup, 0, 4) in ref)
+        ref[0]['mark'] = 50
+        self.assertFalse(self.entry(Markup, 0, 4) in ref)
+        self.assertTrue(self.entry(Markup, 50, 4) in ref)
+
+    def test_generation_per_class(self):
+        markup = self.make(Markup, [(0, 4)])
+        rating = self.make(Rating, [('MPAA', 'PG')])
+        self.assertTrue(self.entry(Markup, 0, 4) in markup)
+        index = markup._index
+        rating[0]['rating'] = 'R'
+        self.assertTrue(self.entry(Markup, 0, 4) in markup)
+        self.assertTrue(markup._index is index)
+
+    def test_set_operations(self):
+        ours = self.make(Markup, [(0, 4), (100, 5), (200, 4)])
+        theirs = self.make(Markup, [(100, 5), (300, 5)])
+        self.assertEqual(sorted(sd.values() for sd in ours^theirs),
+                         [[0, 4], [200, 4], [300, 5]])
+        self.assertEqual([sd.values() for sd in ours&theirs], [[100, 5]])
+        self.assertEqual([sd.values() for sd in ours&[]], [])
+
+    def test_commit_diff(self):
+        ref = self.make(Markup, [(0, 4), (100, 5), (200, 4)])
+        ref.delete(100, 5)
+        ref.append(300, 5)
+        ref.commit()
+        self.assertEqual(self.db.executed, [
+            ('DELETE FROM recordedmarkup WHERE chanid=? AND starttime=? '
+                                              'AND mark=? AND type=?',
+             [1001, '2012-01-01 00:00:00', 100, 5]),
+            ('INSERT INTO recordedmarkup (chanid,starttime,mark,type) '
+                                              'VALUES(?,?,?,?)',
+             [[1001, '2012-01-01 00:00:00', 300, 5]])])
+        self.db.executed = []
+        ref.commit()
+        self.assertEqual(self.db.executed, [])
+
+    def test_commit_replace(self):
+        ref = self.make(Markup, [(0, 4), (100, 5)])
+        ref.delete(0, 4)
+        ref.commit(replace=True)
+        self.assertEqual(self.db.executed, [
+            ('START TRANSACTION', None),
+            ('DELETE FROM recordedmarkup WHERE chanid=? AND starttime=?',
+             (1001, '2012-01-01 00:00:00')),
+            ('INSERT INTO recordedmarkup (chanid,starttime,mark,type) '
+                                              'VALUES(?,?,?,?)',
+             [[1001, '2012-01-01 00:00:00', 100, 5]])])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+#------------------------------
+# tests/test_dt.py
+# Description: Tests of timezone transition lookups, checked against
+#              a linear scan of the transition table
+#------------------------------
+
+from MythTV.utility.dt import basetzinfo, posixtzinfo
+from MythTV.exceptions import MythTZError
+
+from datetime import datetime, timedelta
+import unittest
+import time
+import os
+
+EPOCH = datetime(1970, 1, 1)
+
+def todt(secs):
+    return EPOCH + timedelta(seconds=secs)
+
+class FixedTZ( basetzinfo ):
+    # local mean time with an offset in seconds, followed by
+    # alternating standard and daylight time
+    def __init__(self):
+        transitions = []
+        for t, offset, abbrev, isdst in ((0,        -17762, 'LMT', False),
+                                         (1000000,  -18000, 'EST', False),
+                                         (5000000,  -14400, 'EDT', True),
+                                         (20000000, -18000, 'EST', False),
+                                         (40000000, -14400, 'EDT', True)):
+            transitions.append(self._Transition(t, time.gmtime(t),
+                                    time.gmtime(t+offset), offset,
+                                    abbrev, isdst))
+        self._transitions = tuple(transitions)
+
+def linear_utc(tz, secs):
+    # last transition at or before a UTC time
+    found = None
+    for i, t in enumerate(tz._transitions):
+        if t.time <= secs:
+            found = i
+    return found
+
+def linear_local(tz, secs):
+    # transitions whose span contains the UTC time the local time maps to
+    transitions = tz._transitions
+    found = []
+    for i, t in enumerate(transitions):
+        end = None
+        if i+1 < len(transitions):
+            end = transitions[i+1].time
+        if (t.time <= secs-t.offset) and ((end is None) or \
+                                          (secs-t.offset < end)):
+            found.append(i)
+    if found:
+        # repeated times take the earlier transition
+        return found[0]
+    # skipped times take the later transition
+    for i, t in enumerate(transitions):
+        if secs-t.offset < t.time:
+            return i if i else None
+
+class TestTransitionLookup( unittest.TestCase ):
+    def setUp(self):
+        self.tz = FixedTZ()
+
+    def points(self, tz):
+        bounds = set()
+        for i, t in enumerate(tz._transitions):
+            bounds.add(t.time+t.offset)
+            if i:
+                bounds.add(t.time+tz._transitions[i-1].offset)
+        for bound in sorted(bounds):
+            for delta in range(-4000, 4001):
+                yield bound+delta
+
+    def test_local_matches_linear(self):
+        tz = self.tz
+        for secs in self.points(tz):
+            expected = linear_local(tz, secs)
+            tz._last = 0
+            if expected is None:
+                self.assertRaises(MythTZError, tz.utcoffset, todt(secs))
+                continue
+            self.assertEqual(tz.utcoffset(todt(secs)),
+                             timedelta(0, tz._transitions[expected].offset),
+                             'local time %d' % secs)
+
+    def test_utc_matches_linear(self):
+        tz = self.tz
+        tz._get_transition(todt(0))
+        for secs in self.points(tz):
+            expected = linear_utc(tz, secs)
+            if expected is None:
+                self.assertRaises(MythTZError,
+                                  tz._get_utc_transition, todt(secs))
+                continue
+            self.assertTrue(tz._get_utc_transition(todt(secs)) is \
+                                tz._transitions[expected],
+                            'utc time %d' % secs)
+
+    def test_seconds_offset(self):
+        # clocks went back 238 seconds at the end of local mean time
+        tz = self.tz
+        end = 1000000-17762
+        self.assertEqual(tz.tzname(todt(end-239)), 'LMT')
+        self.assertEqual(tz.tzname(todt(end-1)), 'LMT')
+        self.assertEqual(tz.tzname(todt(end)), 'EST')
+
+    def test_repeated_time(self):
+        tz = self.tz
+        local = todt(20000000-18000+1800)
+        self.assertEqual(tz.tzname(local), 'EDT')
+        later = todt(20000000+1800).replace(tzinfo=tz)
+        self.assertEqual(tz.fromutc(later).replace(tzinfo=None), local)
+        self.assertEqual(tz.tzname(local), 'EST')
+
+    def test_skipped_time(self):
+        tz = self.tz
+        self.assertEqual(tz.tzname(todt(5000000-18000+1800)), 'EDT')
+
+    def test_beyond_final(self):
+        tz = self.tz
+        self.assertEqual(tz.tzname(todt(10**10)), 'EDT')
+        self.assertEqual(tz._get_utc_transition(todt(10**10)).abbrev, 'EDT')
+
+    def test_before_first(self):
+        tz = self.tz
+        self.assertRaises(MythTZError, tz.utcoffset, todt(-100000))
+        self.assertRaises(MythTZError, tz._get_utc_transition,
+                          todt(-100000))
+
+    @unittest.skipUnless(os.path.exists('/usr/share/zoneinfo/America/New_York'),
+                         'zoneinfo not available')
+    def test_zoneinfo_round_trip(self):
+        tz = posixtzinfo('America/New_York')
+        tz._get_transition(todt(0))
+        for i in range(1, len(tz._transitions)):
+            for secs in (tz._transitions[i].time-1, tz._transitions[i].time):
+                expected = tz._transitions[linear_utc(tz, secs)]
+                utc = todt(secs).replace(tzinfo=tz)
+                local = tz.fromutc(utc)
+                self.assertEqual(local.replace(tzinfo=None),
+                                 todt(secs+expected.offset))
+                # the transition just used is preferred for repeated times
+                self.assertEqual(tz.utcoffset(local.replace(tzinfo=None)),
+                                 timedelta(0, expected.offset))
+
+if __name__ == '__main__':
+    unittest.main()